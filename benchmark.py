@@ -0,0 +1,215 @@
+#!python3
+# coding = utf-8
+
+import sys
+import time
+import random
+import argparse
+import subprocess
+
+"""
+性能测试.
+
+import: 用 `python -X importtime` 测量 CLI 路径的 import 时间，超出预算或者 import 了 GUI 模块时返回 1，
+        可以在提交前运行，防止启动时间退化。
+color:  vcp_color.solve_gains() 批量计算 N 台显示器的白点增益的时间。
+alloc:  用 tracemalloc 统计每次调用的内存分配: 解析 caps string、PhyMonitor.read_vcp_code() (模拟的显示器)，
+        Windows 上还有 Win32Backend.get_vcp_feature() (第一台显示器)。每次调用分配的内存 (临时分配的峰值) 超过
+        这一项的预算，或者调用之后保留的内存块达到预算时返回 1。
+"""
+
+# CLI 路径 import monitor_ctrl 的时间预算 (微秒，取多次运行的最小值)
+IMPORT_BUDGET_US = 50000
+# CLI 路径不应该 import 的模块
+IMPORT_FORBIDDEN = ('tkinter', 'tkinter.ttk', 'tkui', 'json')
+# 白点计算的时间预算 (毫秒, 500 台显示器, NumPy)
+COLOR_BUDGET_MS = 5
+# 每次调用之后保留的内存块数的预算 (缓存填满之后不应该增长)
+ALLOC_RETAINED_BUDGET = 0.01
+# 每次调用分配的内存的预算 (字节, 一次调用中临时分配的峰值, 包括返回值)
+ALLOC_PEAK_BUDGET = {
+    'parse_vcp_caps': 4096,
+    'read_vcp_code': 1024,
+    'get_vcp_feature': 512,
+}
+
+
+def measure_import(module: str) -> dict:
+    """
+    在新的解释器中 import 模块，解析 -X importtime 的输出
+    :param module: 模块名
+    :return: {module_name: cumulative_us}
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError('import {} failed:\n{}'.format(module, proc.stderr))
+
+    result = {}
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:'):
+            continue
+        try:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            result[name.strip()] = int(cumulative)
+        except ValueError:
+            # header line
+            continue
+    return result
+
+
+def bench_import(module: str, runs: int, budget_us: int) -> bool:
+    """
+    :param module:
+    :param runs: 运行次数
+    :param budget_us: 预算
+    :return: 是否通过
+    """
+    samples = [measure_import(module) for _ in range(runs)]
+    best = min(i[module] for i in samples)
+    print('import {}: best {} us of {} runs (budget {} us)'.format(module, best, runs, budget_us))
+
+    passed = True
+    if best > budget_us:
+        print('FAIL: import time exceeds budget')
+        passed = False
+
+    # 最慢的几个模块
+    slowest = sorted(samples[0].items(), key=lambda i: i[1], reverse=True)[1:6]
+    for name, cumulative in slowest:
+        print('  {:>8} us  {}'.format(cumulative, name))
+
+    forbidden = [i for i in IMPORT_FORBIDDEN if i in samples[0]]
+    if forbidden:
+        print('FAIL: CLI path imports {}'.format(', '.join(forbidden)))
+        passed = False
+    return passed
+
+
+def bench_color(count: int, runs: int, budget_ms: float) -> bool:
+    """
+    :param count: 显示器数量, 每台的色度坐标在 sRGB 附近随机偏移
+    :param runs: 运行次数
+    :param budget_ms: 预算
+    :return: 是否通过
+    """
+    import vcp_color
+
+    rand = random.Random(0)
+    primaries = [[[x + rand.uniform(-0.01, 0.01), y + rand.uniform(-0.01, 0.01)]
+                  for x, y in (vcp_color.SRGB_PRIMARIES[i] for i in ('red', 'green', 'blue', 'white'))]
+                 for _ in range(count)]
+    channel_max = [(100, 100, 100)] * count
+    target = vcp_color.cct_to_xy(6500)
+
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        vcp_color.solve_gains(primaries, target, channel_max)
+        samples.append((time.perf_counter() - started) * 1000)
+    best = min(samples)
+    print('solve_gains x{}: best {:.3f} ms of {} runs (budget {} ms, numpy: {})'.format(
+        count, best, runs, budget_ms, vcp_color.np is not None))
+    if vcp_color.np is None:
+        print('NumPy is not installed, budget not checked')
+        return True
+    if best > budget_ms:
+        print('FAIL: exceeds budget')
+        return False
+    return True
+
+
+def count_allocations(func, calls: int) -> tuple:
+    """
+    :param func: 无参数的函数, 先调用一次填满缓存和缓冲区
+    :param calls: 调用次数
+    :return: (每次调用之后保留的内存块数, 一次调用中临时分配的峰值字节数)
+    """
+    import tracemalloc
+
+    func()
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot().filter_traces(ignore)
+        for _ in range(calls):
+            func()
+        after = tracemalloc.take_snapshot().filter_traces(ignore)
+        retained = sum(max(0, i.count_diff) for i in after.compare_to(before, 'lineno'))
+        del before, after
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return retained / calls, peak
+
+
+def bench_alloc(calls: int, budget: float) -> bool:
+    """
+    :param calls: 每项的调用次数
+    :param budget: 每次调用之后保留的内存块数的预算, 达到预算即失败
+    :return: 是否通过
+    """
+    import vcp
+    import vcp_trace
+
+    backend = vcp_trace.SimulatedBackend(1)
+    monitor = vcp.PhyMonitor(backend.enumerate_monitors()[0], backend)
+    caps = vcp_trace.SIMULATED_CAPS
+    # (名称, 函数, 每次调用分配的内存的预算)
+    cases = [
+        ('parse_vcp_caps(str)', lambda: vcp.parse_vcp_caps(caps), ALLOC_PEAK_BUDGET['parse_vcp_caps']),
+        ('parse_vcp_caps(memoryview)', lambda buffer=memoryview(caps.encode('ascii')): vcp.parse_vcp_caps(buffer),
+         ALLOC_PEAK_BUDGET['parse_vcp_caps']),
+        ('PhyMonitor.read_vcp_code (simulated)', lambda: monitor.read_vcp_code(0x10),
+         ALLOC_PEAK_BUDGET['read_vcp_code']),
+    ]
+    if sys.platform == 'win32':
+        win32 = vcp.Win32Backend()
+        handles = win32.enumerate_monitors()
+        if handles:
+            handle = handles[0].hPhysicalMonitor
+            cases.append(('Win32Backend.get_vcp_feature', lambda: win32.get_vcp_feature(handle, 0x10),
+                          ALLOC_PEAK_BUDGET['get_vcp_feature']))
+    else:
+        print('not on Windows, Win32Backend not measured')
+
+    passed = True
+    for name, func, peak_budget in cases:
+        retained, peak = count_allocations(func, calls)
+        print('{}: {:.3f} blocks retained per call, {} bytes peak per call'.format(name, retained, peak))
+        if retained >= budget:
+            print('FAIL: {} retains memory (budget {} blocks per call)'.format(name, budget))
+            passed = False
+        if peak > peak_budget:
+            print('FAIL: {} allocates {} bytes per call (budget {} bytes)'.format(name, peak, peak_budget))
+            passed = False
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='monitor_ctrl benchmarks')
+    sub_parsers = parser.add_subparsers(dest='bench')
+    import_parser = sub_parsers.add_parser('import', help='CLI 路径的 import 时间')
+    import_parser.add_argument('-m', default='monitor_ctrl', help='要测量的模块')
+    import_parser.add_argument('-n', type=int, default=5, help='运行次数')
+    import_parser.add_argument('--budget', type=int, default=IMPORT_BUDGET_US, help='预算 (us)')
+    color_parser = sub_parsers.add_parser('color', help='白点增益的批量计算时间')
+    color_parser.add_argument('-c', type=int, default=500, help='显示器数量')
+    color_parser.add_argument('-n', type=int, default=20, help='运行次数')
+    color_parser.add_argument('--budget', type=float, default=COLOR_BUDGET_MS, help='预算 (ms)')
+    alloc_parser = sub_parsers.add_parser('alloc', help='每次 DDC/CI 调用的内存分配 (tracemalloc)')
+    alloc_parser.add_argument('-n', type=int, default=2000, help='调用次数')
+    alloc_parser.add_argument('--budget', type=float, default=ALLOC_RETAINED_BUDGET, help='每次调用保留的内存块数')
+    opts = parser.parse_args()
+
+    if opts.bench == 'import':
+        sys.exit(0 if bench_import(opts.m, opts.n, opts.budget) else 1)
+    if opts.bench == 'color':
+        sys.exit(0 if bench_color(opts.c, opts.n, opts.budget) else 1)
+    if opts.bench == 'alloc':
+        sys.exit(0 if bench_alloc(opts.n, opts.budget) else 1)
+    parser.print_help()
@@ -3,16 +3,13 @@
 
 import os
 import sys
+import time
 import logging
 import argparse
 import vcp
-
-try:
-    import tkinter
-    from tkinter import ttk
-    TK_IMPORTED = True
-except ImportError:
-    TK_IMPORTED = False
+import vcp_code
+import vcp_quirks
+import vcp_profile
 
 
 __VERSION__ = '1.0'
@@ -20,6 +17,10 @@ __APP_NAME__ = 'monitor_ctrl'
 __LOGGING_FORMAT = "%(levelname)s:[%(filename)s:%(lineno)s-%(funcName)s()] %(message)s"
 
 DEFAULT_LOGFILE_PATH = os.path.join(os.environ.get('TEMP', './'), __APP_NAME__, 'log.txt')
+# 各型号写入校验的统计，用来跳过已知可靠的显示器的校验
+DEFAULT_VERIFY_STATS_PATH = os.path.join(os.environ.get('TEMP', './'), __APP_NAME__, 'verify_stats.json')
+# 每台显示器的 EEPROM 写入次数
+DEFAULT_WRITE_COUNTERS_PATH = os.path.join(os.environ.get('TEMP', './'), __APP_NAME__, 'write_counters.json')
 _LOGGER = logging.getLogger(__name__)
 
 # -s 参数的分隔符，设置RGB_GAIN的地方需要 eval() 用户输入，使用 [](),等作为分割符会出错
@@ -29,7 +30,12 @@ ARG_SPLITTER = ':'
 APP_OPTIONS = {
     'console': False,
     'setting_values': {},
-    'log_file': DEFAULT_LOGFILE_PATH
+    'log_file': DEFAULT_LOGFILE_PATH,
+    'verify_policy': None,
+    'quirks_file': None,
+    'log_json': None,
+    'verify_stats_file': DEFAULT_VERIFY_STATS_PATH,
+    'write_counters_file': DEFAULT_WRITE_COUNTERS_PATH,
 }
 
 # Win32 _PhysicalMonitorStructure
@@ -38,6 +44,36 @@ ALL_MONITORS = []
 ALL_PHY_MONITORS = []
 
 
+def tk_available() -> bool:
+    """
+    检查 tkinter 是否可用. 只查找模块不 import，GUI 启动时才 import tkinter
+    :return:
+    """
+    import importlib.util
+    
+    try:
+        return all(importlib.util.find_spec(i) is not None for i in ('_tkinter', 'tkinter'))
+    except (ImportError, ValueError):
+        return False
+
+
+def white_point_arg(text: str) -> dict:
+    """
+    --white-point 参数: 色温或者 x,y
+    :param text:
+    :return: vcp_color.calibrate() 的参数 {'cct': K} / {'xy': (x, y)}
+    """
+    import vcp_color
+    
+    try:
+        if ',' in text:
+            return {'xy': vcp_color.parse_xy(text)}
+        vcp_color.cct_to_xy(float(text))
+        return {'cct': float(text)}
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+
 def parse_arg():
     """
     Parse command line arguments.
@@ -53,17 +89,120 @@ def parse_arg():
     parser.add_argument('-c', action='store_true', default=False, help='不启用GUI')
     parser.add_argument('-l', action='store_true', help='显示可操作的显示器model')
     parser.add_argument('-v', action='store_true', help='Verbose logging')
+    parser.add_argument('--overview', action='store_true', default=False,
+                        help='GUI 使用概览表格 (显示器多于 8 台时默认使用)')
+    parser.add_argument('--verify', action='store', choices=vcp.VERIFY_POLICIES, default=None,
+                        help='写入后读回校验: always 每次校验, sampled 抽样校验, never 不校验. '
+                             '默认使用 quirks 中的设置或 {}'.format(vcp.DEFAULT_VERIFY_POLICY))
+    parser.add_argument('--timeout', action='store', type=float, default=None, metavar='SECONDS',
+                        help='每次 DDC/CI 调用的超时, 读取 caps 为 {} 倍. 超时的显示器被标记为 degraded, '
+                             '之后的操作跳过它直到健康检查通过. 默认不限制'.format(vcp.CAPS_TIMEOUT_FACTOR))
+    parser.add_argument('--health', action='store_true', default=False,
+                        help='检查每台显示器是否响应, 输出断路器状态和读写失败次数 (JSON lines)')
+    parser.add_argument('--write-budget', action='store', type=int, default=0, metavar='N',
+                        help='每台显示器每天最多写入 N 次会保存到 EEPROM 的设置 (颜色预设/菜单语言等), 默认不限制')
+    parser.add_argument('--wear-report', action='store_true', default=False,
+                        help='输出每台显示器累计的 EEPROM 写入次数和估计的剩余寿命 (JSON lines)')
+    parser.add_argument('--log-json', action='store', type=str, default=None, metavar='FILE',
+                        help='输出 JSON lines 格式的结构化日志到 FILE ("-" 为 stderr), 包含每次 VCP 调用的耗时和结果')
+    parser.add_argument('--sync-brightness', action='store', type=float, default=None, metavar='LEVEL',
+                        help='按照各型号的亮度校准曲线，同时设置所有显示器的感知亮度 (0-100)')
+    parser.add_argument('--switch-input', action='store', type=str, default=None, metavar='SRC',
+                        help='同时切换所有显示器的输入源, SRC 为 input_src_list 中的名称')
+    parser.add_argument('--switch-wait', action='store', type=float, default=0, metavar='SECONDS',
+                        help='切换输入源后等待显示器锁定新信号的最长时间, 0 不等待')
+    parser.add_argument('--volume', action='store', type=int, default=None, metavar='N',
+                        help='同时把所有有扬声器的显示器的音量逐步调整到 N, 每台显示器输出一行 JSON')
+    parser.add_argument('--volume-ramp', action='store', type=float, default=1.0, metavar='SECONDS',
+                        help='--volume 的调整时间, 默认 1 秒, 0 直接设置')
+    parser.add_argument('--mute', action='store', choices=tuple(vcp_code.AUDIO_MUTE_CODE), default=None,
+                        help='同时设置所有有扬声器的显示器的静音, 和 --volume 一起使用时先取消静音再调整音量, 或者调整后再静音')
+    parser.add_argument('--power', action='store', choices=tuple(vcp_code.POWER_MODE_CODE), default=None,
+                        help='错开时间并行开关所有显示器, 每台显示器输出一行 JSON 时间线')
+    parser.add_argument('--power-stagger', action='store', type=float, default=0.5, metavar='SECONDS',
+                        help='--power: 相邻两台显示器开始写入的间隔')
+    parser.add_argument('--power-concurrency', action='store', type=int, default=4, metavar='N',
+                        help='--power: 同时写入的显示器数')
+    parser.add_argument('--white-point', action='store', type=white_point_arg, default=None, metavar='CCT|X,Y',
+                        help='根据各型号的面板色度坐标计算并设置 RGB 增益, 如 6500 或 0.3127,0.3290')
+    parser.add_argument('--batch', action='store', type=str, default=None, metavar='FILE',
+                        help='执行批处理脚本 (set/get/wait/sleep/assert), 不同显示器并行执行')
+    parser.add_argument('--inventory', action='store', choices=('csv', 'json'), default=None,
+                        help='输出显示器资产清单 (EDID, 序列号, 开机小时数, 固件版本等)')
+    parser.add_argument('--inventory-base', action='store', type=str, default=None, metavar='FILE',
+                        help='增量模式: 上一次 --inventory json 的输出, 已知的显示器只重新读取开机小时数')
+    parser.add_argument('--query', action='store', type=str, default=None, metavar='EXPR',
+                        help='读取所有显示器的状态, 输出满足条件的显示器, 如 "brightness > 80 and power_mode == on"')
+    parser.add_argument('--watch', action='store', type=str, nargs='?', const='', default=None, metavar='KEYS',
+                        help='检测显示器设置的变化并输出 JSON lines, KEYS: 逗号分隔的 VCP 功能名称, 如 "Luminance,Input Source"')
+    parser.add_argument('--watch-interval', action='store', type=float, default=1.0, metavar='SECONDS',
+                        help='检测变化的轮询间隔')
+    parser.add_argument('--record-trace', action='store', type=str, default=None, metavar='FILE',
+                        help='把所有 DDC/CI 调用的参数、结果和耗时录制到 FILE (JSON lines)')
+    parser.add_argument('--replay', action='store', type=str, default=None, metavar='FILE',
+                        help='不访问显示器, 从 --record-trace 录制的 FILE 回放')
+    parser.add_argument('--simulate', action='store', type=int, default=None, metavar='N',
+                        help='不访问显示器, 使用 N 台模拟的显示器 (测试用)')
+    parser.add_argument('--serve', action='store', type=str, default=None, metavar='[HOST:]PORT',
+                        help='启动 HTTP/JSON 控制接口, 默认只监听 127.0.0.1')
+    parser.add_argument('--token', action='store', type=str, default=None,
+                        help='--serve 要求客户端提供的 token, 或者 --agents 发送给 agent 的 token')
+    parser.add_argument('--agents', action='store', type=str, default=None, metavar='HOST:PORT,...|@FILE',
+                        help='控制端模式: 把 -s 设置发送到这些主机的 agent (--serve), 不访问本机显示器')
+    parser.add_argument('--agent-timeout', action='store', type=float, default=5.0, metavar='SECONDS',
+                        help='每个 agent 请求的超时(秒), 默认 5')
+    parser.add_argument('--agent-concurrency', action='store', type=int, default=32, metavar='N',
+                        help='同时请求的 agent 数, 默认 32')
+    parser.add_argument('--trace', action='store', type=str, default=None, metavar='FILE',
+                        help='记录枚举、读取 caps、每个属性和每次 DDC/CI 调用的耗时, 退出时保存到 FILE. '
+                             '.folded/.txt 为火焰图的 folded stacks, 其它为 Chrome trace JSON')
+    parser.add_argument('--quirks', action='store', type=str, default=None, metavar='FILE',
+                        help='载入额外的显示器 quirks (JSON)')
     opts = parser.parse_args()
     
     global APP_OPTIONS
     APP_OPTIONS['apply_to_model'] = opts.m
     APP_OPTIONS['list_monitors'] = opts.l
+    APP_OPTIONS['overview'] = opts.overview
     APP_OPTIONS['setting_value_string'] = opts.s
     APP_OPTIONS['restore_factory'] = opts.r
     APP_OPTIONS['perform_auto_setup'] = opts.t
+    APP_OPTIONS['verify_policy'] = opts.verify
+    APP_OPTIONS['call_timeout'] = opts.timeout
+    APP_OPTIONS['health'] = opts.health
+    APP_OPTIONS['write_budget'] = opts.write_budget
+    APP_OPTIONS['wear_report'] = opts.wear_report
+    APP_OPTIONS['quirks_file'] = opts.quirks
+    APP_OPTIONS['record_trace'] = opts.record_trace
+    APP_OPTIONS['replay_trace'] = opts.replay
+    APP_OPTIONS['simulate'] = opts.simulate
+    APP_OPTIONS['serve'] = opts.serve
+    APP_OPTIONS['token'] = opts.token
+    APP_OPTIONS['agents'] = opts.agents
+    APP_OPTIONS['agent_timeout'] = opts.agent_timeout
+    APP_OPTIONS['agent_concurrency'] = opts.agent_concurrency
+    APP_OPTIONS['log_json'] = opts.log_json
+    APP_OPTIONS['trace_file'] = opts.trace
+    APP_OPTIONS['sync_brightness'] = opts.sync_brightness
+    APP_OPTIONS['switch_input'] = opts.switch_input
+    APP_OPTIONS['switch_wait'] = opts.switch_wait
+    APP_OPTIONS['volume'] = opts.volume
+    APP_OPTIONS['volume_ramp'] = opts.volume_ramp
+    APP_OPTIONS['mute'] = opts.mute
+    APP_OPTIONS['power'] = opts.power
+    APP_OPTIONS['power_stagger'] = opts.power_stagger
+    APP_OPTIONS['power_concurrency'] = opts.power_concurrency
+    APP_OPTIONS['white_point'] = opts.white_point
+    APP_OPTIONS['batch_file'] = opts.batch
+    APP_OPTIONS['inventory_format'] = opts.inventory
+    APP_OPTIONS['inventory_base'] = opts.inventory_base
+    APP_OPTIONS['watch_codes'] = opts.watch
+    APP_OPTIONS['query'] = opts.query
+    APP_OPTIONS['watch_interval'] = opts.watch_interval
     
-    # if specified -c argument or tkinter not imported
-    if opts.c or (not TK_IMPORTED):
+    # if specified -c argument or tkinter not available
+    APP_OPTIONS['tk_missing'] = (not opts.c) and (not tk_available())
+    if opts.c or APP_OPTIONS['tk_missing']:
         APP_OPTIONS['console'] = True
         # log to console
         APP_OPTIONS['log_file'] = None
@@ -88,20 +227,23 @@ def set_monitor_attr(object_, attr_name, value) -> bool:
     :return:
     """
     try:
-        # convert value type.
-        value_type = type(getattr(object_, attr_name))
+        # convert value type. 已知类型的属性不需要先读取一次
+        value_type = vcp.PROPERTY_TYPES.get(attr_name)
+        if value_type is None:
+            with vcp_profile.span('get ' + attr_name):
+                value_type = type(getattr(object_, attr_name))
         if value_type in (list, tuple):
-            _LOGGER.debug('eval(): ' + value)
+            _LOGGER.debug('eval(): %s', value)
             value = eval(value)
         if value_type in (str, int):
             value = value_type(value)
         
-        setattr(object_, attr_name, value)
-        _LOGGER.info('OK: {}={}'.format(attr_name, value))
+        with vcp_profile.span('set ' + attr_name, value=value):
+            setattr(object_, attr_name, value)
+        _LOGGER.info('OK: %s=%s', attr_name, value)
         return True
     except Exception as err:
-        _LOGGER.error('Failed: {}={}'.format(attr_name, value))
-        _LOGGER.error(err)
+        _LOGGER.error('Failed: %s=%s: %s', attr_name, value, err)
         return False
 
 
@@ -112,16 +254,43 @@ def enum_monitors():
     """
     global ALL_PHY_MONITORS
     global ALL_MONITORS
-    ALL_MONITORS = vcp.enumerate_monitors()
+    vcp.set_default_timeout(APP_OPTIONS.get('call_timeout'))
+    if APP_OPTIONS.get('quirks_file'):
+        try:
+            vcp_quirks.load_quirks(APP_OPTIONS.get('quirks_file'))
+        except (OSError, ValueError) as err:
+            _LOGGER.error('Failed to load quirks: %s', err)
+    if APP_OPTIONS.get('replay_trace') or APP_OPTIONS.get('record_trace') or APP_OPTIONS.get('simulate'):
+        import vcp_trace
+        if APP_OPTIONS.get('simulate'):
+            vcp.set_backend(vcp_trace.SimulatedBackend(APP_OPTIONS.get('simulate')))
+        elif APP_OPTIONS.get('replay_trace'):
+            vcp.set_backend(vcp_trace.ReplayBackend(APP_OPTIONS.get('replay_trace')))
+        if APP_OPTIONS.get('record_trace'):
+            vcp.set_backend(vcp_trace.TraceRecorder(vcp.default_backend(), APP_OPTIONS.get('record_trace')))
+    if real_monitors():
+        vcp.load_verify_stats(APP_OPTIONS.get('verify_stats_file'))
+        vcp.set_write_budget(write_budget())
+    else:
+        # 模拟/回放的显示器: 预算只在内存中计数, 不读写真实显示器的统计
+        vcp.set_write_budget(write_budget(persistent=False))
+    with vcp_profile.span('enumerate'):
+        ALL_MONITORS = vcp.default_backend().enumerate_monitors()
     for i in ALL_MONITORS:
         try:
-            monitor = vcp.PhyMonitor(i)
+            with vcp_profile.span('probe'):
+                monitor = vcp.PhyMonitor(i)
         except OSError as err:
             _LOGGER.error(err)
             # ignore this monitor
             continue
-        _LOGGER.info('Found monitor: ' + monitor.model)
+        if APP_OPTIONS.get('verify_policy'):
+            monitor.verify_policy = APP_OPTIONS.get('verify_policy')
+        _LOGGER.info('Found monitor: %s', monitor.model)
         ALL_PHY_MONITORS.append(monitor)
+    if vcp.get_write_budget() is not None:
+        # 没有序列号的显示器按枚举顺序编号
+        vcp.get_write_budget().identify(ALL_PHY_MONITORS)
 
 
 def parse_settings():
@@ -138,49 +307,146 @@ def parse_settings():
             property_, value = setting.strip().split('=')
             settings_dict[property_] = value
         except ValueError:
-            _LOGGER.error('Failed to parse setting: ' + setting)
+            _LOGGER.error('Failed to parse setting: %s', setting)
             continue
     APP_OPTIONS['setting_values'] = settings_dict
-    _LOGGER.debug('setting properties: {}'.format(APP_OPTIONS.get('setting_values')))
+    _LOGGER.debug('setting properties: %s', APP_OPTIONS.get('setting_values'))
 
 
-def apply_all_settings():
+def target_monitors() -> list:
     """
-    应用命令行指定的操作.
-    :return:
+    过滤不需要操作的显示器
+    :return: -m 指定的型号的显示器
     """
-    # 过滤不需要操作的显示器
     target_monitor = []
     target_model = APP_OPTIONS.get('apply_to_model', '*').upper()
     
     if target_model == '*':
-        target_monitor = ALL_PHY_MONITORS
-    else:
-        for i in ALL_PHY_MONITORS:
-            if i.model.upper() == target_model:
-                target_monitor.append(i)
-            else:
-                _LOGGER.debug('Will NOT apply settings to model: ' + i.model)
-    
-    for monitor in target_monitor:
+        return list(ALL_PHY_MONITORS)
+    for i in ALL_PHY_MONITORS:
+        if i.model.upper() == target_model:
+            target_monitor.append(i)
+        else:
+            _LOGGER.debug('Will NOT apply settings to model: %s', i.model)
+    return target_monitor
+
+
+def apply_all_settings():
+    """
+    应用命令行指定的操作.
+    :return:
+    """
+    for monitor in target_monitors():
+        if not monitor.check_health():
+            _LOGGER.error('%s: skipped, monitor is unavailable: %s', monitor.model,
+                          monitor.degraded_reason or 'circuit open')
+            continue
+        
         if APP_OPTIONS.get('restore_factory'):
-            _LOGGER.info('{}: Reset monitor to factory settings.'.format(monitor.model))
+            _LOGGER.info('%s: Reset monitor to factory settings.', monitor.model)
             monitor.reset_factory()
         
         if APP_OPTIONS.get('perform_auto_setup'):
-            _LOGGER.info('{}: Perform video auto-setup.'.format(monitor.model))
+            _LOGGER.info('%s: Perform video auto-setup.', monitor.model)
             monitor.auto_setup_perform()
         
-        _LOGGER.info('apply settings to: ' + monitor.model)
+        _LOGGER.info('apply settings to: %s', monitor.model)
         settings = APP_OPTIONS.get('setting_values')
-        for i in settings.keys():
-            set_monitor_attr(monitor, i, settings.get(i))
+        with vcp_profile.span('apply', monitor=monitor.monitor_id):
+            for i in settings.keys():
+                if not monitor.available:
+                    # 连续失败后断路器断开, 剩下的设置不再等待超时
+                    _LOGGER.error('%s: remaining settings skipped, monitor is unavailable: %s', monitor.model,
+                                  monitor.degraded_reason or 'circuit open')
+                    break
+                set_monitor_attr(monitor, i, settings.get(i))
+
+
+def print_health() -> bool:
+    """
+    检查每台显示器 (读取 VCP Version), 每台显示器输出一行 JSON 健康状态
+    :return: 是否全部正常
+    """
+    import json
+    import vcp_fleet
+    
+    result = vcp_fleet.run_parallel(lambda m: m.probe(), target_monitors(), skip_degraded=False)
+    for monitor, _, _ in result:
+        print(json.dumps(dict(monitor.health_stats, monitor=monitor.monitor_id), ensure_ascii=False))
+    return all(ok for _, ok, _ in result)
+
+
+def real_monitors() -> bool:
+    """
+    当前的 backend 是否访问真实的显示器 (Win32Backend, 或者记录 trace 的 Win32Backend)
+    --simulate / --replay 的显示器不保存写入次数和校验统计
+    :return:
+    """
+    backend = vcp.default_backend()
+    backend = getattr(backend, 'backend', backend)
+    return isinstance(backend, vcp.Win32Backend)
+
+
+def write_budget(persistent: bool = True):
+    """
+    :param persistent: False 只在内存中计数, 不读写 write_counters_file
+    :return: 记录 EEPROM 写入次数的 vcp_wear.WriteBudget, --write-budget 限制每天的次数
+    """
+    import vcp_wear
+    
+    return vcp_wear.WriteBudget(APP_OPTIONS.get('write_counters_file') if persistent else None,
+                                daily_budget=APP_OPTIONS.get('write_budget'))
+
+
+def print_wear_report():
+    """
+    每台显示器输出一行 JSON
+    :return:
+    """
+    import json
+    
+    for record in write_budget().report():
+        print(json.dumps(record, ensure_ascii=False))
+
+
+def save_verify_stats():
+    """
+    保存写入校验的统计和 EEPROM 写入次数, 在 debug 日志中输出合并的调用次数
+    :return:
+    """
+    for i in ALL_PHY_MONITORS:
+        _LOGGER.debug('%s: call stats: %s', i.monitor_id, i.dedup_stats)
+        _LOGGER.debug('%s: health: %s', i.monitor_id, i.health_stats)
+    if not real_monitors():
+        return
+    path = APP_OPTIONS.get('verify_stats_file')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    vcp.save_verify_stats(path)
+    if vcp.get_write_budget() is not None:
+        vcp.get_write_budget().save()
+
+
+def save_trace():
+    """
+    保存 --trace 记录的 spans
+    :return:
+    """
+    tracer = vcp_profile.disable()
+    if tracer is None:
+        return
+    try:
+        tracer.save(APP_OPTIONS.get('trace_file'))
+    except OSError as err:
+        _LOGGER.error('Failed to save trace: %s', err)
 
 
 def start_gui():
     import tkui
     import threading
+    import vcp_worker
     
+    # GUI 的操作在每台显示器的工作线程中执行, 优先于后台任务
+    pool = vcp_worker.WorkerPool()
     app = tkui.TkApp()
     app.title(__APP_NAME__)
     app.status_text_var.set('正在检测显示器...')
@@ -190,13 +456,260 @@ def start_gui():
         enum_monitors()
         _LOGGER.info('start GUI, ignore command line actions.')
         app.status_text_var.set('')
-        app.add_monitors_to_tab(ALL_PHY_MONITORS)
+        if APP_OPTIONS.get('overview') or len(ALL_PHY_MONITORS) > tkui.OVERVIEW_MIN_MONITORS:
+            # 只读取可见的行, 选中多行一起设置
+            app.add_monitors_overview(ALL_PHY_MONITORS, pool)
+        else:
+            app.add_monitors_to_tab([pool.worker(i).proxy(vcp_worker.PRIORITY_INTERACTIVE)
+                                     for i in ALL_PHY_MONITORS])
     
     threading.Thread(target=background_task, daemon=True).start()
     app.mainloop()
+    _LOGGER.debug('worker stats: %s', pool.stats())
+    pool.stop(timeout=5)
+    save_verify_stats()
+
+
+def watch_monitors():
+    """
+    检测显示器设置的变化，每个变化输出一行 JSON 到 stdout，直到 Ctrl-C
+    :return:
+    """
+    import json
+    import vcp_watch
+    
+    codes = [i.strip() for i in APP_OPTIONS.get('watch_codes').split(',') if i.strip()]
+    watcher = vcp_watch.MonitorWatcher(target_monitors(), codes or vcp_watch.DEFAULT_WATCH_CODES,
+                                       interval=APP_OPTIONS.get('watch_interval'))
+    watcher.subscribe(lambda event: print(json.dumps(event, ensure_ascii=False), flush=True))
+    watcher.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+def run_batch() -> bool:
+    """
+    执行批处理脚本，每台显示器的结果输出一行 JSON 到 stdout
+    :return: 是否全部成功
+    """
+    import json
+    import vcp_batch
+    
+    try:
+        steps = vcp_batch.parse_file(APP_OPTIONS.get('batch_file'))
+    except (OSError, ValueError) as err:
+        _LOGGER.error('Failed to load batch file: %s', err)
+        return False
+    
+    reports = vcp_batch.BatchRunner(steps).run(target_monitors())
+    for report in reports:
+        print(json.dumps(report, ensure_ascii=False, default=str), flush=True)
+    return all(i['ok'] for i in reports)
+
+
+def print_inventory() -> bool:
+    """
+    输出显示器资产清单到 stdout
+    :return: 是否所有显示器都读取成功
+    """
+    import vcp_inventory
+    
+    previous = None
+    if APP_OPTIONS.get('inventory_base'):
+        try:
+            previous = vcp_inventory.load_json(APP_OPTIONS.get('inventory_base'))
+        except (OSError, ValueError) as err:
+            _LOGGER.warning('Failed to load inventory base, full sweep: %s', err)
+    
+    records = vcp_inventory.collect(target_monitors(), previous)
+    if APP_OPTIONS.get('inventory_format') == 'csv':
+        vcp_inventory.to_csv(records, sys.stdout)
+    else:
+        vcp_inventory.to_json(records, sys.stdout)
+    return not any(i.get('error') for i in records)
+
+
+def query_state() -> bool:
+    """
+    输出满足 --query 条件的显示器的状态, 每台显示器一行 JSON
+    :return: 条件是否有效
+    """
+    import json
+    import vcp_state
+    
+    try:
+        conditions = vcp_state.parse_query(APP_OPTIONS.get('query'))
+    except ValueError as err:
+        _LOGGER.error(err)
+        return False
+    table = vcp_state.FleetTable()
+    table.refresh(target_monitors())
+    try:
+        states = table.query(conditions)
+    except ValueError as err:
+        _LOGGER.error(err)
+        return False
+    for state in states:
+        print(json.dumps(state.to_dict(), ensure_ascii=False))
+    return True
+
+
+def control_agents() -> bool:
+    """
+    控制端模式: 把 -s 的设置发送到所有 agent, 没有 -s 时列出所有 agent 的显示器。每台显示器输出一行 JSON
+    :return: 是否全部成功
+    """
+    import json
+    import vcp_batch
+    import vcp_controller
+    
+    try:
+        agents = vcp_controller.load_agents(APP_OPTIONS.get('agents'))
+    except OSError as err:
+        _LOGGER.error('Failed to load agents: %s', err)
+        return False
+    controller = vcp_controller.FleetController(agents, timeout=APP_OPTIONS.get('agent_timeout'),
+                                                max_concurrent=APP_OPTIONS.get('agent_concurrency'),
+                                                token=APP_OPTIONS.get('token'))
+    ok = True
+    failed = 0
+    try:
+        # -m 按型号过滤时先列出每个 agent 的显示器
+        target_model = APP_OPTIONS.get('apply_to_model', '*').upper()
+        settings = APP_OPTIONS.get('setting_values') or None
+        if settings is None or target_model != '*':
+            listed = controller.list_monitors()
+            for report in listed.values():
+                if report['ok']:
+                    report['result'] = {i['monitor']: {'model': i['model']} for i in report['result']
+                                        if target_model == '*' or i['model'].upper() == target_model}
+            monitors = {agent: list(report['result']) for agent, report in listed.items() if report['ok']}
+        if settings is None:
+            result = listed
+        else:
+            try:
+                settings = {k: vcp_batch.convert_value(k, v) for k, v in settings.items()}
+            except (ValueError, SyntaxError) as err:
+                _LOGGER.error('invalid setting: %s', err)
+                return False
+            if target_model == '*':
+                result = controller.bulk(set_=settings)
+            else:
+                # 列出显示器失败的 agent 也要报告
+                result = {agent: report for agent, report in listed.items() if not report['ok']}
+                result.update(controller.bulk(set_=settings, monitors=monitors))
+        
+        for agent, report in result.items():
+            if not report['ok']:
+                ok = False
+                _LOGGER.error(report['error'])
+                print(json.dumps({'agent': agent, 'ok': False, 'error': report['error']}, ensure_ascii=False))
+                continue
+            for monitor_id, record in report['result'].items():
+                if not isinstance(record, dict):
+                    # 旧版本的 agent 对 degraded / 断路器断开的显示器返回 null
+                    record = {'set': {}, 'get': {}, 'errors': {'*': 'no result from agent'}}
+                errors = record.get('errors') or {}
+                record_ok = not errors and all(record.get('set', {}).values())
+                if not record_ok:
+                    failed += 1
+                print(json.dumps(dict(record, agent=agent, monitor=monitor_id, ok=record_ok),
+                                 ensure_ascii=False))
+        if failed:
+            ok = False
+            _LOGGER.error('%s monitor(s) failed', failed)
+        _LOGGER.debug('agent stats: %s', controller.stats())
+    finally:
+        controller.close()
+    return ok
+
+
+def switch_input() -> bool:
+    """
+    切换输入源, 每台显示器输出一行 JSON
+    :return: 是否全部成功
+    """
+    import json
+    import vcp_fleet
+    
+    wait = APP_OPTIONS.get('switch_wait') or 0
+    try:
+        result = vcp_fleet.switch_input(target_monitors(), APP_OPTIONS.get('switch_input'), wait=wait)
+    except ValueError as err:
+        _LOGGER.error(err)
+        return False
+    for monitor_id, report in result.items():
+        print(json.dumps(dict(report, monitor=monitor_id), ensure_ascii=False))
+    return all(i['ok'] and i['locked'] is not False for i in result.values())
+
+
+def set_power() -> bool:
+    """
+    错开时间开关显示器, 每台显示器输出一行 JSON 时间线
+    :return: 是否全部确认
+    """
+    import json
+    import vcp_power
+    
+    orchestrator = vcp_power.PowerOrchestrator(target_monitors(), stagger=APP_OPTIONS.get('power_stagger'),
+                                               max_concurrent=APP_OPTIONS.get('power_concurrency'))
+    result = orchestrator.set(APP_OPTIONS.get('power'))
+    for monitor_id, record in result.items():
+        print(json.dumps(dict(record, monitor=monitor_id), ensure_ascii=False))
+    return all(i['ok'] for i in result.values())
+
+
+def set_audio() -> bool:
+    """
+    设置所有显示器的静音和音量, 每台显示器每个操作输出一行 JSON
+    :return: 是否全部成功
+    """
+    import json
+    import vcp_audio
+    
+    monitors = target_monitors()
+    results = []
+    if APP_OPTIONS.get('mute') == 'off':
+        results.append(('unmute', vcp_audio.set_mute(monitors, False)))
+    if APP_OPTIONS.get('volume') is not None:
+        results.append(('volume', vcp_audio.ramp_volume(monitors, APP_OPTIONS.get('volume'),
+                                                        duration=APP_OPTIONS.get('volume_ramp'))))
+    if APP_OPTIONS.get('mute') == 'on':
+        results.append(('mute', vcp_audio.set_mute(monitors, True)))
+    ok = True
+    for op, result in results:
+        for monitor_id, record in result.items():
+            print(json.dumps(dict(record, monitor=monitor_id, op=op), ensure_ascii=False))
+            ok = ok and record['ok']
+    return ok
+
+
+def calibrate_white_point() -> bool:
+    """
+    设置所有显示器的白点, 每台显示器输出一行 JSON
+    :return: 是否全部成功
+    """
+    import json
+    import vcp_color
+    
+    # white_point_arg() 已经检查过
+    result = vcp_color.calibrate(target_monitors(), **APP_OPTIONS.get('white_point'))
+    for monitor_id, record in result.items():
+        print(json.dumps(dict(record, monitor=monitor_id), ensure_ascii=False))
+    return all(i['ok'] for i in result.values())
 
 
 def start_cli():
+    if APP_OPTIONS.get('wear_report'):
+        print_wear_report()
+        sys.exit(0)
+    
+    if APP_OPTIONS.get('agents'):
+        sys.exit(0 if control_agents() else 1)
+    
     enum_monitors()
     
     if APP_OPTIONS.get('list_monitors'):
@@ -204,7 +717,82 @@ def start_cli():
             print(i.model)
         sys.exit(0)
     
+    if APP_OPTIONS.get('inventory_format'):
+        sys.exit(0 if print_inventory() else 1)
+    
+    if APP_OPTIONS.get('query'):
+        sys.exit(0 if query_state() else 1)
+    
+    if APP_OPTIONS.get('health'):
+        sys.exit(0 if print_health() else 1)
+    
     apply_all_settings()
+    
+    if APP_OPTIONS.get('switch_input') and not switch_input():
+        save_verify_stats()
+        sys.exit(1)
+    
+    if (APP_OPTIONS.get('volume') is not None or APP_OPTIONS.get('mute')) and not set_audio():
+        save_verify_stats()
+        sys.exit(1)
+    
+    if APP_OPTIONS.get('power') and not set_power():
+        save_verify_stats()
+        sys.exit(1)
+    
+    if APP_OPTIONS.get('white_point') and not calibrate_white_point():
+        save_verify_stats()
+        sys.exit(1)
+    
+    if APP_OPTIONS.get('batch_file') and not run_batch():
+        save_verify_stats()
+        sys.exit(1)
+    
+    if APP_OPTIONS.get('sync_brightness') is not None:
+        import vcp_fleet
+        result = vcp_fleet.BrightnessGroup(target_monitors()).set(APP_OPTIONS.get('sync_brightness'))
+        for monitor_id, raw in result.items():
+            if raw is False:
+                _LOGGER.error('%s: brightness failed', monitor_id)
+            else:
+                _LOGGER.info('%s: brightness %s', monitor_id, 'unchanged' if raw is None else raw)
+        if not all(raw is not False for raw in result.values()):
+            save_verify_stats()
+            sys.exit(1)
+    save_verify_stats()
+    
+    if APP_OPTIONS.get('watch_codes') is not None:
+        watch_monitors()
+    
+    if APP_OPTIONS.get('serve'):
+        import vcp_http
+        host, _, port = APP_OPTIONS.get('serve').rpartition(':')
+        vcp_http.serve(target_monitors(), host or vcp_http.DEFAULT_HOST, int(port), token=APP_OPTIONS.get('token'))
+
+
+def has_cli_action() -> bool:
+    """
+    命令行是否指定了需要执行的操作
+    :return:
+    """
+    return (APP_OPTIONS.get('setting_value_string') is not None
+            or APP_OPTIONS.get('restore_factory')
+            or APP_OPTIONS.get('list_monitors')
+            or APP_OPTIONS.get('perform_auto_setup')
+            or APP_OPTIONS.get('sync_brightness') is not None
+            or APP_OPTIONS.get('inventory_format')
+            or APP_OPTIONS.get('batch_file')
+            or APP_OPTIONS.get('switch_input')
+            or APP_OPTIONS.get('power')
+            or APP_OPTIONS.get('volume') is not None
+            or APP_OPTIONS.get('mute')
+            or APP_OPTIONS.get('white_point')
+            or APP_OPTIONS.get('serve')
+            or APP_OPTIONS.get('query')
+            or APP_OPTIONS.get('agents')
+            or APP_OPTIONS.get('wear_report')
+            or APP_OPTIONS.get('health')
+            or APP_OPTIONS.get('watch_codes') is not None)
 
 
 if __name__ == '__main__':
@@ -218,17 +806,18 @@ if __name__ == '__main__':
                         level=APP_OPTIONS['log_level'],
                         format=__LOGGING_FORMAT)
     
-    if not TK_IMPORTED:
+    # 结构化日志使用单独的 handler，和上面的设置互不影响
+    if APP_OPTIONS.get('log_json'):
+        import vcp_log
+        vcp_log.setup_structured_logging(APP_OPTIONS.get('log_json'))
+    
+    if APP_OPTIONS.get('tk_missing'):
         _LOGGER.warning('Failed to import tkinter, force console mode.')
     
     _LOGGER.debug('parse args done. current config:')
     _LOGGER.debug(APP_OPTIONS)
     
-    if APP_OPTIONS.get('console') and \
-            (APP_OPTIONS.get('setting_value_string') is None) \
-            and (not APP_OPTIONS.get('restore_factory')) \
-            and (not APP_OPTIONS.get('list_monitors')) \
-            and (not APP_OPTIONS.get('perform_auto_setup')):
+    if APP_OPTIONS.get('console') and not has_cli_action():
         # Nothing to do.
         _LOGGER.warning('Nothing todo. exit.')
         sys.exit(0)
@@ -237,7 +826,16 @@ if __name__ == '__main__':
     if APP_OPTIONS.get('setting_value_string'):
         parse_settings()
     
-    if APP_OPTIONS.get('console'):
-        start_cli()
-    else:
-        start_gui()
+    if APP_OPTIONS.get('trace_file'):
+        vcp_profile.enable()
+    try:
+        if APP_OPTIONS.get('console'):
+            start_cli()
+        else:
+            try:
+                start_gui()
+            except ImportError as import_err:
+                _LOGGER.warning('Failed to import tkinter, force console mode: %s', import_err)
+                start_cli()
+    finally:
+        save_trace()
@@ -0,0 +1,223 @@
+# coding = utf-8
+
+import time
+import logging
+import threading
+import unittest
+import vcp
+import vcp_code
+import vcp_health
+import vcp_trace
+import vcp_wear
+
+"""
+PhyMonitor 在模拟的显示器 (vcp_trace.SimulatedBackend) 上的行为.
+
+    python -m unittest test_vcp
+"""
+
+
+def simulated_monitor(latency: float = 0.0, backend=None) -> vcp.PhyMonitor:
+    backend = backend or vcp_trace.SimulatedBackend(1, latency=latency)
+    return vcp.PhyMonitor(backend.enumerate_monitors()[0], backend)
+
+
+class CallTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_deadline_does_not_degrade(self):
+        monitor = simulated_monitor(latency=0.05)
+        monitor.call_timeout = 1.0
+        with vcp.Deadline(0.06):
+            self.assertEqual(monitor.read_vcp_code(0x10), (50, 100))
+            # 只剩下 ~10ms: 这次调用超过了调用者的截止时间
+            self.assertEqual(monitor.read_vcp_code(0x12), (0, 0))
+        self.assertFalse(monitor.degraded)
+        self.assertEqual(monitor.health.state, vcp_health.CLOSED)
+        self.assertEqual(monitor.health.stats()['failures'], 0)
+        # 上一次调用返回之后可以继续使用
+        time.sleep(0.06)
+        self.assertEqual(monitor.read_vcp_code(0x12), (70, 100))
+
+    def test_call_timeout_degrades(self):
+        monitor = simulated_monitor(latency=0.05)
+        monitor.call_timeout = 0.01
+        self.assertEqual(monitor.read_vcp_code(0x10), (0, 0))
+        self.assertTrue(monitor.degraded)
+        self.assertEqual(monitor.health.state, vcp_health.OPEN)
+
+    def test_expired_deadline(self):
+        monitor = simulated_monitor()
+        with vcp.Deadline(0):
+            self.assertEqual(monitor.read_vcp_code(0x10), (0, 0))
+        self.assertFalse(monitor.degraded)
+
+
+class _CountingBackend(vcp_trace.SimulatedBackend):
+    """
+    记录总线调用; gate 被清除时 get_vcp_feature 等待, 模拟占用总线的调用
+    """
+    def __init__(self, *args, **kwargs):
+        super(_CountingBackend, self).__init__(*args, **kwargs)
+        self.calls = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.blocked = threading.Event()
+
+    def get_vcp_feature(self, handle, code: int):
+        self.calls.append(('get', code))
+        if not self.gate.is_set():
+            self.blocked.set()
+            self.gate.wait(5)
+        return super(_CountingBackend, self).get_vcp_feature(handle, code)
+
+    def set_vcp_feature(self, handle, code: int, value: int) -> bool:
+        self.calls.append(('set', code, value))
+        return super(_CountingBackend, self).set_vcp_feature(handle, code, value)
+
+
+def run_threads(funcs: list, stagger: float = 0.0) -> list:
+    results = [None] * len(funcs)
+
+    def run(index):
+        results[index] = funcs[index]()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(funcs))]
+    for thread in threads:
+        thread.start()
+        time.sleep(stagger)
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self._budget = vcp.get_write_budget()
+        vcp.set_write_budget(None)
+        self.backend = _CountingBackend(1)
+        self.monitor = simulated_monitor(backend=self.backend)
+        self.monitor.verify_policy = vcp.VERIFY_NEVER
+        self.backend.calls.clear()
+
+    def tearDown(self):
+        self.backend.gate.set()
+        vcp.set_write_budget(self._budget)
+        logging.disable(logging.NOTSET)
+
+    def hold_bus(self) -> threading.Thread:
+        """
+        在另一个线程中开始一次读取 (0x12) 并停在总线上, 直到 self.backend.gate.set()
+        """
+        self.backend.gate.clear()
+        thread = threading.Thread(target=self.monitor.read_vcp_code, args=(0x12,))
+        thread.start()
+        self.assertTrue(self.backend.blocked.wait(5))
+        return thread
+
+    def test_concurrent_reads_share_one_call(self):
+        before = self.monitor.dedup_stats
+        self.backend.gate.clear()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.monitor.read_vcp_code(0x10)))
+                   for _ in range(8)]
+        threads[0].start()
+        self.assertTrue(self.backend.blocked.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)
+        self.backend.gate.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, [(50, 100)] * 8)
+        self.assertEqual(self.backend.calls, [('get', 0x10)])
+        stats = self.monitor.dedup_stats
+        self.assertEqual((stats['reads'] - before['reads'], stats['read_transactions'] - before['read_transactions']),
+                         (8, 1))
+        self.assertEqual(self.monitor._read_flights, {})
+
+    def test_queued_writes_last_value_wins(self):
+        holder = self.hold_bus()
+        values = [10, 20, 30, 40]
+        funcs = [lambda v=v: self.monitor.send_vcp_code(0x10, v) for v in values]
+
+        def release():
+            time.sleep(0.2)
+            self.backend.gate.set()
+
+        threading.Thread(target=release).start()
+        results = run_threads(funcs, stagger=0.02)
+        holder.join(5)
+        self.assertEqual(results, [True] * len(values))
+        self.assertEqual([i for i in self.backend.calls if i[0] == 'set'], [('set', 0x10, 40)])
+        self.assertEqual(self.monitor.read_vcp_code(0x10), (40, 100))
+        self.assertEqual(self.monitor._write_flights, {})
+
+    def test_budget_exhausted_releases_flight(self):
+        budget = vcp_wear.WriteBudget(daily_budget=1)
+        vcp.set_write_budget(budget)
+        code = vcp_code.VCP_CODE['Select Color Preset']
+        self.assertTrue(self.monitor.send_vcp_code(code, 0x05))
+        self.assertFalse(self.monitor.send_vcp_code(code, 0x06))
+        self.assertEqual(self.monitor._write_flights, {})
+        self.assertEqual(budget.denied, 1)
+        # 之后的写入不会等待已经结束的 flight
+        vcp.set_write_budget(None)
+        self.assertTrue(self.monitor.send_vcp_code(code, 0x06))
+
+    def test_reserve_error_releases_flight(self):
+        class _Failing(vcp_wear.WriteBudget):
+            def reserve(self, phy_monitor, code):
+                raise RuntimeError('reserve failed')
+
+        vcp.set_write_budget(_Failing())
+        code = vcp_code.VCP_CODE['Select Color Preset']
+        with self.assertRaises(RuntimeError):
+            self.monitor.send_vcp_code(code, 0x05)
+        self.assertEqual(self.monitor._write_flights, {})
+        vcp.set_write_budget(None)
+        self.assertTrue(self.monitor.send_vcp_code(code, 0x05))
+
+
+class VerifyStatsTest(unittest.TestCase):
+    def setUp(self):
+        self._stats = dict(vcp.MODEL_VERIFY_STATS)
+        vcp.MODEL_VERIFY_STATS.clear()
+
+    def tearDown(self):
+        vcp.MODEL_VERIFY_STATS.clear()
+        vcp.MODEL_VERIFY_STATS.update(self._stats)
+
+    def test_concurrent_counts(self):
+        def count():
+            for _ in range(5000):
+                vcp._count_verify('P2401', 'verified')
+
+        threads = [threading.Thread(target=count) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(vcp.MODEL_VERIFY_STATS['P2401'], {'verified': 40000, 'mismatch': 0})
+
+    def test_reliable(self):
+        self.assertFalse(vcp.model_is_reliable('P2401'))
+        vcp.MODEL_VERIFY_STATS['P2401'] = {'verified': vcp.RELIABLE_VERIFY_COUNT - 1, 'mismatch': 0}
+        self.assertFalse(vcp.model_is_reliable('P2401'))
+        vcp._count_verify('P2401', 'verified')
+        self.assertTrue(vcp.model_is_reliable('P2401'))
+
+    def test_transient_mismatch(self):
+        vcp.MODEL_VERIFY_STATS['P2401'] = {'verified': 100, 'mismatch': 1}
+        self.assertTrue(vcp.model_is_reliable('P2401'))
+        vcp.MODEL_VERIFY_STATS['P2401'] = {'verified': 100, 'mismatch': 10}
+        self.assertFalse(vcp.model_is_reliable('P2401'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# coding = utf-8
+
+import unittest
+import vcp_batch
+
+"""
+vcp_batch 批处理脚本的解析.
+
+    python -m unittest test_vcp_batch
+"""
+
+
+class ParseScriptTest(unittest.TestCase):
+    def assertLineError(self, text, line):
+        with self.assertRaises(ValueError) as ctx:
+            vcp_batch.parse_script(text)
+        self.assertTrue(str(ctx.exception).startswith('line {}: '.format(line)), str(ctx.exception))
+
+    def test_valid(self):
+        steps = vcp_batch.parse_script('\n'.join([
+            '# comment',
+            'set input_src "DisplayPort 1"',
+            'wait input_src == "DisplayPort 1" timeout=10 interval=0.5',
+            'set rgb_gain (90,95,100)',
+            'set "Audio: Speaker Volume" 0x14',
+            'sleep 0.5',
+            'assert brightness >= 40',
+            'get "Display Usage Time"',
+        ]))
+        self.assertEqual([i.op for i in steps], ['set', 'wait', 'set', 'set', 'sleep', 'assert', 'get'])
+        self.assertEqual(steps[1].options, {'timeout': 10.0, 'interval': 0.5})
+        self.assertEqual(steps[2].value, (90, 95, 100))
+        self.assertEqual(steps[3].value, 0x14)
+        self.assertEqual(steps[4].value, 0.5)
+        self.assertEqual(steps[5].value, 40)
+        self.assertEqual([i.line for i in steps], [2, 3, 4, 5, 6, 7, 8])
+
+    def test_tuple_not_iterable(self):
+        self.assertLineError('get brightness\nset rgb_gain 5', 2)
+
+    def test_tuple_syntax_error(self):
+        self.assertLineError('set rgb_gain "(1,"', 1)
+
+    def test_tuple_not_integers(self):
+        self.assertLineError('set rgb_gain "(1, \'a\', 3)"', 1)
+
+    def test_int_value(self):
+        self.assertLineError('set brightness forty', 1)
+        self.assertLineError('set Luminance 4.5', 1)
+
+    def test_sleep_duration(self):
+        self.assertLineError('\nsleep x', 2)
+        self.assertLineError('sleep -1', 1)
+        self.assertLineError('sleep nan', 1)
+
+    def test_option_value(self):
+        self.assertLineError('wait brightness == 40 timeout=soon', 1)
+        self.assertLineError('wait brightness == 40 retries=3', 1)
+
+    def test_assert_options(self):
+        self.assertLineError('assert brightness == 40 timeout=1', 1)
+
+    def test_unclosed_quote(self):
+        self.assertLineError('set input_src "DisplayPort 1', 1)
+
+    def test_unknown_step(self):
+        self.assertLineError('get brightness\n\nreboot', 3)
+
+    def test_usage(self):
+        self.assertLineError('set brightness', 1)
+        self.assertLineError('wait brightness ~ 40', 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
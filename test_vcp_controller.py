@@ -0,0 +1,176 @@
+# coding = utf-8
+
+import time
+import logging
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import vcp
+import vcp_http
+import vcp_trace
+import vcp_controller
+
+"""
+vcp_controller 通过本机回环地址访问多个 agent (vcp_http + vcp_trace.SimulatedBackend).
+
+    python -m unittest test_vcp_controller
+"""
+
+
+def start_server(server) -> str:
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    return '127.0.0.1:{}'.format(server.server_address[1])
+
+
+class _CountingHandler(BaseHTTPRequestHandler):
+    """
+    记录收到的请求; delay 秒之后返回 {}; close_after 为 True 时回应之后关闭连接 (但不告诉客户端)
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format_, *args):
+        pass
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        self.server.requests.append((self.command, self.path))
+        time.sleep(self.server.delay if self.path == '/slow' else 0)
+        data = b'{}'
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except OSError:
+            return
+        self.close_connection = self.server.close_after
+
+    do_GET = do_POST = _reply
+
+
+def counting_server(delay: float = 0.0, close_after: bool = False) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _CountingHandler)
+    server.daemon_threads = True
+    server.requests = []
+    server.delay = delay
+    server.close_after = close_after
+    return server
+
+
+class FleetControllerTest(unittest.TestCase):
+    AGENTS = 3
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.servers = []
+        self.backends = []
+        agents = []
+        for i in range(self.AGENTS):
+            backend = vcp_trace.SimulatedBackend(i + 1)
+            monitors = [vcp.PhyMonitor(h, backend) for h in backend.enumerate_monitors()]
+            server = vcp_http.make_server(vcp_http.MonitorService(monitors), '127.0.0.1', 0, token='secret')
+            self.servers.append(server)
+            self.backends.append(backend)
+            agents.append(start_server(server))
+        # 没有 agent 的端口
+        dead = vcp_http.make_server(vcp_http.MonitorService([]), '127.0.0.1', 0)
+        self.dead = '127.0.0.1:{}'.format(dead.server_address[1])
+        dead.server_close()
+        self.agents = agents
+        self.controller = vcp_controller.FleetController(agents + [self.dead], timeout=2, token='secret')
+
+    def tearDown(self):
+        self.controller.close()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+            server.service.pool.stop(timeout=1)
+        logging.disable(logging.NOTSET)
+
+    def test_list_monitors(self):
+        result = self.controller.list_monitors()
+        self.assertEqual(list(result), self.agents + [self.dead])
+        for i, agent in enumerate(self.agents):
+            self.assertTrue(result[agent]['ok'], result[agent])
+            self.assertEqual(len(result[agent]['result']), i + 1)
+        self.assertFalse(result[self.dead]['ok'])
+        self.assertTrue(self.controller.clients[self.dead].is_down)
+
+    def test_bulk(self):
+        result = self.controller.bulk(set_={'brightness': 40}, get=['brightness'], max_age=0)
+        for i, agent in enumerate(self.agents):
+            self.assertTrue(result[agent]['ok'], result[agent])
+            reports = result[agent]['result']
+            self.assertEqual(len(reports), i + 1)
+            for report in reports.values():
+                self.assertEqual(report, {'set': {'brightness': True}, 'get': {'brightness': 40}, 'errors': {}})
+            for values in self.backends[i]._values.values():
+                self.assertEqual(values[0x10][0], 40)
+        self.assertFalse(result[self.dead]['ok'])
+
+    def test_bulk_selected_monitors(self):
+        monitor_id = self.controller.list_monitors()[self.agents[2]]['result'][1]['monitor']
+        result = self.controller.bulk(set_={'contrast': 10}, monitors={self.agents[2]: [monitor_id]})
+        self.assertEqual(list(result), [self.agents[2]])
+        self.assertEqual(list(result[self.agents[2]]['result']), [monitor_id])
+
+    def test_connections_reused(self):
+        for _ in range(3):
+            self.controller.fan_out('GET', '/monitors', agents=self.agents)
+        for agent in self.agents:
+            stats = self.controller.stats()[agent]
+            self.assertEqual(stats['requests'], 3)
+            self.assertEqual(stats['connects'], 1)
+            self.assertEqual(stats['reused'], 2)
+
+    def test_invalid_token(self):
+        controller = vcp_controller.FleetController(self.agents[:1], timeout=2, token='wrong')
+        try:
+            result = controller.list_monitors()[self.agents[0]]
+        finally:
+            controller.close()
+        self.assertFalse(result['ok'])
+        self.assertIn('401', result['error'])
+
+
+class AgentClientRetryTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.server = None
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        logging.disable(logging.NOTSET)
+
+    def test_stale_connection_retried(self):
+        # agent 回应之后关闭了 keep-alive 连接: 下一个请求用新的连接重试, 只执行一次
+        self.server = counting_server(close_after=True)
+        client = vcp_controller.AgentClient(start_server(self.server), timeout=2)
+        client.request('GET', '/monitors')
+        time.sleep(0.1)
+        self.assertEqual(client.request('POST', '/bulk', {}), {})
+        self.assertEqual(self.server.requests, [('GET', '/monitors'), ('POST', '/bulk')])
+        self.assertEqual(client.stats()['connects'], 2)
+        client.close()
+
+    def test_timeout_not_retried(self):
+        # 慢的 agent: 超时后不在新的连接上再发送一次
+        self.server = counting_server(delay=0.6)
+        client = vcp_controller.AgentClient(start_server(self.server), timeout=0.3)
+        client.request('GET', '/monitors')
+        started = time.monotonic()
+        with self.assertRaises(vcp_controller.AgentError):
+            client.request('POST', '/slow', {})
+        self.assertLess(time.monotonic() - started, 0.55)
+        time.sleep(0.5)
+        self.assertEqual(self.server.requests, [('GET', '/monitors'), ('POST', '/slow')])
+        self.assertFalse(client.is_down)
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+# coding = utf-8
+
+import logging
+import unittest
+from unittest import mock
+import vcp
+import vcp_health
+import vcp_trace
+
+"""
+vcp_health.CircuitBreaker 的状态转换.
+
+    python -m unittest test_vcp_health
+"""
+
+
+class _Clock(object):
+    """
+    代替 vcp_health 中的 time 模块, 手动推进 monotonic()
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = _Clock()
+        patcher = mock.patch.object(vcp_health, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = vcp_health.CircuitBreaker(failure_threshold=3, probe_interval=1.0, backoff=10.0,
+                                                 probe_interval_max=30.0)
+
+    def open_breaker(self):
+        for _ in range(self.breaker.failure_threshold):
+            self.breaker.record(False)
+        self.assertEqual(self.breaker.state, vcp_health.OPEN)
+
+    def test_opens_after_threshold(self):
+        for _ in range(self.breaker.failure_threshold - 1):
+            self.breaker.record(False)
+        self.assertEqual(self.breaker.state, vcp_health.CLOSED)
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, vcp_health.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.stats()['rejected'], 1)
+        self.assertEqual(self.breaker.stats()['opened'], 1)
+
+    def test_success_resets_consecutive_failures(self):
+        for _ in range(self.breaker.failure_threshold - 1):
+            self.breaker.record(False)
+        self.breaker.record(True)
+        for _ in range(self.breaker.failure_threshold - 1):
+            self.breaker.record(False)
+        self.assertEqual(self.breaker.state, vcp_health.CLOSED)
+
+    def test_half_open_allows_one_call(self):
+        self.open_breaker()
+        self.assertFalse(self.breaker.probe_due())
+        self.clock.now += 1.0
+        self.assertTrue(self.breaker.probe_due())
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, vcp_health.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, vcp_health.CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.stats()['recovered'], 1)
+
+    def test_backoff_capped(self):
+        self.open_breaker()
+        intervals = []
+        for _ in range(4):
+            self.clock.now += self.breaker.stats()['next_probe_in']
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(False)
+            self.assertEqual(self.breaker.state, vcp_health.OPEN)
+            intervals.append(self.breaker.stats()['next_probe_in'])
+        self.assertEqual(intervals, [10.0, 30.0, 30.0, 30.0])
+        # 恢复后间隔回到 probe_interval
+        self.clock.now += 30.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(True)
+        self.open_breaker()
+        self.assertEqual(self.breaker.stats()['next_probe_in'], 1.0)
+
+    def test_trip(self):
+        self.breaker.trip()
+        self.assertEqual(self.breaker.state, vcp_health.OPEN)
+        self.assertEqual(self.breaker.stats()['failures'], 0)
+
+
+class _FailingBackend(vcp_trace.SimulatedBackend):
+    """
+    fail 为 True 时所有读写失败
+    """
+    fail = False
+
+    def get_vcp_feature(self, handle, code: int):
+        if self.fail:
+            return self._fail('no response'), 0, 0
+        return super(_FailingBackend, self).get_vcp_feature(handle, code)
+
+
+class MonitorHealthTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.backend = _FailingBackend(1)
+        self.monitor = vcp.PhyMonitor(self.backend.enumerate_monitors()[0], self.backend)
+        self.monitor.health = vcp_health.CircuitBreaker(failure_threshold=3, probe_interval=0.0)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_unsupported_codes_not_counted(self):
+        # 0xC0 没有在 caps string 中列出
+        self.assertNotIn(0xC0, self.monitor.vcp_caps)
+        for _ in range(10):
+            self.assertEqual(self.monitor.read_vcp_code(0xC0), (0, 0))
+        stats = self.monitor.health_stats
+        self.assertEqual(stats['state'], vcp_health.CLOSED)
+        self.assertEqual(stats['failures'], 0)
+
+    def test_recovery_via_probe(self):
+        self.backend.fail = True
+        for _ in range(3):
+            self.monitor.read_vcp_code(0x10)
+        self.assertEqual(self.monitor.health.state, vcp_health.OPEN)
+        self.assertFalse(self.monitor.available)
+        self.assertFalse(self.monitor.probe())
+        self.assertEqual(self.monitor.health.state, vcp_health.OPEN)
+
+        self.backend.fail = False
+        self.assertTrue(self.monitor.check_health())
+        self.assertEqual(self.monitor.health.state, vcp_health.CLOSED)
+        self.assertTrue(self.monitor.available)
+        self.assertEqual(self.monitor.read_vcp_code(0x10), (50, 100))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# coding = utf-8
+
+import json
+import logging
+import threading
+import unittest
+from http.client import HTTPConnection
+from urllib.parse import quote
+import vcp
+import vcp_http
+import vcp_trace
+
+"""
+vcp_http 的 HTTP 接口, 通过本机回环地址访问 vcp_trace.SimulatedBackend 上的服务.
+
+    python -m unittest test_vcp_http
+"""
+
+
+class _FailingBackend(vcp_trace.SimulatedBackend):
+    """
+    读取 failing 中的 code 时失败 (显示器没有响应)
+    """
+    def __init__(self, *args, **kwargs):
+        super(_FailingBackend, self).__init__(*args, **kwargs)
+        self.failing = set()
+
+    def get_vcp_feature(self, handle, code: int):
+        if code in self.failing:
+            return self._fail('no response'), 0, 0
+        return super(_FailingBackend, self).get_vcp_feature(handle, code)
+
+
+class HttpServiceTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.backend = _FailingBackend(2)
+        monitors = [vcp.PhyMonitor(h, self.backend) for h in self.backend.enumerate_monitors()]
+        self.monitor_ids = [i.monitor_id for i in monitors]
+        self.service = vcp_http.MonitorService(monitors, max_age=60)
+        self.server = vcp_http.make_server(self.service, '127.0.0.1', 0, token='secret')
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.conn = HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=5)
+
+    def tearDown(self):
+        self.conn.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.pool.stop(timeout=1)
+        logging.disable(logging.NOTSET)
+
+    def request(self, method: str, path: str, body=None, token: str = 'secret'):
+        headers = {'Authorization': 'Bearer ' + token}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        self.conn.request(method, path, data, headers)
+        response = self.conn.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+
+    def path(self, index: int, name: str = None) -> str:
+        path = '/monitors/' + quote(self.monitor_ids[index], safe='')
+        return path if name is None else path + '/' + name
+
+    def test_list_monitors(self):
+        status, result = self.request('GET', '/monitors')
+        self.assertEqual(status, 200)
+        self.assertEqual([i['monitor'] for i in result], self.monitor_ids)
+
+    def test_get_and_set(self):
+        self.assertEqual(self.request('GET', self.path(0, 'brightness')), (200, {'value': 50}))
+        self.assertEqual(self.request('PUT', self.path(0, 'brightness'), {'value': 40}), (200, {'ok': True}))
+        # 设置之后缓存失效
+        self.assertEqual(self.request('GET', self.path(0, 'brightness')), (200, {'value': 40}))
+        self.assertEqual(self.request('GET', self.path(0, 'Luminance')), (200, {'value': 40}))
+        self.assertEqual(self.request('GET', self.path(1, 'brightness')), (200, {'value': 50}))
+
+    def test_cache(self):
+        self.request('GET', self.path(0, 'contrast'))
+        self.request('GET', self.path(0, 'contrast'))
+        self.request('GET', self.path(0, 'contrast') + '?max_age=0')
+        status, stats = self.request('GET', '/stats')
+        self.assertEqual(status, 200)
+        self.assertEqual((stats['cache']['hits'], stats['cache']['misses']), (1, 2))
+
+    def test_failed_read(self):
+        self.backend.failing.add(0x10)
+        status, result = self.request('GET', self.path(0, 'brightness'))
+        self.assertEqual(status, 502)
+        self.assertIn('0x10', result['error'])
+        # 失败的读取不缓存
+        self.backend.failing.clear()
+        self.assertEqual(self.request('GET', self.path(0, 'brightness')), (200, {'value': 50}))
+
+    def test_get_all_errors(self):
+        self.backend.failing.add(0x12)
+        status, result = self.request('GET', self.path(0))
+        self.assertEqual(status, 200)
+        self.assertEqual(set(result['values']) | set(result['errors']), set(vcp.PROPERTY_TYPES))
+        self.assertEqual(result['values']['brightness'], 50)
+        self.assertNotIn('contrast', result['values'])
+        self.assertIn('contrast', result['errors'])
+        # SIMULATED_CAPS 中没有 0x0C
+        self.assertIn('color_temperature', result['errors'])
+
+    def test_bulk(self):
+        self.backend.failing.add(0x12)
+        status, result = self.request('POST', '/bulk', {'set': {'brightness': 30}, 'get': ['brightness', 'contrast'],
+                                                        'monitors': self.monitor_ids[:1]})
+        self.assertEqual(status, 200)
+        self.assertEqual(list(result), self.monitor_ids[:1])
+        report = result[self.monitor_ids[0]]
+        self.assertEqual(report['set'], {'brightness': True})
+        self.assertEqual(report['get'], {'brightness': 30})
+        self.assertEqual(list(report['errors']), ['contrast'])
+
+    def test_errors(self):
+        self.assertEqual(self.request('GET', '/monitors', token='wrong')[0], 401)
+        self.assertEqual(self.request('GET', '/monitors/NONE%401/brightness')[0], 404)
+        self.assertEqual(self.request('GET', '/monitors/NONE%401')[0], 404)
+        self.assertEqual(self.request('GET', self.path(0, 'no_such_property'))[0], 404)
+        self.assertEqual(self.request('PUT', self.path(0, 'brightness'), {'value': 'high'})[0], 400)
+        self.assertEqual(self.request('PUT', self.path(0, 'brightness'), {'level': 1})[0], 400)
+        self.assertEqual(self.request('POST', '/bulk', {'monitors': 'all'})[0], 400)
+
+    def test_keep_alive(self):
+        self.request('GET', '/monitors')
+        sock = self.conn.sock
+        self.assertIsNotNone(sock)
+        # 返回错误之后同一个连接还可以继续使用
+        self.request('PUT', self.path(0, 'brightness'), {'value': 'high'})
+        self.request('GET', self.path(0, 'brightness'))
+        self.assertIs(self.conn.sock, sock)
+
+
+if __name__ == '__main__':
+    unittest.main()
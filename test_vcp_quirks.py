@@ -0,0 +1,97 @@
+# coding = utf-8
+
+import os
+import json
+import tempfile
+import unittest
+import vcp_quirks
+
+"""
+vcp_quirks 的 quirks 文件校验.
+
+    python -m unittest test_vcp_quirks
+"""
+
+
+class LoadQuirksTest(unittest.TestCase):
+    def setUp(self):
+        self._db = list(vcp_quirks.QUIRKS_DB)
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        vcp_quirks.QUIRKS_DB[:] = self._db
+        self._dir.cleanup()
+
+    def _load(self, content) -> int:
+        path = os.path.join(self._dir.name, 'quirks.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(content, f)
+        return vcp_quirks.load_quirks(path)
+
+    def assertRejected(self, content):
+        with self.assertRaises(ValueError):
+            self._load(content)
+        self.assertEqual(vcp_quirks.QUIRKS_DB, self._db)
+
+    def test_valid(self):
+        count = self._load([{'model': 'P2401', 'command_delay': 0.05, 'broken_codes': ['0x0C'],
+                             'channel_max': {'0x1A': 80}, 'value_remap': {'0xD6': {'0x02': 5}},
+                             'firmware': '0x102'}])
+        self.assertEqual(count, 1)
+        quirk = vcp_quirks.lookup('P2401', firmware=0x102)
+        self.assertEqual(quirk['broken_codes'], [0x0C])
+        self.assertEqual(quirk['channel_max'], {0x1A: 80})
+        self.assertEqual(quirk['value_remap'][0xD6][0x02], 5)
+
+    def test_top_level_not_list(self):
+        self.assertRejected({'model': 'P2401'})
+
+    def test_entry_not_dict(self):
+        self.assertRejected([1])
+
+    def test_missing_model(self):
+        self.assertRejected([{'command_delay': 0.05}])
+
+    def test_unknown_field(self):
+        self.assertRejected([{'model': 'P2401', 'delay': 0.05}])
+
+    def test_channel_max_list(self):
+        self.assertRejected([{'model': 'P2401', 'channel_max': [80]}])
+
+    def test_channel_max_value(self):
+        self.assertRejected([{'model': 'P2401', 'channel_max': {'0x1A': 'eighty'}}])
+        self.assertRejected([{'model': 'P2401', 'channel_max': {'0x1A': 0}}])
+
+    def test_value_remap_list(self):
+        self.assertRejected([{'model': 'P2401', 'value_remap': [[2, 5]]}])
+
+    def test_value_remap_inner_list(self):
+        self.assertRejected([{'model': 'P2401', 'value_remap': {'0xD6': [2, 5]}}])
+
+    def test_broken_codes_int(self):
+        self.assertRejected([{'model': 'P2401', 'broken_codes': 12}])
+
+    def test_broken_codes_out_of_range(self):
+        self.assertRejected([{'model': 'P2401', 'broken_codes': ['0x100']}])
+        self.assertRejected([{'model': 'P2401', 'broken_codes': [1.5]}])
+
+    def test_firmware_not_number(self):
+        self.assertRejected([{'model': 'P2401', 'firmware': 'v1'}])
+
+    def test_bad_entry_rejects_whole_file(self):
+        self.assertRejected([{'model': 'P2401'}, {'model': 'P2402', 'broken_codes': 12}])
+
+    def test_invalid_json(self):
+        path = os.path.join(self._dir.name, 'quirks.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('[{"model": ')
+        with self.assertRaises(ValueError):
+            vcp_quirks.load_quirks(path)
+
+    def test_builtin_quirks_valid(self):
+        for entry in vcp_quirks.QUIRKS_DB:
+            vcp_quirks.validate_quirk(entry)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# coding = utf-8
+
+import logging
+import unittest
+from unittest import mock
+import vcp
+import vcp_edid
+import vcp_trace
+import vcp_wear
+
+"""
+vcp_wear.WriteBudget 按 EDID 序列号区分显示器.
+
+    python -m unittest test_vcp_wear
+"""
+
+
+def _edid(serial: str) -> dict:
+    return {'manufacturer': 'DEL', 'product_code': 0xA0C4, 'serial': serial, 'serial_number': 0}
+
+
+class WriteBudgetKeyTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        backend = vcp_trace.SimulatedBackend(3)
+        self.monitors = [vcp.PhyMonitor(h, backend) for h in backend.enumerate_monitors()]
+
+    def test_serial_key(self):
+        budget = vcp_wear.WriteBudget()
+        budget.identify(self.monitors, {self.monitors[0].monitor_id: _edid('AB12'),
+                                        self.monitors[1].monitor_id: _edid('CD34')})
+        self.assertEqual(budget.key(self.monitors[0]), 'DEL-41156-AB12')
+        self.assertEqual(budget.key(self.monitors[1]), 'DEL-41156-CD34')
+        # 没有序列号时按枚举顺序编号
+        self.assertEqual(budget.key(self.monitors[2]), 'SIM2400#3')
+
+    def test_serial_key_independent_of_order(self):
+        edids = {self.monitors[0].monitor_id: _edid('AB12'), self.monitors[1].monitor_id: _edid('CD34')}
+        first = vcp_wear.WriteBudget()
+        first.identify(self.monitors[:2], edids)
+        second = vcp_wear.WriteBudget()
+        second.identify(self.monitors[1::-1], edids)
+        self.assertEqual(first.key(self.monitors[0]), second.key(self.monitors[0]))
+        self.assertEqual(first.key(self.monitors[1]), second.key(self.monitors[1]))
+
+    def test_fallback_model_index(self):
+        budget = vcp_wear.WriteBudget()
+        budget.identify(self.monitors[::-1], {})
+        self.assertEqual([budget.key(i) for i in self.monitors], ['SIM2400#3', 'SIM2400#2', 'SIM2400#1'])
+
+    def test_edid_read_once(self):
+        budget = vcp_wear.WriteBudget()
+        edids = [dict(_edid('AB12'), instance='X')]
+        with mock.patch.object(vcp_edid, 'read_edids', return_value=edids) as read, \
+                mock.patch.object(vcp_edid, 'match_edids',
+                                  side_effect=lambda monitors, _: {monitors[0].monitor_id: edids[0]}):
+            for _ in range(3):
+                self.assertEqual(budget.key(self.monitors[0]), 'DEL-41156-AB12')
+        self.assertEqual(read.call_count, 1)
+
+    def test_counters_migrated(self):
+        budget = vcp_wear.WriteBudget()
+        budget.identify(self.monitors, {self.monitors[0].monitor_id: _edid('AB12')})
+        budget._counters['SIM2400#1'] = {'first': 0, 'total': 7, 'day': vcp_wear._today(), 'today': 7,
+                                         'codes': {'0x14': 7}}
+        budget.record(self.monitors[0], 0x14)
+        report = {i['monitor']: i['total'] for i in budget.report()}
+        self.assertEqual(report, {'DEL-41156-AB12': 8})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# coding = utf-8
+
+import logging
+import threading
+import unittest
+import vcp
+import vcp_trace
+import vcp_worker
+
+"""
+vcp_worker 的优先级、停止和 MonitorProxy 转发.
+
+    python -m unittest test_vcp_worker
+"""
+
+
+class _FakeMonitor(object):
+    """
+    记录在哪个线程中被访问
+    """
+    monitor_id = 'FAKE@1'
+    model = 'FAKE'
+
+    def __init__(self):
+        self.threads = []
+        self._level = 10
+
+    @property
+    def level(self):
+        self.threads.append(threading.current_thread().name)
+        return self._level
+
+    @level.setter
+    def level(self, value):
+        self.threads.append(threading.current_thread().name)
+        self._level = value
+
+    def add(self, a, b=0):
+        self.threads.append(threading.current_thread().name)
+        return a + b
+
+
+class MonitorWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.monitor = _FakeMonitor()
+        self.worker = vcp_worker.MonitorWorker(self.monitor)
+        self.addCleanup(self.worker.stop, 5)
+
+    def block(self) -> threading.Event:
+        """
+        让工作线程停在一个操作上, 返回放行的 Event
+        """
+        started = threading.Event()
+        release = threading.Event()
+
+        def wait(monitor):
+            started.set()
+            release.wait(5)
+
+        self.worker.submit(wait)
+        self.assertTrue(started.wait(5))
+        return release
+
+    def test_priority_order(self):
+        order = []
+        release = self.block()
+        futures = [self.worker.submit(lambda m, n=name: order.append(n), priority=priority)
+                   for name, priority in (('sweep', vcp_worker.PRIORITY_SWEEP),
+                                          ('poll-1', vcp_worker.PRIORITY_POLL),
+                                          ('interactive-1', vcp_worker.PRIORITY_INTERACTIVE),
+                                          ('poll-2', vcp_worker.PRIORITY_POLL),
+                                          ('interactive-2', vcp_worker.PRIORITY_INTERACTIVE))]
+        self.assertEqual(self.worker.stats()['queue_depth'], 5)
+        release.set()
+        for future in futures:
+            future.result(5)
+        self.assertEqual(order, ['interactive-1', 'interactive-2', 'poll-1', 'poll-2', 'sweep'])
+        stats = self.worker.stats()
+        self.assertEqual(stats['submitted'], {'interactive': 3, 'poll': 2, 'sweep': 1})
+
+    def test_invalid_priority(self):
+        with self.assertRaises(ValueError):
+            self.worker.submit(lambda m: None, priority=7)
+
+    def test_exception_in_future(self):
+        future = self.worker.submit(lambda m: 1 / 0)
+        with self.assertRaises(ZeroDivisionError):
+            future.result(5)
+        self.assertEqual(self.worker.stats()['failed'], 1)
+
+    def test_cancelled_not_run(self):
+        ran = []
+        release = self.block()
+        future = self.worker.submit(lambda m: ran.append(1), priority=vcp_worker.PRIORITY_POLL)
+        self.assertTrue(future.cancel())
+        release.set()
+        self.worker.submit(lambda m: None).result(5)
+        self.assertEqual(ran, [])
+        self.assertEqual(self.worker.stats()['cancelled'], 1)
+
+    def test_stop_drains_queue(self):
+        done = []
+        release = self.block()
+        futures = [self.worker.submit(lambda m, i=i: done.append(i), priority=vcp_worker.PRIORITY_SWEEP)
+                   for i in range(3)]
+        stopper = threading.Thread(target=self.worker.stop, args=(5,))
+        stopper.start()
+        release.set()
+        stopper.join(5)
+        self.assertEqual(done, [0, 1, 2])
+        self.assertTrue(all(i.done() for i in futures))
+        with self.assertRaises(RuntimeError):
+            self.worker.submit(lambda m: None)
+
+
+class MonitorProxyTest(unittest.TestCase):
+    def setUp(self):
+        self.monitor = _FakeMonitor()
+        self.worker = vcp_worker.MonitorWorker(self.monitor)
+        self.addCleanup(self.worker.stop, 5)
+        self.proxy = self.worker.proxy(vcp_worker.PRIORITY_POLL)
+
+    def test_property_read_in_worker(self):
+        self.assertEqual(self.proxy.level, 10)
+        self.assertEqual(self.monitor.threads, ['MonitorWorker-FAKE@1'])
+        self.assertEqual(self.worker.stats()['submitted']['poll'], 1)
+
+    def test_method_forwarded(self):
+        self.assertEqual(self.proxy.add(1, b=2), 3)
+        self.assertEqual(self.monitor.threads, ['MonitorWorker-FAKE@1'])
+
+    def test_setattr_forwarded_in_order(self):
+        self.proxy.level = 20
+        self.proxy.level = 30
+        self.assertEqual(self.proxy.level, 30)
+        self.assertEqual(self.monitor.threads, ['MonitorWorker-FAKE@1'] * 3)
+
+    def test_plain_attributes_direct(self):
+        self.assertEqual(self.proxy.model, 'FAKE')
+        self.assertEqual(self.proxy.monitor_id, 'FAKE@1')
+        self.assertEqual(self.worker.stats()['submitted']['poll'], 0)
+
+    def test_simulated_monitor(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        backend = vcp_trace.SimulatedBackend(1)
+        pool = vcp_worker.WorkerPool()
+        self.addCleanup(pool.stop, 5)
+        proxy = pool.worker(vcp.PhyMonitor(backend.enumerate_monitors()[0], backend)).proxy()
+        proxy.brightness = 30
+        self.assertEqual(proxy.brightness, 30)
+        self.assertEqual(proxy.read_vcp_code(0x12), (70, 100))
+
+
+if __name__ == '__main__':
+    unittest.main()
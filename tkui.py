@@ -4,7 +4,12 @@
 import tkinter as tk
 from tkinter import ttk
 import logging
+import queue
+import math
 import os
+import vcp_code
+import vcp_state
+import vcp_worker
 
 """
 注意： GUI中显示的配置不会自动刷新，要查看新的配置目前需要重启应用程序
@@ -12,6 +17,9 @@ import os
 
 _LOGGER = logging.getLogger(__name__)
 
+# 显示器多于这个数量时默认使用概览表格而不是每台显示器一个 Tab
+OVERVIEW_MIN_MONITORS = 8
+
 
 def _get_attr(object_, property_name):
     try:
@@ -113,7 +121,7 @@ class RGBSlider(ttk.LabelFrame):
 
 class PowerButtonWidget(ttk.Button):
     """
-    电源按钮控件
+    电源按钮控件, 只在显示器支持的电源状态 (caps string) 之间切换
     """
     def __init__(self, parent, phy_monitor, property_name: str, value_list: list, **kwargs):
         super(PowerButtonWidget, self).__init__(parent, **kwargs)
@@ -123,8 +131,12 @@ class PowerButtonWidget(ttk.Button):
         self.value = tk.StringVar()
 
         self.value.set(_get_attr(self.phy_monitor, self.property_name))
-        self.__current_value_index = self.value_list.index(self.value.get())
+        # 当前状态不在列表中 (未知状态) 时, 第一次点击设置为列表中的第一个
+        self.__current_value_index = self.value_list.index(self.value.get()) \
+            if self.value.get() in self.value_list else -1
         self.configure(textvariable=self.value, command=self.__click_action)
+        if len(self.value_list) < 2:
+            self.state(['disabled'])
 
     def __click_action(self):
         self.__current_value_index += 1
@@ -138,9 +150,9 @@ class PowerButtonWidget(ttk.Button):
         
 class OptionListWidget(ttk.OptionMenu):
     """
-    下拉列表菜单控件
-    TODO: 跟踪StringVar的变化，会执行相应的命令，但是会执行两次。
-    通过比较当前设置来避免设置两次，但是无效的设置仍然会被执行两次。担心EEPROM的寿命
+    下拉列表菜单控件.
+    使用 OptionMenu 的 command 而不是跟踪 StringVar, 每次选择只执行一次;
+    和上一次读取或设置的值比较，相同时不写入，不需要先从显示器读取。
     """
     def __init__(self, parent, phy_monitor, property_name: str, options_list: list, **kwargs):
         
@@ -148,19 +160,20 @@ class OptionListWidget(ttk.OptionMenu):
         self.property_name = property_name
         self.options_list = options_list
         self.var = tk.StringVar()
-        self.var.set(_get_attr(self.phy_monitor, self.property_name))
+        self.current_value = _get_attr(self.phy_monitor, self.property_name)
+        self.var.set(self.current_value)
         
-        super(OptionListWidget, self).__init__(parent, self.var, self.var.get(), *self.options_list, **kwargs)
-        # trace Change Event.
-        self.var.trace('w', self.__set_value)
-
-    def __set_value(self, *event):
-        value = self.var.get()
-        old_value = _get_attr(self.phy_monitor, self.property_name)
-        if old_value == value:
-            logging.info('ignored: update setting: ' + value)
+        super(OptionListWidget, self).__init__(parent, self.var, self.var.get(), *self.options_list,
+                                               command=self.__set_value, **kwargs)
+        if not self.options_list:
+            self.state(['disabled'])
+
+    def __set_value(self, value: str):
+        if value == self.current_value:
+            _LOGGER.debug('ignored: %s is already %s', self.property_name, value)
             return
         _set_attr(self.phy_monitor, self.property_name, value)
+        self.current_value = value
         
 
 class MonitorTab(ttk.Frame):
@@ -183,14 +196,16 @@ class MonitorTab(ttk.Frame):
         self.brightness_bar = PropertySlider(self, self.phy_monitor, 'brightness', self.phy_monitor.brightness_max)
         self.contrast_bar = PropertySlider(self, self.phy_monitor, 'contrast', self.phy_monitor.contrast_max)
         self.rgb_slider = RGBSlider(self, self.phy_monitor, 'rgb_gain', self.phy_monitor.rgb_gain_max)
-        self.power_button = PowerButtonWidget(self, self.phy_monitor, 'power_mode', self.phy_monitor.power_mode_list)
+        # 选项只包含 caps string 中列出的值
+        self.power_button = PowerButtonWidget(self, self.phy_monitor, 'power_mode',
+                                              self.phy_monitor.supported_options('power_mode'))
 
         self.color_preset_option = OptionListWidget(self, self.phy_monitor,
-                                                    'color_preset', self.phy_monitor.color_preset_list)
+                                                    'color_preset', self.phy_monitor.supported_options('color_preset'))
         self.osd_lang_option = OptionListWidget(self, self.phy_monitor,
-                                                'osd_language', self.phy_monitor.osd_languages_list)
+                                                'osd_language', self.phy_monitor.supported_options('osd_language'))
         self.input_select_option = OptionListWidget(self, self.phy_monitor,
-                                                    'input_src', self.phy_monitor.input_src_list)
+                                                    'input_src', self.phy_monitor.supported_options('input_src'))
 
         self.reset_factory_button = ttk.Button(self, text="恢复出厂设置", command=self.phy_monitor.reset_factory)
         self.auto_setup_button = ttk.Button(self, text="自动调整", command=self.phy_monitor.auto_setup_perform)
@@ -214,6 +229,184 @@ class MonitorTab(ttk.Frame):
         self.reset_factory_button.grid(row=7, column=1, sticky='E')
 
 
+class MonitorOverview(ttk.Frame):
+    """
+    多台显示器的概览表格.
+
+    每台显示器是 ttk.Treeview 的一行而不是一组控件，只有滚动到可见范围内的行才在工作线程中读取显示器，
+    读取的结果通过队列回到 Tk 线程。选中多行后可以一起设置亮度、输入源和电源，双击一行打开完整的设置。
+    """
+    # (字段, 标题, 宽度)
+    COLUMNS = (
+        ('brightness', '亮度', 60),
+        ('contrast', '对比度', 60),
+        ('input_src', '输入信号', 180),
+        ('power_mode', '电源', 60),
+    )
+    LOAD_FIELDS = tuple(i[0] for i in COLUMNS)
+    # 检查读取结果的间隔(ms)
+    POLL_MS = 50
+
+    def __init__(self, parent, phy_monitors: list, pool: vcp_worker.WorkerPool, **kwargs):
+        """
+        :param parent:
+        :param phy_monitors: vcp.PhyMonitor() instance(s)
+        :param pool: 所有读写都在这个 WorkerPool 中执行
+        """
+        super(MonitorOverview, self).__init__(parent, **kwargs)
+        self.monitors = {i.monitor_id: i for i in phy_monitors}
+        self.pool = pool
+        self.table = vcp_state.FleetTable()
+        self._loading = set()
+        # 工作线程 -> Tk 线程: (monitor_id, Future)
+        self._results = queue.Queue()
+
+        self.__init_widgets()
+        self.__init_ui()
+        for monitor_id in self.monitors:
+            self.tree.insert('', tk.END, iid=monitor_id, text=monitor_id,
+                             values=['...'] * len(self.COLUMNS))
+        self.after(self.POLL_MS, self.__drain_results)
+
+    def __init_widgets(self):
+        self.tree = ttk.Treeview(self, columns=self.LOAD_FIELDS, selectmode='extended')
+        self.tree.heading('#0', text='显示器')
+        self.tree.column('#0', width=160)
+        for name, title, width in self.COLUMNS:
+            self.tree.heading(name, text=title)
+            self.tree.column(name, width=width, stretch=name == 'input_src')
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.__on_scroll)
+        self.tree.bind('<Double-1>', self.__open_detail)
+        self.tree.bind('<Configure>', lambda event: self.__load_visible())
+
+        self.toolbar = ttk.Frame(self)
+        self.brightness_var = tk.IntVar(value=50)
+        self.brightness_bar = tk.Scale(self.toolbar, orient=tk.HORIZONTAL, from_=0, to=100,
+                                       variable=self.brightness_var, length=120, showvalue=1)
+        self.brightness_button = ttk.Button(self.toolbar, text='设置亮度',
+                                            command=lambda: self.apply('brightness', self.brightness_var.get()))
+        self.input_var = tk.StringVar()
+        self.input_select = ttk.Combobox(self.toolbar, textvariable=self.input_var, state='readonly', width=24,
+                                         values=list(vcp_code.INPUT_SRC_CODE.keys()))
+        self.input_button = ttk.Button(self.toolbar, text='切换输入',
+                                       command=lambda: self.input_var.get() and self.apply('input_src',
+                                                                                            self.input_var.get()))
+        self.power_on_button = ttk.Button(self.toolbar, text='开机', command=lambda: self.apply('power_mode', 'on'))
+        self.power_off_button = ttk.Button(self.toolbar, text='关机', command=lambda: self.apply('power_mode', 'off'))
+        self.select_all_button = ttk.Button(self.toolbar, text='全选',
+                                            command=lambda: self.tree.selection_set(self.tree.get_children()))
+        self.reload_button = ttk.Button(self.toolbar, text='刷新', command=self.reload)
+
+    def __init_ui(self):
+        self.tree.grid(row=0, column=0, sticky='NESW')
+        self.scrollbar.grid(row=0, column=1, sticky='NS')
+        self.toolbar.grid(row=1, column=0, columnspan=2, sticky='WE')
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+
+        self.brightness_bar.grid(row=0, column=0, sticky='W')
+        self.brightness_button.grid(row=0, column=1, sticky='SW')
+        self.input_select.grid(row=0, column=2, sticky='SW')
+        self.input_button.grid(row=0, column=3, sticky='SW')
+        self.power_on_button.grid(row=1, column=0, sticky='W')
+        self.power_off_button.grid(row=1, column=1, sticky='W')
+        self.select_all_button.grid(row=1, column=2, sticky='W')
+        self.reload_button.grid(row=1, column=3, sticky='W')
+
+    # ############################# 按需读取
+
+    def visible_rows(self) -> list:
+        """
+        :return: 当前可见的行 (monitor_id)
+        """
+        items = self.tree.get_children()
+        first, last = self.tree.yview()
+        return items[int(first * len(items)):int(math.ceil(last * len(items)))]
+
+    def __on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.__load_visible()
+
+    def __load_visible(self):
+        # 显示之前 yview() 总是 (0, 1), 不能用来判断可见的行
+        if not self.tree.winfo_ismapped():
+            return
+        for monitor_id in self.visible_rows():
+            if monitor_id not in self.table and monitor_id not in self._loading:
+                self.__submit(monitor_id, vcp_state.read_state, self.LOAD_FIELDS, priority=vcp_worker.PRIORITY_POLL)
+
+    def __submit(self, monitor_id: str, func, *args, priority: int):
+        """
+        在显示器的工作线程中执行 func(monitor, *args), 返回 MonitorState
+        """
+        self._loading.add(monitor_id)
+        future = self.pool.submit(self.monitors[monitor_id], func, *args, priority=priority)
+        future.add_done_callback(lambda f: self._results.put((monitor_id, f)))
+
+    def __drain_results(self):
+        while True:
+            try:
+                monitor_id, future = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._loading.discard(monitor_id)
+            if future.exception() is not None:
+                _LOGGER.error('%s: read failed: %s', monitor_id, future.exception())
+                self.tree.item(monitor_id, values=['?'] * len(self.COLUMNS))
+                continue
+            state = future.result()
+            self.table.put(state)
+            self.tree.item(monitor_id, values=['' if state.get(i) is None else state.get(i)
+                                               for i in self.LOAD_FIELDS])
+        self.after(self.POLL_MS, self.__drain_results)
+
+    def reload(self):
+        """
+        重新读取选中的行, 没有选中时读取可见的行
+        :return:
+        """
+        for monitor_id in self.tree.selection() or self.visible_rows():
+            self.table.remove(monitor_id)
+            self.tree.item(monitor_id, values=['...'] * len(self.COLUMNS))
+        self.__load_visible()
+        for monitor_id in self.tree.selection():
+            if monitor_id not in self._loading:
+                self.__submit(monitor_id, vcp_state.read_state, self.LOAD_FIELDS, priority=vcp_worker.PRIORITY_POLL)
+
+    # ############################# 批量设置
+
+    @staticmethod
+    def _apply(monitor, property_name: str, value, fields: tuple) -> vcp_state.MonitorState:
+        _set_attr(monitor, property_name, value)
+        return vcp_state.read_state(monitor, fields)
+
+    def apply(self, property_name: str, value):
+        """
+        设置所有选中的显示器, 完成后重新读取这些行
+        :param property_name: PhyMonitor 的属性
+        :param value:
+        :return:
+        """
+        selection = self.tree.selection()
+        if not selection:
+            _LOGGER.info('no monitor selected, ignored: %s=%s', property_name, value)
+            return
+        for monitor_id in selection:
+            self.tree.set(monitor_id, property_name, '...')
+            self.__submit(monitor_id, self._apply, property_name, value, self.LOAD_FIELDS,
+                          priority=vcp_worker.PRIORITY_INTERACTIVE)
+
+    def __open_detail(self, event):
+        monitor_id = self.tree.identify_row(event.y)
+        if not monitor_id:
+            return
+        window = tk.Toplevel(self)
+        window.title(monitor_id)
+        MonitorTab(window, self.pool.worker(self.monitors[monitor_id]).proxy(vcp_worker.PRIORITY_INTERACTIVE))\
+            .grid(row=0, column=0, sticky='NESW')
+
+
 class TkApp(tk.Tk):
     """
     APP
@@ -243,6 +436,19 @@ class TkApp(tk.Tk):
             widget = MonitorTab(self.notebook, pm)
             self.notebook.add(widget, text=widget.model_name)
         self.status_text_var.set('{} monitor(s) found.'.format(len(phy_monitor_list)))
+
+    def add_monitors_overview(self, phy_monitor_list: list, pool: vcp_worker.WorkerPool):
+        """
+        用概览表格代替 NoteBook 显示所有显示器
+        :param phy_monitor_list: vcp.PhyMonitor() instance(s)
+        :param pool:
+        :return:
+        """
+        self.notebook.grid_forget()
+        self.overview = MonitorOverview(self, phy_monitor_list, pool)
+        self.overview.grid(row=0, column=0, sticky='NESW')
+        self.geometry('640x480')
+        self.status_text_var.set('{} monitor(s) found.'.format(len(phy_monitor_list)))
         
     def add_logfile_button(self, logfile_path: str):
         ttk.Button(self, text='查看日志文件', command=lambda: os.system('explorer /select, "{}"'.format(logfile_path)))\
@@ -1,14 +1,49 @@
 # coding = utf-8
 
 import sys
+import time
 import logging
+import threading
 import ctypes
 from ctypes import wintypes
 import vcp_code
+import vcp_quirks
+import vcp_health
+import vcp_profile
 from typing import Tuple
 
 _LOGGER = logging.getLogger(__name__)
 
+# ######################## 写入校验策略
+# 很多显示器 SetVCPFeature 返回成功但实际上忽略了设置的值，写入后读回校验
+VERIFY_ALWAYS = 'always'
+# 每 N 次写入校验一次
+VERIFY_SAMPLED = 'sampled'
+VERIFY_NEVER = 'never'
+VERIFY_POLICIES = (VERIFY_ALWAYS, VERIFY_SAMPLED, VERIFY_NEVER)
+
+DEFAULT_VERIFY_POLICY = VERIFY_SAMPLED
+DEFAULT_VERIFY_SAMPLE_RATE = 10
+# 写入后等待显示器应用设置的时间(秒)，再读回
+DEFAULT_VERIFY_SETTLE_DELAY = 0.05
+# 校验失败后重新写入的次数
+DEFAULT_VERIFY_RETRIES = 2
+
+# 同一型号累计校验成功这么多次，且失败的比例不超过 RELIABLE_MISMATCH_RATIO，则认为该型号可靠，sampled 模式下不再校验
+RELIABLE_VERIFY_COUNT = 50
+# 偶尔一次失败 (如写入时用户正在操作 OSD) 不会让型号永远被认为不可靠
+RELIABLE_MISMATCH_RATIO = 0.02
+
+# ######################## 超时
+# 每次 DDC/CI 调用的超时(秒), None 不限制. 超时的调用无法中断，显示器被标记为 degraded
+DEFAULT_CALL_TIMEOUT = None
+# caps string 需要多次传输，读取 caps 的超时为 call_timeout 的倍数
+CAPS_TIMEOUT_FACTOR = 5
+
+# 每个型号的校验统计: {model: {'verified': int, 'mismatch': int}}, 在 _VERIFY_STATS_LOCK 中修改
+MODEL_VERIFY_STATS = {}
+_VERIFY_STATS_LOCK = threading.Lock()
+
 """
 
 # Reference
@@ -21,8 +56,234 @@ https://milek7.pl/ddcbacklight/mccs.pdf
 """
 
 
+def load_verify_stats(path: str):
+    """
+    从 JSON 文件载入各型号的写入校验统计, 合并到 MODEL_VERIFY_STATS
+    :param path:
+    :return:
+    """
+    import json
+    
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+    except (OSError, ValueError) as err:
+        _LOGGER.debug('unable to load verify stats: %s', err)
+        return
+    for model, counter in stats.items():
+        _count_verify(model, 'verified', int(counter.get('verified', 0)))
+        _count_verify(model, 'mismatch', int(counter.get('mismatch', 0)))
+
+
+def save_verify_stats(path: str):
+    """
+    保存各型号的写入校验统计到 JSON 文件
+    :param path:
+    :return:
+    """
+    import json
+    
+    with _VERIFY_STATS_LOCK:
+        data = json.dumps(MODEL_VERIFY_STATS, indent=1, sort_keys=True)
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(data)
+    except OSError as err:
+        _LOGGER.error('unable to save verify stats: %s', err)
+
+
+def _count_verify(model: str, name: str, count: int = 1):
+    """
+    :param model:
+    :param name: 'verified' / 'mismatch'
+    :param count:
+    :return:
+    """
+    with _VERIFY_STATS_LOCK:
+        counter = MODEL_VERIFY_STATS.setdefault(model, {'verified': 0, 'mismatch': 0})
+        counter[name] += count
+
+
+def model_is_reliable(model: str) -> bool:
+    """
+    根据累计的校验统计判断某型号的显示器写入是否可靠
+    :param model:
+    :return:
+    """
+    with _VERIFY_STATS_LOCK:
+        counter = MODEL_VERIFY_STATS.get(model)
+        if not counter:
+            return False
+        verified, mismatch = counter['verified'], counter['mismatch']
+    return verified >= RELIABLE_VERIFY_COUNT and mismatch <= RELIABLE_MISMATCH_RATIO * (verified + mismatch)
+
+
+# 字节 -> 16 进制数字的值, 不是 16 进制数字为 -1
+_HEX_DIGITS = [-1] * 256
+for _index, _char in enumerate(b'0123456789abcdef'):
+    _HEX_DIGITS[_char] = _HEX_DIGITS[ord(chr(_char).upper())] = _index
+del _index, _char
+
+
+def _find_bytes(data: memoryview, pattern: bytes) -> int:
+    """
+    :return: pattern 在 data 中第一次出现的位置, 没有找到为 -1
+    """
+    first = pattern[0]
+    size = len(pattern)
+    for index in range(len(data) - size + 1):
+        if data[index] == first and data[index:index + size] == pattern:
+            return index
+    return -1
+
+
+def parse_vcp_caps(caps) -> dict:
+    """
+    解析 caps string 中 vcp(...) 部分，得到支持的 VCP code 以及可选的值
+    例: vcp(02 04 10 12 14(05 08 0B) 60(01 03 0F) D6(01 04 05) DF)
+    直接在字节上解析，不创建子字符串；可以传入 ctypes 缓冲区的 memoryview, 遇到 NUL 结束
+    :param caps: VCP Capabilities String, 或者 bytes / memoryview
+    :return: {code: tuple(values) 或者 None (没有列出可选值)}
+    """
+    data = memoryview(caps.encode('ascii', 'replace') if isinstance(caps, str) else caps).cast('B')
+    start = _find_bytes(data, b'vcp(')
+    if start == -1:
+        return {}
+    
+    result = {}
+    last_code = None
+    # 正在解析的 16 进制数: -1 没有, -2 不是 16 进制数
+    number = -1
+    depth = 0
+    values = []
+    for byte in data[start + len(b'vcp('):]:
+        if byte == 0x20 or byte == 0x28 or byte == 0x29:
+            # ' ', '(', ')'
+            if number >= 0:
+                if depth == 0:
+                    result[number] = None
+                    last_code = number
+                elif depth == 1:
+                    values.append(number)
+            number = -1
+            if byte == 0x28:
+                depth += 1
+                values = []
+            elif byte == 0x29:
+                if depth == 0:
+                    break
+                if depth == 1 and last_code is not None:
+                    result[last_code] = tuple(values)
+                depth -= 1
+        elif byte == 0:
+            break
+        else:
+            digit = _HEX_DIGITS[byte]
+            if digit < 0 or number == -2:
+                number = -2
+            elif number == -1:
+                number = digit
+            else:
+                number = number * 16 + digit
+    return result
+
+
+def _log_vcp_call(monitor_id: str, op: str, code: int, value, result, start: float):
+    """
+    输出一次 VCP 调用的结构化日志记录, 只在 DEBUG 级别开启时调用
+    :param monitor_id:
+    :param op: 'set' / 'get'
+    :param code: VCP Code
+    :param value: 写入或读取到的值
+    :param result: 调用结果
+    :param start: time.perf_counter() 调用开始时间
+    :return:
+    """
+    latency_ms = round((time.perf_counter() - start) * 1000, 3)
+    _LOGGER.debug('%s: %s vcp 0x%02X value=%s result=%s %.3fms', monitor_id, op, code, value, result, latency_ms,
+                  extra={'monitor': monitor_id, 'op': op, 'vcp_code': code, 'value': value,
+                         'result': result, 'latency_ms': latency_ms})
+
+
+# #################################### Win32 API
+class _WinApi(object):
+    """
+    用到的 Dxva2.dll / user32.dll 函数.
+    第一次调用 _winapi() 时绑定一次，声明完整的 argtypes / restype，之后的调用不再查找函数和设置 restype.
+    """
+    def __init__(self):
+        class _PhysicalMonitorStructure(ctypes.Structure):
+            """
+            PHYSICAL_MONITOR Structure.
+            https://msdn.microsoft.com/en-us/library/vs/alm/dd692967(v=vs.85).aspx
+            typedef struct _PHYSICAL_MONITOR {
+                HANDLE hPhysicalMonitor;
+                WCHAR  szPhysicalMonitorDescription[PHYSICAL_MONITOR_DESCRIPTION_SIZE];
+            } PHYSICAL_MONITOR, *LPPHYSICAL_MONITOR;
+
+            PHYSICAL_MONITOR_DESCRIPTION_SIZE = 128
+            """
+            _fields_ = [
+                ("hPhysicalMonitor", wintypes.HANDLE),
+                ("szPhysicalMonitorDescription", wintypes.WCHAR * 128)
+            ]
+        self.PHYSICAL_MONITOR = _PhysicalMonitorStructure
+
+        # https://msdn.microsoft.com/en-us/library/dd145061(v=vs.85).aspx
+        self.MONITORENUMPROC = ctypes.WINFUNCTYPE(wintypes.BOOL,
+                                                  wintypes.HMONITOR,
+                                                  wintypes.HDC,
+                                                  wintypes.LPRECT,
+                                                  wintypes.LPARAM)
+
+        dxva2 = ctypes.WinDLL('Dxva2')
+        user32 = ctypes.WinDLL('user32')
+
+        def bind(dll, name, argtypes, restype=wintypes.BOOL):
+            func = getattr(dll, name)
+            func.argtypes = argtypes
+            func.restype = restype
+            return func
+
+        self.EnumDisplayMonitors = bind(user32, 'EnumDisplayMonitors', [
+            wintypes.HDC, wintypes.LPRECT, self.MONITORENUMPROC, wintypes.LPARAM])
+        self.GetNumberOfPhysicalMonitorsFromHMONITOR = bind(dxva2, 'GetNumberOfPhysicalMonitorsFromHMONITOR', [
+            wintypes.HMONITOR, wintypes.LPDWORD])
+        self.GetPhysicalMonitorsFromHMONITOR = bind(dxva2, 'GetPhysicalMonitorsFromHMONITOR', [
+            wintypes.HMONITOR, wintypes.DWORD, ctypes.POINTER(_PhysicalMonitorStructure)])
+        self.DestroyPhysicalMonitor = bind(dxva2, 'DestroyPhysicalMonitor', [
+            wintypes.HANDLE])
+        self.GetCapabilitiesStringLength = bind(dxva2, 'GetCapabilitiesStringLength', [
+            wintypes.HANDLE, wintypes.LPDWORD])
+        self.CapabilitiesRequestAndCapabilitiesReply = bind(dxva2, 'CapabilitiesRequestAndCapabilitiesReply', [
+            wintypes.HANDLE, ctypes.c_char_p, wintypes.DWORD])
+        # pvct (LPMC_VCP_CODE_TYPE) 不使用，传 None
+        self.GetVCPFeatureAndVCPFeatureReply = bind(dxva2, 'GetVCPFeatureAndVCPFeatureReply', [
+            wintypes.HANDLE, ctypes.c_ubyte, wintypes.LPDWORD, wintypes.LPDWORD, wintypes.LPDWORD])
+        self.SetVCPFeature = bind(dxva2, 'SetVCPFeature', [
+            wintypes.HANDLE, ctypes.c_ubyte, wintypes.DWORD])
+
+
+_WINAPI = None
+
+
+def _winapi() -> _WinApi:
+    """
+    绑定 Win32 API, 只在第一次调用时执行，import 时不做任何操作
+    :return:
+    """
+    global _WINAPI
+    if _WINAPI is None:
+        _WINAPI = _WinApi()
+    return _WINAPI
+
+
 # #################################### Use Windows API to enumerate monitors
-def _get_physical_monitors_from_hmonitor(hmonitor: wintypes.HMONITOR) -> list:
+# enumerate_monitors() 找到的物理显示器: {physical monitor handle: (HMONITOR, 这个 HMONITOR 的物理显示器数量)}
+_HMONITORS = {}
+
+
+def _get_physical_monitors_from_hmonitor(hmonitor) -> list:
     """
     Retrieves the physical monitors associated with an HMONITOR monitor handle
 
@@ -45,34 +306,18 @@ def _get_physical_monitors_from_hmonitor(hmonitor: wintypes.HMONITOR) -> list:
     :return:
 
     """
-    class _PhysicalMonitorStructure(ctypes.Structure):
-        """
-        PHYSICAL_MONITOR Structure.
-        https://msdn.microsoft.com/en-us/library/vs/alm/dd692967(v=vs.85).aspx
-        typedef struct _PHYSICAL_MONITOR {
-            HANDLE hPhysicalMonitor;
-            WCHAR  szPhysicalMonitorDescription[PHYSICAL_MONITOR_DESCRIPTION_SIZE];
-        } PHYSICAL_MONITOR, *LPPHYSICAL_MONITOR;
-
-        PHYSICAL_MONITOR_DESCRIPTION_SIZE = 128
-        """
-        _fields_ = [
-            ("hPhysicalMonitor", wintypes.HANDLE),
-            ("szPhysicalMonitorDescription", wintypes.WCHAR * 128)
-        ]
-
+    api = _winapi()
+    
     # Retrieves the number of physical monitors
     phy_monitor_number = wintypes.DWORD()
-    api_call_get_number = ctypes.windll.Dxva2.GetNumberOfPhysicalMonitorsFromHMONITOR
-    if not api_call_get_number(hmonitor, ctypes.byref(phy_monitor_number)):
+    if not api.GetNumberOfPhysicalMonitorsFromHMONITOR(hmonitor, ctypes.byref(phy_monitor_number)):
         _LOGGER.error(ctypes.WinError())
         return []
     
     # Retrieves the physical monitors
-    api_call_get_monitor = ctypes.windll.Dxva2.GetPhysicalMonitorsFromHMONITOR
     # create array
-    phy_monitor_array = (_PhysicalMonitorStructure * phy_monitor_number.value)()
-    if not api_call_get_monitor(hmonitor, phy_monitor_number, phy_monitor_array):
+    phy_monitor_array = (api.PHYSICAL_MONITOR * phy_monitor_number.value)()
+    if not api.GetPhysicalMonitorsFromHMONITOR(hmonitor, phy_monitor_number, phy_monitor_array):
         _LOGGER.error(ctypes.WinError())
         return []
     
@@ -94,18 +339,10 @@ def enumerate_monitors() -> list:
     
     :return: list contains physical monitor handles
     """
+    api = _winapi()
     all_hmonitor = []
 
-    # Factory function of EnumDisplayMonitors callback.
-    # 保持引用以防止被GC !
-    # https://msdn.microsoft.com/en-us/library/dd145061(v=vs.85).aspx
-    _MONITOR_ENUM_PROC = ctypes.WINFUNCTYPE(wintypes.BOOL,
-                                            wintypes.HMONITOR,
-                                            wintypes.HDC,
-                                            ctypes.POINTER(wintypes.LPRECT),
-                                            wintypes.LPARAM)
-
-    def __monitor_enum_proc_callback(hmonitor_: wintypes.HMONITOR, hdc, lprect, lparam) -> bool:
+    def __monitor_enum_proc_callback(hmonitor_, hdc, lprect, lparam) -> bool:
         """
         EnumDisplayMonitors callback, append HMONITOR to all_hmonitor list.
         :param hmonitor_:
@@ -117,36 +354,69 @@ def enumerate_monitors() -> list:
         all_hmonitor.append(hmonitor_)
         return True
     
-    if not ctypes.windll.user32.EnumDisplayMonitors(None, None,
-                                                    _MONITOR_ENUM_PROC(__monitor_enum_proc_callback), None):
-            raise ctypes.WinError()
+    # 保持 callback 的引用以防止被GC !
+    callback = api.MONITORENUMPROC(__monitor_enum_proc_callback)
+    if not api.EnumDisplayMonitors(None, None, callback, 0):
+        raise ctypes.WinError()
     
     # get physical monitor handle
     handles = []
     for hmonitor in all_hmonitor:
-        handles.extend(_get_physical_monitors_from_hmonitor(hmonitor))
+        physical_monitors = _get_physical_monitors_from_hmonitor(hmonitor)
+        for i in physical_monitors:
+            _HMONITORS[i.hPhysicalMonitor] = (hmonitor, len(physical_monitors))
+        handles.extend(physical_monitors)
     
     return handles
 
 
-class PhyMonitor(object):
+def hmonitor_of(phy_monitor) -> tuple:
     """
-    一个物理显示器的VCP控制class，封装常用操作.
+    物理显示器所属的 HMONITOR, 用来找到显示器的设备路径 (vcp_edid)
+    :param phy_monitor: PhyMonitor()
+    :return: (HMONITOR, 这个 HMONITOR 的物理显示器数量); 不是 enumerate_monitors() 找到的显示器 (模拟等) 时为 None
     """
-    def __init__(self, phy_monitor):
-        self._phy_monitor = phy_monitor
-        self._phy_monitor_handle = self._phy_monitor.hPhysicalMonitor
-        # VCP Capabilities String
-        self._caps_string = ''
-        # Monitor model name
-        self.model = ''
-        self.info_display_type = ''
-        
-        self._get_monitor_caps()
-        if self._caps_string != '':
-            self._get_model_info()
+    return _HMONITORS.get(phy_monitor._phy_monitor_handle)
 
-    def _get_monitor_caps(self):
+
+class _Scratch(object):
+    """
+    一台显示器的 ctypes 缓冲区和指针，每次调用重复使用，读取时不创建新的 ctypes 对象.
+    同一台显示器的调用由 PhyMonitor 的锁串行化，不会同时使用
+    """
+    __slots__ = ('current', 'maximum', 'p_current', 'p_maximum', 'caps_length', 'p_caps_length', 'caps')
+
+    def __init__(self):
+        self.current = wintypes.DWORD()
+        self.maximum = wintypes.DWORD()
+        # 直接传 POINTER(DWORD) 对象, 不需要每次调用 byref()
+        self.p_current = ctypes.pointer(self.current)
+        self.p_maximum = ctypes.pointer(self.maximum)
+        self.caps_length = wintypes.DWORD()
+        self.p_caps_length = ctypes.pointer(self.caps_length)
+        # 按需要增大的 caps string 缓冲区
+        self.caps = None
+
+
+class Win32Backend(object):
+    """
+    通过 Dxva2 访问显示器.
+    PhyMonitor 的所有 DDC/CI 调用都经过 backend，vcp_trace 中的 TraceRecorder / ReplayBackend 实现相同的接口。
+    """
+    def __init__(self):
+        # {handle: _Scratch}
+        self._buffers = {}
+    
+    def _scratch(self, handle) -> _Scratch:
+        scratch = self._buffers.get(handle)
+        if scratch is None:
+            scratch = self._buffers.setdefault(handle, _Scratch())
+        return scratch
+    
+    def enumerate_monitors(self) -> list:
+        return enumerate_monitors()
+    
+    def capabilities(self, handle) -> bytes:
         """
         https://msdn.microsoft.com/en-us/library/windows/desktop/dd692938(v=vs.85).aspx
         BOOL GetCapabilitiesStringLength(
@@ -160,28 +430,378 @@ class PhyMonitor(object):
             _Out_  LPSTR pszASCIICapabilitiesString,
             _In_   DWORD dwCapabilitiesStringLengthInCharacters
         );
-        :return:
+        :param handle: physical monitor handle
+        :return: caps string 的原始字节 (ASCII), 读取失败时为 b''
         """
-        
-        caps_string_length = wintypes.DWORD()
-        if not ctypes.windll.Dxva2.GetCapabilitiesStringLength(self._phy_monitor_handle,
-                                                               ctypes.byref(caps_string_length)):
+        api = _winapi()
+        scratch = self._scratch(handle)
+        if not api.GetCapabilitiesStringLength(handle, scratch.p_caps_length):
             _LOGGER.error(ctypes.WinError())
             raise ctypes.WinError()
         
-        caps_string = (ctypes.c_char * caps_string_length.value)()
-        if not ctypes.windll.Dxva2.CapabilitiesRequestAndCapabilitiesReply(
-                self._phy_monitor_handle, caps_string, caps_string_length):
-                _LOGGER.error(ctypes.WinError())
-                return
+        length = scratch.caps_length.value
+        if scratch.caps is None or len(scratch.caps) < length:
+            scratch.caps = (ctypes.c_char * length)()
+        if not api.CapabilitiesRequestAndCapabilitiesReply(handle, scratch.caps, length):
+            _LOGGER.error(ctypes.WinError())
+            return b''
+        # 不解码: parse_vcp_caps() 直接在字节上解析, 只有 model / type 需要解码
+        return bytes(memoryview(scratch.caps)[:length]).partition(b'\0')[0]
+    
+    def set_vcp_feature(self, handle, code: int, value: int) -> bool:
+        """
+        https://msdn.microsoft.com/en-us/library/dd692979(v=vs.85).aspx
+        BOOL SetVCPFeature(
+            _In_  HANDLE hMonitor,
+            _In_  BYTE bVCPCode,
+            _In_  DWORD dwNewValue
+        );
+        """
+        return bool(_winapi().SetVCPFeature(handle, code, value))
+    
+    def get_vcp_feature(self, handle, code: int) -> Tuple[bool, int, int]:
+        """
+        https://msdn.microsoft.com/en-us/library/dd692953(v=vs.85).aspx
+        BOOL GetVCPFeatureAndVCPFeatureReply(
+            _In_   HANDLE hMonitor,
+            _In_   BYTE bVCPCode,
+            _Out_  LPMC_VCP_CODE_TYPE pvct,
+            _Out_  LPDWORD pdwCurrentValue,
+            _Out_  LPDWORD pdwMaximumValue
+        );
+        :return: Win32 API return, current_value, max_value
+        """
+        scratch = self._scratch(handle)
+        ret_ = bool(_winapi().GetVCPFeatureAndVCPFeatureReply(handle, code, None, scratch.p_current,
+                                                              scratch.p_maximum))
+        return ret_, scratch.current.value, scratch.maximum.value
+    
+    def destroy(self, handle) -> bool:
+        """
+        https://msdn.microsoft.com/en-us/library/windows/desktop/dd692936(v=vs.85).aspx
+        BOOL DestroyPhysicalMonitor(
+            _In_  HANDLE hMonitor
+        );
+        """
+        self._buffers.pop(handle, None)
+        return bool(_winapi().DestroyPhysicalMonitor(handle))
+    
+    def last_error(self) -> str:
+        """
+        上一次失败的调用的错误信息 (GetLastError 是线程局部的，需要在同一线程中调用)
+        :return:
+        """
+        return str(ctypes.WinError())
+
+
+_BACKEND = None
+
+
+def default_backend():
+    """
+    PhyMonitor 默认使用的 backend, 第一次调用时创建 Win32Backend
+    :return:
+    """
+    global _BACKEND
+    if _BACKEND is None:
+        _BACKEND = Win32Backend()
+    return _BACKEND
+
+
+def set_backend(backend):
+    """
+    替换默认的 backend, 如 vcp_trace.TraceRecorder / vcp_trace.ReplayBackend
+    :param backend:
+    :return:
+    """
+    global _BACKEND
+    _BACKEND = backend
+
+
+def set_default_timeout(seconds: float):
+    """
+    之后创建的 PhyMonitor 每次 DDC/CI 调用的超时
+    :param seconds: None 不限制
+    :return:
+    """
+    global DEFAULT_CALL_TIMEOUT
+    DEFAULT_CALL_TIMEOUT = seconds
+
+
+class CallTimeout(TimeoutError):
+    """
+    DDC/CI 调用超时、超过 Deadline 或者被取消
+    """
+
+
+class MonitorDegraded(OSError):
+    """
+    显示器被标记为 degraded, 健康检查没有通过
+    """
+
+
+_DEADLINE = threading.local()
+
+
+class Deadline(object):
+    """
+    一组操作的截止时间，在当前线程中生效；截止时间之后或者 cancel() 之后的 DDC/CI 调用直接失败:
+
+        with vcp.Deadline(5) as deadline:
+            monitor.rgb_gain = (90, 90, 90)
+
+    其它线程可以调用 deadline.cancel(). 嵌套时使用最早的截止时间.
+    """
+    def __init__(self, seconds: float = None):
+        """
+        :param seconds: None 只能通过 cancel() 取消
+        """
+        self.expires = None if seconds is None else time.monotonic() + seconds
+        self.cancelled = False
+        self._outer = None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def remaining(self) -> float:
+        """
+        :return: 剩余时间(秒), 已经取消时为 0, 没有截止时间时为 None
+        """
+        if self.cancelled:
+            return 0.0
+        remaining = None if self.expires is None else self.expires - time.monotonic()
+        outer = self._outer.remaining() if self._outer is not None else None
+        if outer is not None and (remaining is None or outer < remaining):
+            return outer
+        return remaining
+
+    def __enter__(self):
+        self._outer = getattr(_DEADLINE, 'current', None)
+        _DEADLINE.current = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _DEADLINE.current = self._outer
+        self._outer = None
+
+
+class _Call(object):
+    """
+    在单独的线程中进行的一次 backend 调用
+    """
+    __slots__ = ('done', 'result', 'error', 'exception')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.exception = None
+
+
+# vcp_wear.WriteBudget, None 不限制持久写入
+_WRITE_BUDGET = None
+
+
+def set_write_budget(budget):
+    """
+    限制所有显示器的 EEPROM 写入
+    :param budget: vcp_wear.WriteBudget, None 取消限制
+    :return:
+    """
+    global _WRITE_BUDGET
+    _WRITE_BUDGET = budget
+
+
+def get_write_budget():
+    """
+    :return: set_write_budget() 设置的 vcp_wear.WriteBudget 或者 None
+    """
+    return _WRITE_BUDGET
+
+
+# PhyMonitor 可以设置的属性和值的类型，用来转换命令行 / 脚本中的字符串
+PROPERTY_TYPES = {
+    'color_temperature': int,
+    'brightness': int,
+    'contrast': int,
+    'color_preset': str,
+    'rgb_gain': tuple,
+    'osd_language': str,
+    'power_mode': str,
+    'input_src': str,
+    'volume': int,
+    'audio_mute': str,
+    'audio_balance': int,
+    'audio_bass': int,
+    'audio_treble': int,
+}
+
+# str 类型的属性可以设置的值: {属性: {名称: VCP 值}}
+PROPERTY_CHOICES = {
+    'color_preset': vcp_code.COLOR_PRESET_CODE,
+    'osd_language': vcp_code.OSD_LANG_CODE,
+    'power_mode': vcp_code.POWER_MODE_CODE,
+    'input_src': vcp_code.INPUT_SRC_CODE,
+    'audio_mute': vcp_code.AUDIO_MUTE_CODE,
+}
+# PROPERTY_CHOICES 中的属性对应的 VCP 功能名称
+PROPERTY_CODES = {
+    'color_preset': 'Select Color Preset',
+    'osd_language': 'OSD Language',
+    'power_mode': 'Power Mode',
+    'input_src': 'Input Source',
+    'audio_mute': 'Audio: Mute (screen blank)',
+}
+# int 类型、范围为 0 - 最大值的属性对应的 VCP 功能名称
+PROPERTY_LEVEL_CODES = {
+    'brightness': 'Luminance',
+    'contrast': 'Contrast',
+    'volume': 'Audio: Speaker Volume',
+    'audio_balance': 'Audio: Balance L/R',
+    'audio_bass': 'Audio: Bass',
+    'audio_treble': 'Audio: Treble',
+}
+# 属性读写的 VCP 功能名称, 写入后用来使缓存失效
+PROPERTY_VCP_CODES = dict(
+    {k: (v,) for k, v in PROPERTY_CODES.items()},
+    **{k: (v,) for k, v in PROPERTY_LEVEL_CODES.items()},
+    color_temperature=('User Color Temperature Increment', 'User Color Temperature'),
+    rgb_gain=('Video Gain Red', 'Video Gain Green', 'Video Gain Blue'),
+    brightness_max=('Luminance',),
+    contrast_max=('Contrast',),
+    volume_max=('Audio: Speaker Volume',),
+    rgb_gain_max=('Video Gain Red',),
+    rgb_gain_max_channels=('Video Gain Red', 'Video Gain Green', 'Video Gain Blue'),
+    info_poweron_hours=('Display Usage Time',),
+    info_pannel_type=('Flat Panel Sub-Pixel Layout',),
+)
+
+
+def property_vcp_codes(name: str) -> frozenset:
+    """
+    :param name: PhyMonitor 的属性名或 vcp_code.VCP_CODE 中的功能名称
+    :return: 读取这个属性用到的 VCP code; 未知的属性返回 None
+    """
+    if name in vcp_code.VCP_CODE:
+        return frozenset((vcp_code.VCP_CODE[name],))
+    names = PROPERTY_VCP_CODES.get(name)
+    if names is None:
+        return None
+    return frozenset(vcp_code.VCP_CODE[i] for i in names)
+
+
+def written_vcp_codes(name: str) -> frozenset:
+    """
+    :param name: PhyMonitor 的属性名或 vcp_code.VCP_CODE 中的功能名称
+    :return: 写入这个属性后可能改变的 VCP code (包括 vcp_code.DEPENDENT_CODES); None 为所有设置
+    """
+    codes = property_vcp_codes(name)
+    if codes is None:
+        return None
+    result = set(codes)
+    for code in codes:
+        if code in vcp_code.DEPENDENT_CODES:
+            dependent = vcp_code.DEPENDENT_CODES[code]
+            if dependent is None:
+                return None
+            result.update(dependent)
+    return frozenset(result)
+
+
+class _Flight(object):
+    """
+    一次进行中的 DDC/CI 调用. 同一台显示器、同一个 code 的并发读取共享一次调用的结果；
+    还没有开始的写入被之后的写入替换为最新的值, 所有写入者得到这次写入的结果.
+    done 在第一个等待者出现时 (持有 _flight_lock) 才创建, 没有并发的调用不创建 threading.Event
+    """
+    __slots__ = ('done', 'value', 'verify', 'result')
+
+    def __init__(self, value: int = None, verify: bool = None):
+        self.done = None
+        self.value = value
+        self.verify = verify
+        self.result = None
+
+
+class PhyMonitor(object):
+    """
+    一个物理显示器的VCP控制class，封装常用操作.
+    """
+    def __init__(self, phy_monitor, backend=None):
+        """
+        :param phy_monitor: backend.enumerate_monitors() 返回的 PHYSICAL_MONITOR
+        :param backend: DDC/CI 调用的实现, 默认为 default_backend()
+        """
+        self._backend = backend or default_backend()
+        self._phy_monitor = phy_monitor
+        self._phy_monitor_handle = self._phy_monitor.hPhysicalMonitor
+        # VCP Capabilities String, backend 返回的 bytes (Win32Backend) 或 str
+        self._caps_string = ''
+        # Monitor model name
+        self.model = ''
+        self.info_display_type = ''
+        # caps string 中列出的 VCP code: {code: tuple(values) / None}
+        self.vcp_caps = {}
+        # 同一台显示器的 DDC/CI 调用不能同时进行
+        self._lock = threading.RLock()
+        # 最近一次读取 / 写入的值: {code: (value, max_value, time.monotonic())}
+        self._value_cache = {}
+        # 进行中的读取 / 等待中的写入: {code: _Flight}
+        self._flight_lock = threading.Lock()
+        self._read_flights = {}
+        self._write_flights = {}
+        # 调用次数和实际的 DDC/CI 调用次数
+        self._dedup_counters = {'reads': 0, 'read_transactions': 0, 'writes': 0, 'write_transactions': 0}
+        # 日志中区分显示器用的 id
+        self.monitor_id = str(self._phy_monitor_handle)
+        
+        # 每次 DDC/CI 调用的超时(秒)，超时或者还有超时的调用没有返回时标记为 degraded
+        self.call_timeout = DEFAULT_CALL_TIMEOUT
+        self.degraded = False
+        self.degraded_reason = ''
+        # 超时后仍在进行的调用
+        self._hung_call = None
+        # 断路器: 连续失败后读写直接失败, 直到健康检查通过
+        self.health = vcp_health.CircuitBreaker()
+        
+        # 写入校验
+        self.verify_policy = DEFAULT_VERIFY_POLICY
+        self.verify_sample_rate = DEFAULT_VERIFY_SAMPLE_RATE
+        self.verify_settle_delay = DEFAULT_VERIFY_SETTLE_DELAY
+        self.verify_retries = DEFAULT_VERIFY_RETRIES
+        self._write_counter = 0
         
-        self._caps_string = caps_string.value.decode('ASCII')
+        # quirks 在构造时查找一次，之后的调用直接使用
+        self.vcp_version = 0
+        self.firmware_level = 0
+        self._set_quirk(vcp_quirks.lookup(''))
+        
+        with vcp_profile.span('caps'):
+            self._get_monitor_caps()
+        if self._caps_string:
+            with vcp_profile.span('parse'):
+                self._get_model_info()
+        self.monitor_id = '{}@{}'.format(self.model or 'unknown', self._phy_monitor_handle)
+        self._load_quirk()
+
+    def _get_monitor_caps(self):
+        """
+        读取 VCP Capabilities String
+        :return:
+        :raise CallTimeout: 超时 (OSError)
+        """
+        self._caps_string = self._call(self._backend.capabilities, self._phy_monitor_handle,
+                                       timeout_factor=CAPS_TIMEOUT_FACTOR)[0]
     
     def _get_model_info(self):
         """
         analyze caps string
         :return:
         """
+        caps = self._caps_string
+        if isinstance(caps, (bytes, bytearray)):
+            caps = caps.decode('ASCII', 'replace')
+        
         def find_(src: str, start_: str, end_: str) -> str:
             """
             查找 start_ 和 end_ 之间包围的内容
@@ -201,75 +821,391 @@ class PhyMonitor(object):
                 return ''
             return src[start_index:end_index]
         
-        model = find_(self._caps_string, 'model(', ')')
+        # vcp(...) 在原始的字节上解析
+        self.vcp_caps = parse_vcp_caps(self._caps_string)
+        
+        model = find_(caps, 'model(', ')')
         if model == '':
-            _LOGGER.warning('unable to find model info in vcp caps string: {}'.format(self._caps_string))
+            _LOGGER.warning('unable to find model info in vcp caps string')
+            _LOGGER.debug('vcp caps string: %s', caps)
         self.model = model
 
-        info_display_type = find_(self._caps_string, 'type(', ')')
+        info_display_type = find_(caps, 'type(', ')')
         if info_display_type == '':
-            _LOGGER.warning('unable to find display type info in vcp caps string: {}'.format(self._caps_string))
+            _LOGGER.warning('%s: unable to find display type info in vcp caps string', model)
         self.info_display_type = info_display_type
         
+    def _set_quirk(self, quirk: dict):
+        """
+        应用 quirks
+        :param quirk: vcp_quirks.lookup() 的返回值
+        :return:
+        """
+        self.quirk = quirk
+        self._command_delay = quirk['command_delay']
+        self._broken_codes = frozenset(quirk['broken_codes'])
+        self._value_remap = quirk['value_remap']
+        self._channel_max = quirk['channel_max']
+        if quirk['verify_policy']:
+            self.verify_policy = quirk['verify_policy']
+    
+    def _load_quirk(self):
+        """
+        读取 VCP 版本和固件版本，查找这台显示器的 quirks. caps string 中没有列出的不读取，为 0
+        :return:
+        """
+        for attr, vcp_code_key in (('vcp_version', 'VCP  Version'), ('firmware_level', 'Display Firmware Level')):
+            if vcp_code.VCP_CODE[vcp_code_key] in self.vcp_caps:
+                setattr(self, attr, self.get_vcp_value_by_name(vcp_code_key)[0])
+        self._set_quirk(vcp_quirks.lookup(self.model, self.vcp_version, self.firmware_level))
+    
+    def _remap_value(self, code: int, value: int) -> int:
+        """
+        根据 quirks 转换读取到的值
+        :param code: VCP Code
+        :param value: 显示器报告的值
+        :return:
+        """
+        remap = self._value_remap.get(code)
+        if remap is None:
+            return value
+        return remap.get(value, value)
+    
+    def _max_value(self, vcp_code_key: str) -> int:
+        """
+        读取最大值，quirks 中指定了最大值则直接使用
+        :param vcp_code_key: key name of vcp_code.VCP_CODE dict
+        :return:
+        """
+        max_ = self._channel_max.get(vcp_code.VCP_CODE.get(vcp_code_key))
+        if max_ is not None:
+            return max_
+        return self.get_vcp_value_by_name(vcp_code_key)[1]
+    
     def close(self):
         """
         Close WinAPI Handle.
-        
-        https://msdn.microsoft.com/en-us/library/windows/desktop/dd692936(v=vs.85).aspx
-        BOOL DestroyPhysicalMonitor(
-            _In_  HANDLE hMonitor
-        );
         :return:
         """
-        import ctypes
-        api_call = ctypes.windll.Dxva2.DestroyPhysicalMonitor
+        if not self._backend.destroy(self._phy_monitor_handle):
+            _LOGGER.error('%s: close failed: %s', self.monitor_id, self._backend.last_error())
+    
+    # ########################## 超时和健康检查
+    
+    def mark_degraded(self, reason: str):
+        """
+        标记为 degraded, 批量操作 (vcp_fleet) 跳过这台显示器直到 probe() 成功
+        :param reason:
+        :return:
+        """
+        if not self.degraded:
+            _LOGGER.warning('%s: marked as degraded: %s', self.monitor_id, reason)
+        self.degraded = True
+        self.degraded_reason = reason
+        self.health.trip()
+    
+    @property
+    def available(self) -> bool:
+        """
+        没有被标记为 degraded, 断路器没有断开
+        """
+        return not self.degraded and self.health.state != vcp_health.OPEN
+    
+    @property
+    def health_stats(self) -> dict:
+        """
+        :return: vcp_health.CircuitBreaker.stats() 和 'degraded', 'degraded_reason'
+        """
+        stats = self.health.stats()
+        stats['degraded'] = self.degraded
+        stats['degraded_reason'] = self.degraded_reason
+        return stats
+    
+    def _call_timeout(self, factor: float) -> Tuple[float, bool]:
+        """
+        :param factor: call_timeout 的倍数
+        :return: (这次调用的超时(秒), None 不限制; 超时是否由 Deadline 决定)
+        :raise CallTimeout: 当前线程的 Deadline 已经到期或者被取消
+        """
+        timeout = self.call_timeout * factor if self.call_timeout else None
+        deadline = getattr(_DEADLINE, 'current', None)
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining is not None:
+                if remaining <= 0:
+                    raise CallTimeout('{}: {}'.format(self.monitor_id, 'cancelled' if deadline.cancelled
+                                                      else 'deadline exceeded'))
+                if timeout is None or remaining < timeout:
+                    return remaining, True
+        return timeout, False
+    
+    def _run_call(self, call: _Call, func, args: tuple):
+        """
+        有超时的调用的线程
+        """
+        try:
+            call.result = func(*args)
+            ok = call.result[0] if isinstance(call.result, tuple) else call.result
+            if not ok:
+                # GetLastError 只在调用的线程中有效
+                call.error = self._backend.last_error()
+        except Exception as err:
+            call.exception = err
+        finally:
+            call.done.set()
+    
+    def _call(self, func, *args, timeout_factor: float = 1):
+        """
+        在超时限制内调用 backend. 有超时时在单独的线程中调用, 超时后不等待它返回
+        :param func: backend 的方法
+        :param args:
+        :param timeout_factor: call_timeout 的倍数
+        :return: (func 的返回值, 失败时的 backend.last_error())
+        :raise CallTimeout:
+        """
+        timeout, by_deadline = self._call_timeout(timeout_factor)
+        hung = self._hung_call
+        if hung is not None:
+            if not hung.done.is_set():
+                raise CallTimeout('{}: previous call still running'.format(self.monitor_id))
+            self._hung_call = None
         
-        if not api_call(self._phy_monitor_handle):
-            _LOGGER.error(ctypes.WinError())
+        tracer = vcp_profile.TRACER
+        span_ = None if tracer is None else tracer.begin('bus ' + func.__name__,
+                                                         {'monitor': self.monitor_id, 'vcp': args[1:]})
+        try:
+            if timeout is None:
+                # 没有超时: 在当前线程中直接调用, 不创建 _Call
+                result = func(*args)
+                ok = result[0] if isinstance(result, tuple) else result
+                return result, (None if ok else self._backend.last_error())
+            call = _Call()
+            threading.Thread(target=self._run_call, args=(call, func, args), name='ddc-{}'.format(self.monitor_id),
+                             daemon=True).start()
+            if not call.done.wait(timeout):
+                # 调用还在进行, 之后的调用等它返回
+                self._hung_call = call
+                if by_deadline:
+                    # 调用者的截止时间到了, 不是显示器没有响应: 不标记 degraded, 不计入断路器
+                    raise CallTimeout('{}: deadline exceeded after {:.3f}s'.format(self.monitor_id, timeout))
+                self.mark_degraded('call timed out after {:.3f}s'.format(timeout))
+                raise CallTimeout('{}: call timed out after {:.3f}s'.format(self.monitor_id, timeout))
+        finally:
+            if span_ is not None:
+                span_.end()
+        if call.exception is not None:
+            raise call.exception
+        return call.result, call.error
+    
+    def probe(self) -> bool:
+        """
+        健康检查: 读取 VCP Version (0xDF), 不受断路器限制. 成功时清除 degraded 并闭合断路器
+        :return: 是否成功
+        """
+        self.health.half_open()
+        with self._lock:
+            try:
+                (ok, _, _), _ = self._call(self._backend.get_vcp_feature, self._phy_monitor_handle,
+                                           vcp_code.VCP_CODE['VCP  Version'])
+            except CallTimeout as err:
+                _LOGGER.debug('%s: probe failed: %s', self.monitor_id, err)
+                ok = False
+        self.health.record(bool(ok))
+        if ok and self.degraded:
+            _LOGGER.info('%s: probe succeeded, no longer degraded', self.monitor_id)
+            self.degraded = False
+            self.degraded_reason = ''
+        return bool(ok)
+    
+    def check_health(self) -> bool:
+        """
+        批量操作之前调用: 正常时直接返回 True; 断开时只在到了检查时间时 probe(), 不等待已知不响应的显示器
+        :return: 是否可以操作
+        """
+        if self.available and self.health.state == vcp_health.CLOSED:
+            return True
+        if not self.health.probe_due():
+            return False
+        return self.probe()
+    
+    def _health_allow(self, op: str, code: int) -> bool:
+        if self.health.allow():
+            return True
+        _LOGGER.debug('%s: %s 0x%02X skipped, circuit open', self.monitor_id, op, code)
+        return False
+    
+    def _health_record(self, code: int, ok: bool):
+        # caps string 中没有列出的 code 失败是因为不支持, 不计入
+        if ok or not self.vcp_caps or code in self.vcp_caps:
+            self.health.record(bool(ok))
     
     # ########################## 发送/读取 VCP 设置的函数
     
-    def send_vcp_code(self, code: int, value: int) -> bool:
+    def _set_vcp_feature(self, code: int, value: int) -> bool:
+        """
+        :param code: VCP Code
+        :param value: Data
+        :return: Win32 API return, 超时或者断路器断开时返回 False
+        """
+        if not self._health_allow('set', code):
+            return False
+        try:
+            ret_, error = self._call(self._backend.set_vcp_feature, self._phy_monitor_handle, code, value)
+        except CallTimeout as err:
+            ret_, error = False, err
+        else:
+            self._health_record(code, ret_)
+        budget = _WRITE_BUDGET
+        if ret_ and budget is not None and budget.is_persistent(code):
+            # 包括校验失败后的重新写入
+            budget.record(self, code)
+        if not ret_:
+            _LOGGER.error('%s: send vcp command failed: 0x%02X: %s', self.monitor_id, code,
+                          error, extra={'monitor': self.monitor_id, 'op': 'set', 'vcp_code': code})
+        return ret_
+    
+    def _get_vcp_feature(self, code: int) -> Tuple[bool, int, int]:
+        """
+        :param code: VCP Code
+        :return: Win32 API return, current_value, max_value; 超时或者断路器断开时返回 False, 0, 0
+        """
+        if not self._health_allow('get', code):
+            return False, 0, 0
+        try:
+            (ret_, current_value, max_value), error = self._call(self._backend.get_vcp_feature,
+                                                                 self._phy_monitor_handle, code)
+        except CallTimeout as err:
+            (ret_, current_value, max_value), error = (False, 0, 0), err
+        else:
+            self._health_record(code, ret_)
+        if not ret_:
+            _LOGGER.error('%s: get vcp command failed: 0x%02X: %s', self.monitor_id, code,
+                          error, extra={'monitor': self.monitor_id, 'op': 'get', 'vcp_code': code})
+        return ret_, current_value, max_value
+    
+    def _need_verify(self, code: int) -> bool:
+        """
+        根据校验策略决定这次写入是否需要读回校验
+        :param code: VCP Code
+        :return:
+        """
+        if self.verify_policy == VERIFY_NEVER or code in vcp_code.WRITE_ONLY_CODES:
+            return False
+        if self.verify_policy == VERIFY_ALWAYS:
+            return True
+        # sampled: 已知可靠的型号全速运行
+        if model_is_reliable(self.model):
+            return False
+        # 第一次写入以及之后每 N 次写入校验一次
+        self._write_counter += 1
+        return (self._write_counter - 1) % max(1, self.verify_sample_rate) == 0
+    
+    def _verify_write(self, code: int, value: int) -> bool:
+        """
+        写入后等待显示器应用设置，读回并比较，不一致则重新写入
+        :param code: VCP Code
+        :param value: 写入的值
+        :return: 最终读回的值是否和写入的一致
+        """
+        # 如 0x8D 读回时高位是黑屏状态, 只比较静音的位
+        mask = vcp_code.VERIFY_MASKS.get(code, -1)
+        for attempt in range(self.verify_retries + 1):
+            time.sleep(self.verify_settle_delay)
+            ok, current, _ = self._get_vcp_feature(code)
+            if ok and self._remap_value(code, current) & mask == self._remap_value(code, value) & mask:
+                _count_verify(self.model, 'verified')
+                return True
+            
+            _count_verify(self.model, 'mismatch')
+            _LOGGER.warning('%s: verify vcp code 0x%02X failed, wrote %s, read back %s (attempt %s)',
+                            self.monitor_id, code, value, current if ok else None, attempt + 1)
+            if attempt < self.verify_retries and not self._set_vcp_feature(code, value):
+                return False
+        return False
+    
+    def send_vcp_code(self, code: int, value: int, verify: bool = None) -> bool:
         """
         send vcp code to monitor.
-        
-        https://msdn.microsoft.com/en-us/library/dd692979(v=vs.85).aspx
-        BOOL SetVCPFeature(
-            _In_  HANDLE hMonitor,
-            _In_  BYTE bVCPCode,
-            _In_  DWORD dwNewValue
-        );
+        根据 verify_policy 读回校验写入的值
         
         :param code: VCP Code
         :param value: Data
-        :return: Win32 API return
+        :param verify: None: 根据 verify_policy 决定, False: 不校验 (调用者自己确认结果)
+        :return: Win32 API return, 校验失败时返回 False
         """
         if code is None:
             _LOGGER.error('vcp code to send is None. ignored.')
             return False
+        if code in self._broken_codes:
+            _LOGGER.warning('%s: vcp code 0x%02X is marked as broken. ignored.', self.monitor_id, code)
+            return False
         
-        api_call = ctypes.windll.Dxva2.SetVCPFeature
-        code = wintypes.BYTE(code)
-        new_value = wintypes.DWORD(value)
-        api_call.restype = ctypes.c_bool
-        ret_ = api_call(self._phy_monitor_handle, code, new_value)
-        if not ret_:
-            _LOGGER.error('send vcp command failed: ' + hex(code))
-            _LOGGER.error(ctypes.WinError())
+        with self._flight_lock:
+            self._dedup_counters['writes'] += 1
+            flight = self._write_flights.get(code)
+            leader = flight is None
+            if leader:
+                flight = self._write_flights[code] = _Flight(value, verify)
+            else:
+                # 前一个写入还在等待总线: 改为写入最新的值
+                flight.value, flight.verify = value, verify
+                if flight.done is None:
+                    flight.done = threading.Event()
+        if not leader:
+            flight.done.wait()
+            return flight.result
+        
+        debug_ = _LOGGER.isEnabledFor(logging.DEBUG)
+        start = time.perf_counter() if debug_ else 0
+        tracer = vcp_profile.TRACER
+        span_ = None if tracer is None else tracer.begin('send_vcp_code(0x{:02X})'.format(code),
+                                                         {'monitor': self.monitor_id})
+        ret_ = False
+        try:
+            budget = _WRITE_BUDGET
+            if budget is not None and budget.is_persistent(code):
+                delay = budget.reserve(self, code)
+                if delay is None:
+                    _LOGGER.warning('%s: EEPROM write budget exhausted, vcp code 0x%02X not written.',
+                                    self.monitor_id, code)
+                    return False
+                if delay:
+                    # 距离上一次持久写入太近: 等待, 期间同一个 code 的写入合并为最后一次
+                    time.sleep(delay)
+            with self._lock:
+                with self._flight_lock:
+                    # 开始写入之后的写入者等待下一次写入
+                    del self._write_flights[code]
+                    value, verify = flight.value, flight.verify
+                    self._dedup_counters['write_transactions'] += 1
+                ret_ = self._set_vcp_feature(code, value)
+                if ret_ and self._command_delay:
+                    time.sleep(self._command_delay)
+                if ret_ and verify is not False and self._need_verify(code):
+                    ret_ = self._verify_write(code, value)
+                if ret_ and code not in vcp_code.WRITE_ONLY_CODES:
+                    cached = self._value_cache.get(code)
+                    self._value_cache[code] = (self._remap_value(code, value), cached[1] if cached else 0,
+                                               time.monotonic())
+        finally:
+            with self._flight_lock:
+                # 没有开始写入就退出 (预算用完, reserve() 或 sleep() 抛出异常): 不要留下已经结束的 flight
+                if self._write_flights.get(code) is flight:
+                    del self._write_flights[code]
+                flight.result = ret_
+                done = flight.done
+            if done is not None:
+                done.set()
+            if span_ is not None:
+                span_.end(value=flight.value, result=ret_)
+        if debug_:
+            _log_vcp_call(self.monitor_id, 'set', code, value, ret_, start)
         return ret_
     
     def read_vcp_code(self, code: int) -> Tuple[int, int]:
         """
         send vcp code to monitor, get current value and max value.
-        
-        https://msdn.microsoft.com/en-us/library/dd692953(v=vs.85).aspx
-        BOOL GetVCPFeatureAndVCPFeatureReply(
-            _In_   HANDLE hMonitor,
-            _In_   BYTE bVCPCode,
-            _Out_  LPMC_VCP_CODE_TYPE pvct,
-            _Out_  LPDWORD pdwCurrentValue,
-            _Out_  LPDWORD pdwMaximumValue
-        );
+        读取到的值根据 quirks 转换
         
         :param code: VCP Code
         :return: current_value, max_value
@@ -277,26 +1213,141 @@ class PhyMonitor(object):
         if code is None:
             _LOGGER.error('vcp code to send is None. ignored.')
             return 0, 0
+        if code in self._broken_codes:
+            _LOGGER.warning('%s: vcp code 0x%02X is marked as broken. ignored.', self.monitor_id, code)
+            return 0, 0
         
-        api_call = ctypes.windll.Dxva2.GetVCPFeatureAndVCPFeatureReply
-        api_in_vcp_code = wintypes.BYTE(code)
-        api_out_current_value = wintypes.DWORD()
-        api_out_max_value = wintypes.DWORD()
-        
-        if not api_call(self._phy_monitor_handle, api_in_vcp_code, None,
-                        ctypes.byref(api_out_current_value), ctypes.byref(api_out_max_value)):
-            _LOGGER.error('get vcp command failed: ' + hex(code))
-            _LOGGER.error(ctypes.WinError())
-        return api_out_current_value.value, api_out_max_value.value
+        with self._flight_lock:
+            self._dedup_counters['reads'] += 1
+            flight = self._read_flights.get(code)
+            leader = flight is None
+            if leader:
+                flight = self._read_flights[code] = _Flight()
+            elif flight.done is None:
+                flight.done = threading.Event()
+        if not leader:
+            # 同一个 code 的读取正在进行，共享它的结果
+            flight.done.wait()
+            return flight.result
+
+        debug_ = _LOGGER.isEnabledFor(logging.DEBUG)
+        start = time.perf_counter() if debug_ else 0
+        tracer = vcp_profile.TRACER
+        span_ = None if tracer is None else tracer.begin('read_vcp_code(0x{:02X})'.format(code),
+                                                         {'monitor': self.monitor_id})
+        ret_, current_value, max_value = False, 0, 0
+        try:
+            with self._lock:
+                ret_, current_value, max_value = self._get_vcp_feature(code)
+                current_value = self._remap_value(code, current_value)
+                if ret_:
+                    self._value_cache[code] = (current_value, max_value, time.monotonic())
+                with self._flight_lock:
+                    # 在释放总线之前移除: 之后的写入完成后开始的读取不会得到旧的值
+                    del self._read_flights[code]
+                    self._dedup_counters['read_transactions'] += 1
+        finally:
+            with self._flight_lock:
+                if self._read_flights.get(code) is flight:
+                    del self._read_flights[code]
+                flight.result = current_value, max_value
+                done = flight.done
+            if done is not None:
+                done.set()
+            if span_ is not None:
+                span_.end(value=current_value, result=ret_)
+        if debug_:
+            _log_vcp_call(self.monitor_id, 'get', code, (current_value, max_value), ret_, start)
+        return current_value, max_value
         
-    def set_vcp_value_by_name(self, vcp_code_key: str, value: int) -> bool:
+    def cached_vcp_value(self, code: int, max_age: float) -> Tuple[int, int]:
+        """
+        最近一次成功读取或写入的值，不访问显示器
+        :param code: VCP Code
+        :param max_age: 允许的最长时间(秒)
+        :return: current_value, max_value (写入后 max_value 沿用之前读取的值，未知为 0); 没有足够新的值时返回 None
+        """
+        cached = self._value_cache.get(code)
+        if cached is None or time.monotonic() - cached[2] > max_age:
+            return None
+        return cached[0], cached[1]
+
+    def cached_vcp_time(self, code: int) -> float:
+        """
+        最近一次成功读取或写入的时间，读取失败时不更新
+        :param code: VCP Code
+        :return: time.monotonic() 时间戳; 没有成功读写过返回 None
+        """
+        cached = self._value_cache.get(code)
+        return None if cached is None else cached[2]
+
+    def cached_vcp_values(self) -> dict:
+        """
+        所有缓存的值，不访问显示器
+        :return: {code: (current_value, max_value, time.time() 时间戳)}
+        """
+        offset = time.time() - time.monotonic()
+        return {code: (value, max_value, ts + offset) for code, (value, max_value, ts) in
+                list(self._value_cache.items())}
+
+    @property
+    def dedup_stats(self) -> dict:
+        """
+        并发调用合并的统计
+        :return: {'reads', 'read_transactions', 'reads_shared', 'writes', 'write_transactions', 'writes_collapsed',
+                  'saved': 节省的 DDC/CI 调用次数}
+        """
+        with self._flight_lock:
+            stats = dict(self._dedup_counters)
+        stats['reads_shared'] = stats['reads'] - stats['read_transactions']
+        stats['writes_collapsed'] = stats['writes'] - stats['write_transactions']
+        stats['saved'] = stats['reads_shared'] + stats['writes_collapsed']
+        return stats
+    
+    def supports_vcp_code(self, code: int) -> bool:
+        """
+        caps string 中是否列出了这个 VCP code. 无法解析 caps string 时认为支持
+        :param code: VCP Code
+        :return:
+        """
+        if code in self._broken_codes:
+            return False
+        if not self.vcp_caps:
+            return True
+        return code in self.vcp_caps
+    
+    def supported_values(self, code: int) -> tuple:
+        """
+        caps string 中列出的某个 VCP code 可选的值
+        :param code: VCP Code
+        :return: 没有列出时返回 None
+        """
+        return self.vcp_caps.get(code)
+    
+    def supported_options(self, property_name: str) -> list:
+        """
+        caps string 中列出的某个属性可以设置的值
+        :param property_name: PROPERTY_CHOICES 中的属性, 如 'input_src'
+        :return: 选项名称; caps string 没有列出可选的值时返回全部选项, 不支持这个功能时返回 []
+        """
+        choices = PROPERTY_CHOICES[property_name]
+        code = vcp_code.VCP_CODE[PROPERTY_CODES[property_name]]
+        if not self.supports_vcp_code(code):
+            return []
+        values = self.supported_values(code)
+        if not values:
+            return list(choices)
+        return [k for k, v in choices.items() if v in values]
+    
+    def set_vcp_value_by_name(self, vcp_code_key: str, value: int, verify: bool = None) -> bool:
         """
         根据功能名称发送vcp code和数据
         :param vcp_code_key: key name of vcp_code.VCP_CODE dict
         :param value: new value
+        :param verify: 参见 send_vcp_code()
         :return:
         """
-        return self.send_vcp_code(vcp_code.VCP_CODE.get(vcp_code_key), value)
+        return self.send_vcp_code(vcp_code.VCP_CODE.get(vcp_code_key), value, verify)
     
     def get_vcp_value_by_name(self, vcp_code_key: str) -> Tuple[int, int]:
         """
@@ -305,7 +1356,89 @@ class PhyMonitor(object):
         :return: current_value, max_value
         """
         return self.read_vcp_code(vcp_code.VCP_CODE.get(vcp_code_key))
-    
+
+    def set_property(self, name: str, value) -> bool:
+        """
+        设置属性. 和属性的 setter 相同，但是无效的值抛出异常，并返回写入的结果
+        :param name: PROPERTY_TYPES 中的属性, 或者 vcp_code.VCP_CODE 中的功能名称 (值为原始值)
+        :param value: PROPERTY_TYPES 中的类型
+        :return: send_vcp_code() 的结果, 读取最大值等失败时返回 False
+        :raise ValueError: 值无效、超出范围或者显示器不支持
+        :raise AttributeError: 不能设置的属性
+        """
+        if name in vcp_code.VCP_CODE:
+            code = vcp_code.VCP_CODE[name]
+            if value < 0:
+                raise ValueError('invalid {}: {}'.format(name, value))
+            values = self.supported_values(code)
+            if values:
+                if value not in values:
+                    raise ValueError('invalid {}: {}, available: {}'.format(name, value, list(values)))
+            elif code not in vcp_code.WRITE_ONLY_CODES:
+                max_ = self._max_value(name)
+                if max_ > 0 and value > max_:
+                    raise ValueError('invalid {}: {}, allowed: 0-{}'.format(name, value, max_))
+            return self.send_vcp_code(code, value)
+
+        if name in PROPERTY_LEVEL_CODES:
+            vcp_code_key = PROPERTY_LEVEL_CODES[name]
+            if (vcp_code.VCP_CODE[vcp_code_key] in vcp_code.AUDIO_CODES and
+                    not self.supports_vcp_code(vcp_code.VCP_CODE[vcp_code_key])):
+                raise ValueError('{} not supported'.format(vcp_code_key))
+            max_ = self._max_value(vcp_code_key)
+            if max_ <= 0:
+                _LOGGER.error('%s: unable to read max value of %s', self.monitor_id, vcp_code_key)
+                return False
+            if value < 0 or value > max_:
+                raise ValueError('invalid {}: {}, allowed: 0-{}'.format(name, value, max_))
+            return self.set_vcp_value_by_name(vcp_code_key, value)
+
+        if name in PROPERTY_CHOICES:
+            choices = PROPERTY_CHOICES[name]
+            if value not in choices:
+                raise ValueError('invalid {}: {}, available: {}'.format(name, value, list(choices)))
+            code = vcp_code.VCP_CODE[PROPERTY_CODES[name]]
+            if code in vcp_code.AUDIO_CODES and not self.supports_vcp_code(code):
+                raise ValueError('{} not supported'.format(PROPERTY_CODES[name]))
+            return self.send_vcp_code(code, choices[value])
+
+        if name == 'color_temperature':
+            increment = self.get_vcp_value_by_name('User Color Temperature Increment')[0]
+            if increment == 0:
+                _LOGGER.error('%s: invalid color temperature increment: 0', self.monitor_id)
+                return False
+            new_value = (value - self.quirk['color_temp_base']) // increment
+            max_ = self._max_value('User Color Temperature')
+            if new_value < 0 or (max_ > 0 and new_value > max_):
+                raise ValueError('invalid color temperature: {}, allowed: {}-{}'.format(
+                    value, self.quirk['color_temp_base'], self.quirk['color_temp_base'] + max_ * increment))
+            return self.set_vcp_value_by_name('User Color Temperature', new_value)
+
+        if name == 'rgb_gain':
+            try:
+                rg, gg, bg = value
+            except (TypeError, ValueError):
+                raise ValueError('invalid RGB value: {!r}, expected (red, green, blue)'.format(value))
+            for channel, max_ in zip((rg, gg, bg), self.rgb_gain_max_channels):
+                if channel < 0 or channel > max_:
+                    raise ValueError('invalid RGB value: {}, allowed: 0-{}'.format(channel, max_))
+            # 三个颜色都写入, 任何一个失败都返回 False
+            results = [self.set_vcp_value_by_name('Video Gain Red', rg),
+                       self.set_vcp_value_by_name('Video Gain Green', gg),
+                       self.set_vcp_value_by_name('Video Gain Blue', bg)]
+            return all(results)
+
+        raise AttributeError('{} is read-only'.format(name))
+
+    def _set_property_or_warn(self, name: str, value):
+        """
+        属性的 setter: 无效的值只输出警告
+        """
+        try:
+            self.set_property(name, value)
+        except ValueError as err:
+            _LOGGER.warning('%s: %s', self.monitor_id, err)
+
     # ########################### 经过包装后方便调用的属性/方法
     
     def reset_factory(self):
@@ -319,17 +1452,15 @@ class PhyMonitor(object):
     def color_temperature(self):
         increment = self.get_vcp_value_by_name('User Color Temperature Increment')[0]
         current = self.get_vcp_value_by_name('User Color Temperature')[0]
-        return 3000 + current * increment
+        return self.quirk['color_temp_base'] + current * increment
     
     @color_temperature.setter
     def color_temperature(self, value: int):
-        increment = self.get_vcp_value_by_name('User Color Temperature Increment')[0]
-        new_value = (value - 3000) // increment
-        self.set_vcp_value_by_name('User Color Temperature', new_value)
+        self._set_property_or_warn('color_temperature', value)
     
     @property
     def brightness_max(self):
-        return self.get_vcp_value_by_name('Luminance')[1]
+        return self._max_value('Luminance')
     
     @property
     def brightness(self):
@@ -342,16 +1473,11 @@ class PhyMonitor(object):
         :param value:
         :return:
         """
-        brightness_max = self.brightness_max
-        if value < 0 or value > brightness_max:
-            _LOGGER.warning('invalid brightness level: {}, allowed: 0-{}'.format(
-                value, brightness_max))
-            return
-        self.set_vcp_value_by_name('Luminance', value)
+        self._set_property_or_warn('brightness', value)
 
     @property
     def contrast_max(self):
-        return self.get_vcp_value_by_name('Contrast')[1]
+        return self._max_value('Contrast')
     
     @property
     def contrast(self):
@@ -359,12 +1485,7 @@ class PhyMonitor(object):
     
     @contrast.setter
     def contrast(self, value):
-        contrast_max = self.contrast_max
-        if value < 0 or value > contrast_max:
-            _LOGGER.warning('invalid contrast level: {}, allowed: 0-{}'.format(
-                value, contrast_max))
-            return
-        self.set_vcp_value_by_name('Contrast', value)
+        self._set_property_or_warn('contrast', value)
     
     @property
     def color_preset_list(self) -> list:
@@ -388,20 +1509,26 @@ class PhyMonitor(object):
     
     @color_preset.setter
     def color_preset(self, preset: str):
-        if preset not in self.color_preset_list:
-            _LOGGER.warning('invalid color preset: {}, available:{}'.format(
-                preset, self.color_preset_list))
-            return
-        self.set_vcp_value_by_name('Select Color Preset', vcp_code.COLOR_PRESET_CODE.get(preset))
+        self._set_property_or_warn('color_preset', preset)
     
     @property
     def rgb_gain_max(self):
         """
         最大允许设置的RGB值
-        ! 只取红色的RGB最大值作为3个颜色的参考
+        ! 只取红色的RGB最大值作为3个颜色的参考, 每个颜色的最大值参见 rgb_gain_max_channels
         :return:
         """
-        return self.get_vcp_value_by_name('Video Gain Red')[1]
+        return self._max_value('Video Gain Red')
+    
+    @property
+    def rgb_gain_max_channels(self) -> Tuple[int, int, int]:
+        """
+        每个颜色最大允许设置的值
+        :return: Red, Green, Blue
+        """
+        return (self._max_value('Video Gain Red'),
+                self._max_value('Video Gain Green'),
+                self._max_value('Video Gain Blue'))
     
     @property
     def rgb_gain(self) -> Tuple[int, int, int]:
@@ -416,33 +1543,7 @@ class PhyMonitor(object):
     
     @rgb_gain.setter
     def rgb_gain(self, value_pack):
-        max_ = self.rgb_gain_max
-        
-        # 检查传入参数
-        def check_input(value) -> bool:
-            """
-            检查传入的RGB gain
-            :param value:
-            :return:
-            """
-            if value < 0 or value > max_:
-                _LOGGER.warning('invalid RGB value: {}, allowed: 0-{}'.format(
-                    value, max_))
-                return False
-            return True
-        try:
-            rg = value_pack[0]
-            gg = value_pack[1]
-            bg = value_pack[2]
-        except Exception as err:
-            _LOGGER.error(err)
-            return
-        if not (check_input(rg) and check_input(gg) and check_input(bg)):
-            return
-        # 设置 RGB Gain
-        self.set_vcp_value_by_name('Video Gain Red', rg)
-        self.set_vcp_value_by_name('Video Gain Green', gg)
-        self.set_vcp_value_by_name('Video Gain Blue', bg)
+        self._set_property_or_warn('rgb_gain', value_pack)
     
     def auto_setup_perform(self):
         """
@@ -477,11 +1578,7 @@ class PhyMonitor(object):
 
     @osd_language.setter
     def osd_language(self, language: str):
-        if language not in self.osd_languages_list:
-            _LOGGER.warning('invalid OSD Language: {}, available:{}'.format(
-                language, self.osd_languages_list))
-            return
-        self.set_vcp_value_by_name('OSD Language', vcp_code.OSD_LANG_CODE.get(language))
+        self._set_property_or_warn('osd_language', language)
 
     @property
     def power_mode_list(self) -> list:
@@ -497,16 +1594,15 @@ class PhyMonitor(object):
         for i in list(vcp_code.POWER_MODE_CODE.keys()):
             if vcp_code.POWER_MODE_CODE[i] == power_:
                 return i
-        # return 'off' to fix quirky, example: when power-off, it return 0x02
-        return 'off'
+        # 关机后返回 0x02 等值一般由 value_remap 转换为 0x05; 自定义 quirk 覆盖了转换时也认为是关机
+        if power_ in vcp_code.POWER_MODE_OFF_VALUES:
+            return 'off'
+        _LOGGER.debug('%s: unknown power mode: 0x%02X', self.monitor_id, power_)
+        return self.quirk['power_mode_unknown']
 
     @power_mode.setter
     def power_mode(self, mode: str):
-        if mode not in self.power_mode_list:
-            _LOGGER.warning('invalid power mode: {}, available:{}'.format(
-                mode, self.power_mode_list))
-            return
-        self.set_vcp_value_by_name('Power Mode', vcp_code.POWER_MODE_CODE.get(mode))
+        self._set_property_or_warn('power_mode', mode)
 
     @property
     def input_src_list(self) -> list:
@@ -526,12 +1622,84 @@ class PhyMonitor(object):
 
     @input_src.setter
     def input_src(self, src: str):
-        if src not in self.input_src_list:
-            _LOGGER.warning('invalid input source: {}, available:{}'.format(
-                src, self.input_src_list))
-            return
-        self.set_vcp_value_by_name('Input Source', vcp_code.INPUT_SRC_CODE.get(src))
+        self._set_property_or_warn('input_src', src)
 
+    # ########################## 音频
+    # 没有扬声器的显示器 caps string 中不列出音频功能: 读取返回 None, 设置被忽略, 都不访问显示器
+    
+    def _audio_level(self, vcp_code_key: str):
+        if not self.supports_vcp_code(vcp_code.VCP_CODE[vcp_code_key]):
+            return None
+        return self.get_vcp_value_by_name(vcp_code_key)[0]
+    
+    @property
+    def has_audio(self) -> bool:
+        """
+        caps string 中列出了音量或静音
+        """
+        return any(self.supports_vcp_code(vcp_code.VCP_CODE[i]) for i in
+                   ('Audio: Speaker Volume', 'Audio: Mute (screen blank)'))
+    
+    @property
+    def volume_max(self):
+        return self._max_value('Audio: Speaker Volume')
+    
+    @property
+    def volume(self):
+        """
+        扬声器音量, 不支持时为 None
+        """
+        return self._audio_level('Audio: Speaker Volume')
+    
+    @volume.setter
+    def volume(self, value: int):
+        self._set_property_or_warn('volume', value)
+    
+    @property
+    def audio_mute(self):
+        """
+        静音状态: 'on' / 'off', 不支持或者未知时为 None
+        """
+        value = self._audio_level('Audio: Mute (screen blank)')
+        if value is None:
+            return None
+        value &= vcp_code.AUDIO_MUTE_MASK
+        for i in list(vcp_code.AUDIO_MUTE_CODE.keys()):
+            if vcp_code.AUDIO_MUTE_CODE[i] == value:
+                return i
+        return None
+    
+    @audio_mute.setter
+    def audio_mute(self, mute: str):
+        self._set_property_or_warn('audio_mute', mute)
+    
+    @property
+    def audio_balance(self):
+        """
+        左右平衡, 一般 0-100, 50 为居中; 不支持时为 None
+        """
+        return self._audio_level('Audio: Balance L/R')
+    
+    @audio_balance.setter
+    def audio_balance(self, value: int):
+        self._set_property_or_warn('audio_balance', value)
+    
+    @property
+    def audio_bass(self):
+        return self._audio_level('Audio: Bass')
+    
+    @audio_bass.setter
+    def audio_bass(self, value: int):
+        self._set_property_or_warn('audio_bass', value)
+    
+    @property
+    def audio_treble(self):
+        return self._audio_level('Audio: Treble')
+    
+    @audio_treble.setter
+    def audio_treble(self, value: int):
+        self._set_property_or_warn('audio_treble', value)
+    
     @property
     def info_pannel_type(self) -> str:
         pannel_type = self.get_vcp_value_by_name('Flat Panel Sub-Pixel Layout')[0]
@@ -562,7 +1730,7 @@ if __name__ == '__main__':
             _LOGGER.error(os_err)
             # 忽略这个显示器并继续
             continue
-        _LOGGER.info('found {}'.format(monitor.model))
+        _LOGGER.info('found %s', monitor.model)
         phy_monitors.append(monitor)
 
     test_monitor = phy_monitors[0]
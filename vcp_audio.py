@@ -0,0 +1,135 @@
+# coding = utf-8
+
+import math
+import time
+import logging
+import vcp_code
+import vcp_fleet
+
+"""
+多台显示器的扬声器音量和静音.
+
+ramp_volume() 把每台显示器的音量在 duration 秒内逐步调整到目标值，避免音量突变；
+相邻两次写入的间隔不小于 MIN_STEP_INTERVAL (DDC/CI 要求两条命令之间至少 50ms)，步数不超过音量的变化量。
+不同显示器并行调整，同一台显示器的写入由 PhyMonitor 串行化。
+
+caps string 中没有列出音量 (0x62) 或静音 (0x8D) 的显示器没有扬声器，直接跳过，不访问显示器。
+音量和静音不会保存到 EEPROM，不受写入预算限制。
+
+    vcp_audio.set_mute(phy_monitors, False)
+    vcp_audio.ramp_volume(phy_monitors, 60, duration=2.0)
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+# DDC/CI 两条命令之间的最小间隔(秒)
+MIN_STEP_INTERVAL = 0.05
+# 默认的调整间隔(秒)
+DEFAULT_STEP_INTERVAL = 0.1
+# 默认的调整时间(秒)
+DEFAULT_RAMP_DURATION = 1.0
+
+_VOLUME = vcp_code.VCP_CODE['Audio: Speaker Volume']
+_MUTE = vcp_code.VCP_CODE['Audio: Mute (screen blank)']
+
+
+def ramp_steps(start: int, target: int, duration: float, step_interval: float = DEFAULT_STEP_INTERVAL) -> list:
+    """
+    :param start: 当前音量
+    :param target: 目标音量
+    :param duration: 调整时间(秒), 0 直接写入目标值
+    :param step_interval: 相邻两次写入的间隔(秒), 不小于 MIN_STEP_INTERVAL
+    :return: [(相对于开始的时间, 音量), ...], 最后一项为目标值; 音量没有变化时为 []
+    """
+    delta = target - start
+    if delta == 0:
+        return []
+    step_interval = max(step_interval, MIN_STEP_INTERVAL)
+    # 向下取整: 间隔不小于 step_interval; 浮点误差 (如 0.3 / 0.05 = 5.999...) 只会减少步数
+    count = max(1, min(abs(delta), int(math.floor(duration / step_interval))))
+    # 写入本身需要时间, 按间隔排列, 总时间不超过 duration
+    interval = max(duration / count, step_interval) if count > 1 else 0.0
+    return [(interval * i, start + int(round(delta * (i + 1) / count))) for i in range(count)]
+
+
+def ramp_volume(phy_monitors: list, target: int, duration: float = DEFAULT_RAMP_DURATION,
+                step_interval: float = DEFAULT_STEP_INTERVAL, max_workers: int = vcp_fleet.DEFAULT_MAX_WORKERS,
+                pool=None, timeout: float = None) -> dict:
+    """
+    同时把多台显示器的音量逐步调整到 target
+    :param phy_monitors: vcp.PhyMonitor() instance(s)
+    :param target: 目标音量, 超过显示器的最大值时使用最大值
+    :param duration: 调整时间(秒)
+    :param step_interval: 相邻两次写入的间隔(秒), 不小于 MIN_STEP_INTERVAL
+    :param max_workers: 最大线程数
+    :param pool: vcp_worker.WorkerPool, 参见 vcp_fleet.run_parallel()
+    :param timeout: 整个操作的截止时间(秒), 参见 vcp_fleet.run_parallel()
+    :return: {monitor_id: {'ok': bool, 'skipped': bool, 'from': 音量, 'to': 音量, 'steps': 写入次数,
+                           'latency': 秒}}
+    """
+    if target < 0:
+        raise ValueError('invalid volume: {}'.format(target))
+
+    def ramp(monitor):
+        started = time.monotonic()
+        current, volume_max = monitor.read_vcp_code(_VOLUME)
+        if volume_max <= 0:
+            return {'ok': False, 'skipped': False, 'from': None, 'to': None, 'steps': 0, 'latency': None}
+        to = min(target, volume_max)
+        steps = ramp_steps(current, to, duration, step_interval)
+        ok = True
+        written = 0
+        for offset, volume in steps:
+            delay = started + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            # 中间值不校验, 最后一次按校验策略
+            ok = monitor.send_vcp_code(_VOLUME, volume, verify=None if volume == to else False)
+            written += 1
+            if not ok:
+                break
+        return {'ok': ok, 'skipped': False, 'from': current, 'to': to if ok else None, 'steps': written,
+                'latency': round(time.monotonic() - started, 3)}
+
+    return _run_audio(ramp, _VOLUME, phy_monitors, max_workers, pool, timeout)
+
+
+def set_mute(phy_monitors: list, mute: bool, max_workers: int = vcp_fleet.DEFAULT_MAX_WORKERS, pool=None,
+             timeout: float = None) -> dict:
+    """
+    同时设置多台显示器的静音
+    :param phy_monitors: vcp.PhyMonitor() instance(s)
+    :param mute: True 静音, False 取消静音
+    :param max_workers: 最大线程数
+    :param pool: vcp_worker.WorkerPool, 参见 vcp_fleet.run_parallel()
+    :param timeout: 整个操作的截止时间(秒), 参见 vcp_fleet.run_parallel()
+    :return: {monitor_id: {'ok': bool, 'skipped': bool, 'latency': 秒}}
+    """
+    value = vcp_code.AUDIO_MUTE_CODE['on' if mute else 'off']
+
+    def write(monitor):
+        started = time.monotonic()
+        ok = monitor.send_vcp_code(_MUTE, value)
+        return {'ok': ok, 'skipped': False, 'latency': round(time.monotonic() - started, 3)}
+
+    return _run_audio(write, _MUTE, phy_monitors, max_workers, pool, timeout)
+
+
+def _run_audio(func, code: int, phy_monitors: list, max_workers: int, pool, timeout: float) -> dict:
+    """
+    对 caps string 中列出了 code 的显示器并行执行 func, 其它显示器返回 skipped
+    :return: {monitor_id: func 的结果}
+    """
+    result = {}
+    supported = []
+    for monitor in phy_monitors:
+        if monitor.supports_vcp_code(code):
+            supported.append(monitor)
+        else:
+            _LOGGER.info('%s: no audio (0x%02X), skipped', monitor.monitor_id, code)
+            result[monitor.monitor_id] = {'ok': True, 'skipped': True}
+    for monitor, report, err in vcp_fleet.run_parallel(func, supported, max_workers, pool=pool, timeout=timeout):
+        if err is not None:
+            report = {'ok': False, 'skipped': False, 'error': str(err)}
+        result[monitor.monitor_id] = report
+    return {i.monitor_id: result[i.monitor_id] for i in phy_monitors}
@@ -0,0 +1,264 @@
+# coding = utf-8
+
+import ast
+import time
+import shlex
+import logging
+import operator
+from collections import namedtuple
+import vcp
+import vcp_code
+import vcp_fleet
+
+"""
+批处理脚本.
+
+一个进程中对选中的显示器按顺序执行多个步骤，不同显示器并行执行。每行一个步骤，# 开头为注释:
+
+    set input_src "DisplayPort 1"
+    wait input_src == "DisplayPort 1" timeout=10 interval=0.5
+    sleep 1
+    set color_preset sRGB
+    set brightness 40
+    get brightness
+    assert brightness == 40
+    set "Audio: Speaker Volume" 20
+
+属性名可以是 PhyMonitor 的属性 (vcp.PROPERTY_TYPES 以及其它只读属性)，也可以是 vcp_code.VCP_CODE 中的功能名称。
+get / assert 优先使用之前步骤读取到的值，set 之后受影响的属性 (按 VCP code，如 set color_preset 之后的 rgb_gain)
+会重新读取；wait 每次都从显示器读取。set 的值无效或者写入失败时这台显示器停止执行。
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+STEP_OPS = ('set', 'get', 'wait', 'sleep', 'assert')
+
+COMPARE_OPS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+DEFAULT_WAIT_TIMEOUT = 10.0
+DEFAULT_WAIT_INTERVAL = 0.5
+
+# line: 脚本中的行号
+Step = namedtuple('Step', ('op', 'prop', 'compare', 'value', 'options', 'line'))
+
+
+def convert_value(prop: str, text: str):
+    """
+    把脚本中的字符串转换为属性需要的类型
+    :param prop: 属性名或 VCP 功能名称
+    :param text:
+    :return:
+    :raise ValueError: 不能转换为属性需要的类型
+    """
+    value_type = int if prop in vcp_code.VCP_CODE else vcp.PROPERTY_TYPES.get(prop)
+    try:
+        if value_type is tuple:
+            value = ast.literal_eval(text)
+            if not isinstance(value, (tuple, list)) or not all(isinstance(i, int) for i in value):
+                raise ValueError('not a tuple of integers')
+            return tuple(value)
+        if value_type is int:
+            return int(text, 0)
+    except (ValueError, SyntaxError, TypeError) as err:
+        raise ValueError('invalid value for {}: {!r} ({})'.format(prop, text, err))
+    if value_type is str:
+        return text
+    # 只读属性: 尽量转换为数字
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def _parse_seconds(text: str, name: str) -> float:
+    try:
+        seconds = float(text)
+    except ValueError:
+        raise ValueError('invalid {}: {!r}'.format(name, text))
+    if not 0 <= seconds < float('inf'):
+        raise ValueError('invalid {}: {!r}'.format(name, text))
+    return seconds
+
+
+def _parse_options(tokens: list) -> dict:
+    options = {}
+    for token in tokens:
+        key, sep, value = token.partition('=')
+        if not sep or key not in ('timeout', 'interval'):
+            raise ValueError('invalid option: {}'.format(token))
+        options[key] = _parse_seconds(value, key)
+    return options
+
+
+def _parse_step(op: str, args: list, line_no: int) -> Step:
+    """
+    :raise ValueError: 没有行号的错误信息
+    """
+    if op == 'sleep':
+        if len(args) != 1:
+            raise ValueError('usage: sleep SECONDS')
+        return Step(op, None, None, _parse_seconds(args[0], 'sleep duration'), {}, line_no)
+    if op == 'get':
+        if len(args) != 1:
+            raise ValueError('usage: get PROPERTY')
+        return Step(op, args[0], None, None, {}, line_no)
+    if op == 'set':
+        if len(args) != 2:
+            raise ValueError('usage: set PROPERTY VALUE')
+        return Step(op, args[0], None, convert_value(args[0], args[1]), {}, line_no)
+    if op in ('wait', 'assert'):
+        if len(args) < 3 or args[1] not in COMPARE_OPS:
+            raise ValueError('usage: {} PROPERTY OP VALUE [timeout=S interval=S]'.format(op))
+        options = _parse_options(args[3:])
+        if op == 'assert' and options:
+            raise ValueError('assert takes no options')
+        return Step(op, args[0], args[1], convert_value(args[0], args[2]), options, line_no)
+    raise ValueError('unknown step: {}, available: {}'.format(op, STEP_OPS))
+
+
+def parse_script(text: str) -> list:
+    """
+    解析批处理脚本
+    :param text:
+    :return: [Step, ...]
+    :raise ValueError: 'line N: ...'
+    """
+    steps = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        try:
+            tokens = shlex.split(line, comments=True)
+            if tokens:
+                steps.append(_parse_step(tokens[0].lower(), tokens[1:], line_no))
+        except ValueError as err:
+            raise ValueError('line {}: {}'.format(line_no, err))
+    return steps
+
+
+def parse_file(path: str) -> list:
+    """
+    解析批处理脚本文件
+    :param path:
+    :return: [Step, ...]
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_script(f.read())
+
+
+class BatchRunner(object):
+    """
+    对多台显示器执行批处理步骤
+    """
+    def __init__(self, steps: list, max_workers: int = vcp_fleet.DEFAULT_MAX_WORKERS):
+        self.steps = list(steps)
+        self.max_workers = max_workers
+
+    @staticmethod
+    def _read(monitor, prop: str):
+        if prop in vcp_code.VCP_CODE:
+            return monitor.get_vcp_value_by_name(prop)[0]
+        return getattr(monitor, prop)
+
+    @staticmethod
+    def _write(monitor, prop: str, value):
+        if prop not in vcp_code.VCP_CODE and prop not in vcp.PROPERTY_TYPES:
+            raise AttributeError('{} is read-only'.format(prop))
+        # 无效的值抛出 ValueError
+        if not monitor.set_property(prop, value):
+            raise RuntimeError('set {} failed'.format(prop))
+
+    @staticmethod
+    def _invalidate(cache: dict, prop: str):
+        """
+        删除写入 prop 后可能改变的缓存
+        """
+        written = vcp.written_vcp_codes(prop)
+        for name in list(cache):
+            codes = vcp.property_vcp_codes(name)
+            if written is None or codes is None or codes & written:
+                del cache[name]
+
+    def run_monitor(self, monitor) -> dict:
+        """
+        对一台显示器执行所有步骤，失败时停止
+        :param monitor: vcp.PhyMonitor()
+        :return: {'monitor': monitor_id, 'model': model, 'ok': bool, 'results': [(line, op, prop, value), ...],
+                  'error': str}
+        """
+        cache = {}
+        results = []
+
+        def cached_read(prop):
+            if prop not in cache:
+                cache[prop] = self._read(monitor, prop)
+            return cache[prop]
+
+        report = {'monitor': monitor.monitor_id, 'model': monitor.model, 'ok': True, 'results': results,
+                  'error': ''}
+        for step in self.steps:
+            try:
+                if step.op == 'sleep':
+                    time.sleep(step.value)
+                    value = step.value
+                elif step.op == 'set':
+                    try:
+                        self._write(monitor, step.prop, step.value)
+                    finally:
+                        self._invalidate(cache, step.prop)
+                    value = step.value
+                elif step.op == 'get':
+                    value = cached_read(step.prop)
+                elif step.op == 'assert':
+                    value = cached_read(step.prop)
+                    if not COMPARE_OPS[step.compare](value, step.value):
+                        raise AssertionError('{} = {!r}, expected {} {!r}'.format(
+                            step.prop, value, step.compare, step.value))
+                else:
+                    value = self._wait(monitor, step)
+                    cache[step.prop] = value
+            except Exception as err:
+                report['ok'] = False
+                report['error'] = 'line {}: {}: {}'.format(step.line, step.op, err)
+                _LOGGER.error('%s: %s', monitor.monitor_id, report['error'])
+                break
+            results.append((step.line, step.op, step.prop, value))
+        return report
+
+    def _wait(self, monitor, step: Step):
+        """
+        轮询直到条件满足或超时
+        :param monitor:
+        :param step:
+        :return: 最后读取到的值
+        """
+        timeout = step.options.get('timeout', DEFAULT_WAIT_TIMEOUT)
+        interval = step.options.get('interval', DEFAULT_WAIT_INTERVAL)
+        deadline = time.monotonic() + timeout
+        while True:
+            value = self._read(monitor, step.prop)
+            if COMPARE_OPS[step.compare](value, step.value):
+                return value
+            if time.monotonic() + interval > deadline:
+                raise TimeoutError('{} = {!r}, waiting for {} {!r} timed out after {}s'.format(
+                    step.prop, value, step.compare, step.value, timeout))
+            time.sleep(interval)
+
+    def run(self, phy_monitors: list) -> list:
+        """
+        并行对每台显示器执行所有步骤
+        :param phy_monitors: vcp.PhyMonitor() instance(s)
+        :return: [run_monitor() 的结果, ...], 没有执行的显示器 (degraded 等) 为失败的结果
+        """
+        reports = []
+        for monitor, report, err in vcp_fleet.run_parallel(self.run_monitor, phy_monitors, self.max_workers):
+            if err is not None:
+                report = {'monitor': monitor.monitor_id, 'model': monitor.model, 'ok': False, 'results': [],
+                          'error': str(err) or type(err).__name__}
+            reports.append(report)
+        return reports
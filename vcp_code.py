@@ -204,6 +204,85 @@ POWER_MODE_CODE = {
     'off': 0x05,
 }
 
+# 0xD6 读取时可能返回的关机/待机状态:
+# 0x02: Standby, 0x03: Suspend, 0x04: Off (DPM), 0x05: Off (电源键)
+# 有些显示器用电源键关机后返回 0x02 而不是 0x05
+POWER_MODE_OFF_VALUES = (0x02, 0x03, 0x04, 0x05)
+
+# 0x8D Audio Mute / Screen Blank, bit 0-1 为静音状态 (bit 2-3 为黑屏, 读取时忽略)
+AUDIO_MUTE_CODE = {
+    'on': 0x01,
+    'off': 0x02,
+}
+AUDIO_MUTE_MASK = 0x03
+
+# 写入校验时只比较这些位: {code: mask}, 其余的位显示器可能另有用途
+VERIFY_MASKS = {VCP_CODE['Audio: Mute (screen blank)']: AUDIO_MUTE_MASK}
+
+# 音频功能, caps string 中没有列出时认为显示器没有扬声器
+AUDIO_CODES = frozenset(VCP_CODE[i] for i in (
+    'Audio: Speaker Volume',
+    'Audio: Mute (screen blank)',
+    'Audio: Balance L/R',
+    'Audio: Bass',
+    'Audio: Treble',
+))
+
+# 0x02 New Control Value
+# 0x01: 没有新的设置, 0x02: 用户通过显示器按键修改了设置 (读取后主机写入 0x01 清除)
+# 0xFF: 显示器没有用户可调的设置
+NEW_CONTROL_VALUE_CODE = {
+    'No new control values': 0x01,
+    'New control values present': 0x02,
+    'No user controls': 0xFF,
+}
+
+# 只能写入的动作类指令，读回的值没有意义，不做写入校验
+WRITE_ONLY_CODES = frozenset(VCP_CODE[i] for i in (
+    'Degauss',
+    'Restore Factory Defaults',
+    'Restore Factory Luminance / Contrast Defaults',
+    'Restore Factory Geometry Defaults',
+    'Restore Factory Color Defaults',
+    'Restore Factory TV Defaults',
+    'Auto Setup',
+    'Auto Color Setup',
+    'Save / Restore Settings',
+    # 主机写入 0x01 清除标志，显示器随时可能再次设置，读回的值不能用来校验
+    'New Control Value',
+))
+
+# 写入后会同时改变其它设置的指令: {code: 受影响的 code}, None 为所有设置
+# 用来使读取的缓存失效
+DEPENDENT_CODES = {
+    VCP_CODE['Restore Factory Defaults']: None,
+    VCP_CODE['Restore Factory Luminance / Contrast Defaults']: (VCP_CODE['Luminance'], VCP_CODE['Contrast']),
+    VCP_CODE['Restore Factory Geometry Defaults']: None,
+    VCP_CODE['Restore Factory Color Defaults']: tuple(VCP_CODE[i] for i in (
+        'User Color Temperature', 'Select Color Preset', 'Video Gain Red', 'Video Gain Green', 'Video Gain Blue')),
+    VCP_CODE['Restore Factory TV Defaults']: None,
+    VCP_CODE['Save / Restore Settings']: None,
+    # 切换颜色预设会改变 RGB、色温, 很多显示器的亮度和对比度也跟随预设
+    VCP_CODE['Select Color Preset']: tuple(VCP_CODE[i] for i in (
+        'User Color Temperature', 'Luminance', 'Contrast', 'Video Gain Red', 'Video Gain Green', 'Video Gain Blue')),
+}
+
+# 写入后保存到显示器 EEPROM 的设置 (擦写次数有限)，其它 code 认为是易失的 (亮度等显示器一般延迟保存或不保存)
+PERSISTENT_CODES = frozenset(VCP_CODE[i] for i in (
+    'Restore Factory Defaults',
+    'Restore Factory Luminance / Contrast Defaults',
+    'Restore Factory Geometry Defaults',
+    'Restore Factory Color Defaults',
+    'Restore Factory TV Defaults',
+    'Save / Restore Settings',
+    'User Color Temperature',
+    'Select Color Preset',
+    'Video Gain Red',
+    'Video Gain Green',
+    'Video Gain Blue',
+    'OSD Language',
+))
+
 # OSD 菜单语言列表
 OSD_LANG_CODE = {
     'Reserved/ignored': 0x00,
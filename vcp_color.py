@@ -0,0 +1,250 @@
+# coding = utf-8
+
+import logging
+import vcp_fleet
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+白点校准.
+
+根据每个型号面板的色度坐标 (quirks 中的 primaries)，计算把白点调整到目标色温 / xy 坐标需要的 RGB 增益。
+所有显示器一次批量计算: 安装了 NumPy 时用 (N, 3, 3) 矩阵一次求解，否则逐台计算 (结果相同)。
+增益只会降低某些通道 (最大的通道保持最大值)，计算结果和当前值不同的显示器才通过 rgb_gain 写入。
+目标白点必须在面板三原色的三角形之内，否则这台显示器不写入。
+
+假设增益和通道的线性亮度成正比。
+
+# Reference
+[CIE 1931 color space](https://en.wikipedia.org/wiki/CIE_1931_color_space)
+[Planckian locus](https://en.wikipedia.org/wiki/Planckian_locus)
+[Standard illuminant: D series](https://en.wikipedia.org/wiki/Standard_illuminant#Illuminant_series_D)
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+# quirks 中没有指定 primaries 时使用
+SRGB_PRIMARIES = {
+    'red': (0.640, 0.330),
+    'green': (0.300, 0.600),
+    'blue': (0.150, 0.060),
+    'white': (0.3127, 0.3290),
+}
+_PRIMARY_ORDER = ('red', 'green', 'blue', 'white')
+
+# cct_to_xy() 支持的色温范围 (K)
+CCT_MIN = 1667
+CCT_MAX = 25000
+
+
+def cct_to_xy(cct: float) -> tuple:
+    """
+    色温 -> CIE 1931 xy.
+    4000K 以上使用 CIE 日光轨迹 (6500K 约等于 D65)，以下使用普朗克轨迹的三次样条近似 (Kim et al.)
+    :param cct: 色温 (K), CCT_MIN - CCT_MAX
+    :return: (x, y)
+    """
+    t = float(cct)
+    if not CCT_MIN <= t <= CCT_MAX:
+        raise ValueError('color temperature out of range: {}, allowed: {}-{}'.format(cct, CCT_MIN, CCT_MAX))
+    if t >= 4000:
+        if t <= 7000:
+            x = -4.6070e9 / t ** 3 + 2.9678e6 / t ** 2 + 0.09911e3 / t + 0.244063
+        else:
+            x = -2.0064e9 / t ** 3 + 1.9018e6 / t ** 2 + 0.24748e3 / t + 0.237040
+        y = -3.000 * x ** 2 + 2.870 * x - 0.275
+    else:
+        x = -0.2661239e9 / t ** 3 - 0.2343589e6 / t ** 2 + 0.8776956e3 / t + 0.179910
+        if t <= 2222:
+            y = -1.1063814 * x ** 3 - 1.34811020 * x ** 2 + 2.18555832 * x - 0.20219683
+        else:
+            y = -0.9549476 * x ** 3 - 1.37418593 * x ** 2 + 2.09137015 * x - 0.16748867
+    return x, y
+
+
+def check_xy(xy) -> tuple:
+    """
+    检查 xy 色度坐标
+    :param xy: (x, y)
+    :return: (x, y) float
+    :raise ValueError: 不是两个数, y <= 0, x < 0 或者 x + y > 1
+    """
+    try:
+        x, y = (float(i) for i in xy)
+    except (TypeError, ValueError):
+        raise ValueError('white point must be two numbers x,y: {!r}'.format(xy))
+    if y <= 0 or x < 0 or x + y > 1:
+        raise ValueError('invalid chromaticity {},{}: requires x >= 0, y > 0, x + y <= 1'.format(x, y))
+    return x, y
+
+
+def parse_xy(text: str) -> tuple:
+    """
+    :param text: 'x,y', 如 '0.3127,0.3290'
+    :return: (x, y)
+    :raise ValueError:
+    """
+    return check_xy(text.split(','))
+
+
+def in_gamut(primaries: list, xy: tuple) -> bool:
+    """
+    :param primaries: [[x, y] * 4] (red, green, blue, white)
+    :param xy: (x, y)
+    :return: xy 是否在三原色的三角形之内 (包括边上)
+    """
+    (x1, y1), (x2, y2), (x3, y3) = primaries[:3]
+    x, y = xy
+    d1 = (x - x2) * (y1 - y2) - (x1 - x2) * (y - y2)
+    d2 = (x - x3) * (y2 - y3) - (x2 - x3) * (y - y3)
+    d3 = (x - x1) * (y3 - y1) - (x3 - x1) * (y - y1)
+    has_neg = d1 < 0 or d2 < 0 or d3 < 0
+    has_pos = d1 > 0 or d2 > 0 or d3 > 0
+    return not (has_neg and has_pos)
+
+
+def _primaries_of(monitor) -> list:
+    """
+    :param monitor: vcp.PhyMonitor()
+    :return: [[x, y] * 4], 顺序为 _PRIMARY_ORDER
+    """
+    primaries = monitor.quirk.get('primaries') or SRGB_PRIMARIES
+    return [list(primaries[i]) for i in _PRIMARY_ORDER]
+
+
+def _xy_to_xyz(x: float, y: float) -> list:
+    # Y = 1
+    return [x / y, 1.0, (1 - x - y) / y]
+
+
+def _solve3(m: list, v: list) -> list:
+    """
+    Cramer's rule 求解 3x3 线性方程组 m @ r = v
+    """
+    def det(a):
+        return (a[0][0] * (a[1][1] * a[2][2] - a[1][2] * a[2][1])
+                - a[0][1] * (a[1][0] * a[2][2] - a[1][2] * a[2][0])
+                + a[0][2] * (a[1][0] * a[2][1] - a[1][1] * a[2][0]))
+    d = det(m)
+    result = []
+    for col in range(3):
+        replaced = [[v[row] if c == col else m[row][c] for c in range(3)] for row in range(3)]
+        result.append(det(replaced) / d)
+    return result
+
+
+def _solve_python(primaries: list, target: list) -> list:
+    """
+    逐台计算, 没有 NumPy 时使用
+    """
+    result = []
+    for r, g, b, w in primaries:
+        # 列为三个原色的 XYZ
+        columns = [_xy_to_xyz(*r), _xy_to_xyz(*g), _xy_to_xyz(*b)]
+        p = [[columns[c][row] for c in range(3)] for row in range(3)]
+        # 面板原生白点 = P @ S, 目标白点 = P @ (S * gain)
+        scale = _solve3(p, _xy_to_xyz(*w))
+        gain = [i / s for i, s in zip(_solve3(p, target), scale)]
+        result.append(gain)
+    return result
+
+
+def _solve_numpy(primaries: list, target: list):
+    """
+    所有显示器一次求解
+    """
+    xy = np.asarray(primaries, dtype=float)
+    x, y = xy[..., 0], xy[..., 1]
+    # (N, 4, 3)
+    xyz = np.stack((x / y, np.ones_like(x), (1 - x - y) / y), axis=-1)
+    # (N, 3, 3), 列为三个原色
+    p = np.swapaxes(xyz[:, :3, :], 1, 2)
+    scale = np.linalg.solve(p, xyz[:, 3, :, None])[..., 0]
+    target = np.broadcast_to(np.asarray(target, dtype=float), scale.shape)
+    return np.linalg.solve(p, target[..., None])[..., 0] / scale
+
+
+def solve_gains(primaries: list, target_xy: tuple, channel_max: list) -> list:
+    """
+    批量计算 RGB 增益
+    :param primaries: 每台显示器的 [[x, y] * 4] (red, green, blue, white)
+    :param target_xy: 目标白点 (x, y)
+    :param channel_max: 每台显示器的 (max_r, max_g, max_b)
+    :return: [(r, g, b), ...], 最大的通道为该通道的最大值
+    """
+    if not primaries:
+        return []
+    target = _xy_to_xyz(*target_xy)
+    if np is not None:
+        gains = _solve_numpy(primaries, target)
+        gains = np.clip(gains / gains.max(axis=1, keepdims=True), 0.0, 1.0)
+        raw = np.rint(gains * np.asarray(channel_max, dtype=float)).astype(int)
+        return [tuple(int(v) for v in row) for row in raw.tolist()]
+
+    result = []
+    for gain, max_ in zip(_solve_python(primaries, target), channel_max):
+        peak = max(gain)
+        result.append(tuple(int(round(min(1.0, max(0.0, g / peak)) * m)) for g, m in zip(gain, max_)))
+    return result
+
+
+def calibrate(phy_monitors: list, cct: float = None, xy: tuple = None, dry_run: bool = False,
+              max_workers: int = vcp_fleet.DEFAULT_MAX_WORKERS) -> dict:
+    """
+    把所有显示器的白点调整到目标色温 / xy 坐标
+    :param phy_monitors: vcp.PhyMonitor() instance(s)
+    :param cct: 目标色温 (K), 和 xy 二选一
+    :param xy: 目标白点 (x, y)
+    :param dry_run: 只计算, 不写入
+    :param max_workers: 最大线程数
+    :return: {monitor_id: {'ok': bool, 'gain': (r, g, b) / None (读取失败或者超出色域), 'previous': (r, g, b),
+                           'changed': 写入成功 (dry_run 时为需要写入), 'error': str}}
+    :raise ValueError: 无效的色温或 xy
+    """
+    if (cct is None) == (xy is None):
+        raise ValueError('exactly one of cct and xy is required')
+    target_xy = cct_to_xy(cct) if cct is not None else check_xy(xy)
+
+    # 并行读取最大值和当前值
+    def read(monitor):
+        return monitor.rgb_gain_max_channels, monitor.rgb_gain
+
+    monitors, channel_max, previous = [], [], []
+    result = {}
+    for monitor, values, err in vcp_fleet.run_parallel(read, phy_monitors, max_workers):
+        if err is not None or not all(values[0]):
+            _LOGGER.warning('%s: unable to read RGB gain, skipped', monitor.monitor_id)
+            result[monitor.monitor_id] = {'ok': False, 'gain': None, 'previous': None, 'changed': False,
+                                          'error': str(err) if err is not None else 'unable to read RGB gain'}
+            continue
+        if not in_gamut(_primaries_of(monitor), target_xy):
+            _LOGGER.warning('%s: white point %.4f,%.4f is outside the panel gamut, skipped', monitor.monitor_id,
+                            *target_xy)
+            result[monitor.monitor_id] = {'ok': False, 'gain': None, 'previous': tuple(values[1]), 'changed': False,
+                                          'error': 'white point outside the panel gamut'}
+            continue
+        monitors.append(monitor)
+        channel_max.append(values[0])
+        previous.append(tuple(values[1]))
+
+    gains = solve_gains([_primaries_of(i) for i in monitors], target_xy, channel_max)
+    changed = []
+    for monitor, gain, old in zip(monitors, gains, previous):
+        result[monitor.monitor_id] = {'ok': True, 'gain': gain, 'previous': old, 'changed': dry_run and gain != old,
+                                      'error': ''}
+        if gain != old:
+            changed.append(monitor)
+
+    if not dry_run:
+        def write(monitor):
+            return monitor.set_property('rgb_gain', result[monitor.monitor_id]['gain'])
+
+        for monitor, ok, err in vcp_fleet.run_parallel(write, changed, max_workers):
+            record = result[monitor.monitor_id]
+            record['changed'] = record['ok'] = bool(ok) and err is None
+            if not record['ok']:
+                record['error'] = str(err) if err is not None else 'write failed'
+    return result
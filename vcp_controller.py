@@ -0,0 +1,303 @@
+# coding = utf-8
+
+import json
+import time
+import queue
+import logging
+import threading
+import http.client
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, wait
+
+"""
+多台主机的控制端.
+
+每台主机运行 `monitor_ctrl.py -c --serve 0.0.0.0:8765` 作为 agent (vcp_http)，控制端把同一个操作并行发送到所有 agent:
+
+    controller = vcp_controller.FleetController(['10.0.0.1:8765', '10.0.0.2:8765'], timeout=5)
+    controller.bulk(set_={'brightness': 40})
+    # {'10.0.0.1:8765': {'ok': True, 'result': {...}, 'error': None, 'latency': 0.05}, ...}
+
+- 每个 agent 保持若干个 keep-alive 连接, 重复使用
+- 同时进行的请求不超过 max_concurrent
+- 连接和读取都有超时；连接失败的 agent 在 retry_after 秒内直接返回错误，不再等待超时
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+# 单个请求的超时(秒)
+DEFAULT_TIMEOUT = 5.0
+# 同时进行的请求数
+DEFAULT_MAX_CONCURRENT = 32
+# 每个 agent 最多保持的连接数
+DEFAULT_MAX_CONNECTIONS = 2
+# 连接失败后多久再尝试连接(秒)
+DEFAULT_RETRY_AFTER = 30.0
+# 重复使用的 keep-alive 连接在收到回应之前出现这些错误时，说明 agent 已经关闭了连接，用新的连接重试
+# (http.client.RemoteDisconnected 是 ConnectionResetError 的子类)
+_STALE_CONNECTION_ERRORS = (ConnectionResetError, BrokenPipeError)
+
+
+class AgentError(Exception):
+    """
+    agent 返回错误或者无法访问
+    """
+    def __init__(self, message: str, status: int = None):
+        super(AgentError, self).__init__(message)
+        self.status = status
+
+
+def parse_address(address: str, default_port: int = DEFAULT_PORT) -> tuple:
+    """
+    :param address: HOST[:PORT]
+    :param default_port:
+    :return: (host, port)
+    """
+    host, sep, port = address.strip().rpartition(':')
+    if not sep:
+        return port, default_port
+    return host, int(port)
+
+
+class AgentClient(object):
+    """
+    一个 agent 的 HTTP 客户端
+    """
+    def __init__(self, address: str, timeout: float = DEFAULT_TIMEOUT,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS, retry_after: float = DEFAULT_RETRY_AFTER,
+                 token: str = None):
+        """
+        :param address: HOST[:PORT]
+        :param timeout: 连接和读取的超时(秒)
+        :param max_connections: 最多同时使用的连接数
+        :param retry_after: 连接失败后多久再尝试连接(秒)
+        :param token: agent 的 token
+        """
+        self.address = address
+        self.host, self.port = parse_address(address)
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._headers = {'Content-Type': 'application/json'}
+        if token:
+            self._headers['Authorization'] = 'Bearer ' + token
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+        self._counters = {'requests': 0, 'connects': 0, 'reused': 0, 'failures': 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _connection(self) -> tuple:
+        """
+        :return: (HTTPConnection, 是否重复使用的连接)
+        """
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            self._count('connects')
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+    @property
+    def is_down(self) -> bool:
+        return time.monotonic() < self._down_until
+
+    def request(self, method: str, path: str, body=None):
+        """
+        发送请求
+        :param method:
+        :param path: 如 /monitors
+        :param body: 转换为 JSON 发送
+        :return: 返回的 JSON
+        :raise AgentError:
+        """
+        if self.is_down:
+            raise AgentError('{}: agent down, retry in {:.0f}s'.format(
+                self.address, self._down_until - time.monotonic()))
+        data = None if body is None else json.dumps(body).encode('utf-8')
+        if not self._slots.acquire(timeout=self.timeout):
+            raise AgentError('{}: no free connection'.format(self.address))
+        try:
+            self._count('requests')
+            conn, reused = self._connection()
+            while True:
+                try:
+                    conn.request(method, path, data, self._headers)
+                    response = conn.getresponse()
+                except (OSError, http.client.HTTPException) as err:
+                    conn.close()
+                    if reused and isinstance(err, _STALE_CONNECTION_ERRORS):
+                        # keep-alive 连接已经被 agent 关闭, 还没有收到任何回应: 请求没有被执行, 用新的连接重试一次.
+                        # 超时或者其它错误不重试: agent 可能已经执行了请求 (如 POST /bulk)
+                        self._count('connects')
+                        conn, reused = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+                        continue
+                    raise self._failed(err)
+                break
+            try:
+                payload = response.read()
+            except (OSError, http.client.HTTPException) as err:
+                conn.close()
+                raise self._failed(err)
+            if reused:
+                self._count('reused')
+            if response.will_close:
+                conn.close()
+            else:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+        try:
+            result = json.loads(payload.decode('utf-8')) if payload else None
+        except ValueError as err:
+            raise AgentError('{}: invalid response: {}'.format(self.address, err), response.status)
+        if response.status >= 400:
+            message = result.get('error') if isinstance(result, dict) else payload
+            raise AgentError('{}: {} {}'.format(self.address, response.status, message), response.status)
+        return result
+
+    def _failed(self, err: Exception) -> AgentError:
+        self._count('failures')
+        if isinstance(err, OSError) and not isinstance(err, TimeoutError):
+            # 连接失败: 一段时间内不再尝试; 超时的 agent 可能只是慢, 下次仍然尝试
+            self._down_until = time.monotonic() + self.retry_after
+        return AgentError('{}: {}'.format(self.address, str(err) or type(err).__name__))
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+        stats['idle_connections'] = self._idle.qsize()
+        stats['down'] = self.is_down
+        return stats
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class FleetController(object):
+    """
+    把操作并行发送到多个 agent, 汇总结果
+    """
+    def __init__(self, agents: list, timeout: float = DEFAULT_TIMEOUT, max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+                 retry_after: float = DEFAULT_RETRY_AFTER, token: str = None):
+        """
+        :param agents: HOST[:PORT] 列表
+        :param timeout: 单个请求的超时(秒)
+        :param max_concurrent: 同时进行的请求数
+        :param retry_after: 连接失败的 agent 多久再尝试连接(秒)
+        :param token: agent 的 token
+        """
+        self.timeout = timeout
+        self.clients = {i: AgentClient(i, timeout, retry_after=retry_after, token=token) for i in agents}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, min(max_concurrent, len(self.clients))),
+                                            thread_name_prefix='FleetController')
+
+    @staticmethod
+    def _call(client: AgentClient, method: str, path: str, body) -> dict:
+        started = time.monotonic()
+        try:
+            result = client.request(method, path, body)
+        except AgentError as err:
+            return {'ok': False, 'result': None, 'error': str(err), 'latency': time.monotonic() - started}
+        return {'ok': True, 'result': result, 'error': None, 'latency': time.monotonic() - started}
+
+    def fan_out(self, method: str, path: str, body=None, agents: list = None, deadline: float = None,
+                bodies: dict = None) -> dict:
+        """
+        把同一个请求发送到多个 agent
+        :param method:
+        :param path:
+        :param body: 请求 body
+        :param agents: 要发送的 agent, 默认全部
+        :param deadline: 等待所有 agent 的最长时间(秒), 超过后没有完成的 agent 返回错误; None 只受单个请求的超时限制
+        :param bodies: {agent: body} 每个 agent 的请求 body 不同时使用, 代替 body
+        :return: {agent: {'ok', 'result', 'error', 'latency'}}
+        """
+        agents = list(self.clients) if agents is None else agents
+        futures = {}
+        for agent in agents:
+            futures[self._executor.submit(self._call, self.clients[agent], method, path,
+                                          body if bodies is None else bodies[agent])] = agent
+        done, _ = wait(futures, timeout=deadline)
+
+        result = {}
+        for future, agent in futures.items():
+            if future in done:
+                result[agent] = future.result()
+            else:
+                future.cancel()
+                result[agent] = {'ok': False, 'result': None, 'error': '{}: deadline exceeded'.format(agent),
+                                 'latency': deadline}
+        return {i: result[i] for i in agents}
+
+    def list_monitors(self, deadline: float = None) -> dict:
+        """
+        :return: {agent: {'ok', 'result': [{'monitor', 'model', ...}], 'error', 'latency'}}
+        """
+        return self.fan_out('GET', '/monitors', deadline=deadline)
+
+    def get(self, monitor: str, name: str, max_age: float = None, agents: list = None,
+            deadline: float = None) -> dict:
+        """
+        读取每个 agent 上的一台显示器的属性
+        :param monitor: monitor id
+        :param name: 属性名
+        :param max_age: agent 的缓存有效时间(秒)
+        :param agents:
+        :param deadline:
+        :return: {agent: {'ok', 'result': {'value': ...}, 'error', 'latency'}}
+        """
+        path = '/monitors/{}/{}'.format(quote(monitor, safe=''), quote(name, safe=''))
+        if max_age is not None:
+            path += '?max_age={}'.format(max_age)
+        return self.fan_out('GET', path, agents=agents, deadline=deadline)
+
+    def bulk(self, set_: dict = None, get: list = None, monitors: dict = None, max_age: float = None,
+             deadline: float = None) -> dict:
+        """
+        在所有 agent 的显示器上执行 vcp_http.MonitorService.bulk()
+        :param set_: {name: value}
+        :param get: [name]
+        :param monitors: {agent: [monitor_id]} 只操作这些 agent 的这些显示器, 默认所有 agent 的所有显示器
+        :param max_age:
+        :param deadline:
+        :return: {agent: {'ok', 'result': {monitor_id: {'set', 'get', 'errors'}}, 'error', 'latency'}}
+        """
+        request = {'set': set_ or {}, 'get': get or []}
+        if max_age is not None:
+            request['max_age'] = max_age
+        if monitors is None:
+            return self.fan_out('POST', '/bulk', request, deadline=deadline)
+        bodies = {agent: dict(request, monitors=ids) for agent, ids in monitors.items() if ids}
+        return self.fan_out('POST', '/bulk', agents=list(bodies), deadline=deadline, bodies=bodies)
+
+    def stats(self) -> dict:
+        """
+        :return: {agent: AgentClient.stats()}
+        """
+        return {agent: client.stats() for agent, client in self.clients.items()}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        for client in self.clients.values():
+            client.close()
+
+
+def load_agents(text: str) -> list:
+    """
+    :param text: 逗号分隔的 HOST[:PORT], 或者 @FILE (每行一个, # 开头为注释)
+    :return: agent 列表
+    """
+    if text.startswith('@'):
+        with open(text[1:], 'r', encoding='utf-8') as f:
+            lines = [i.split('#', 1)[0].strip() for i in f]
+        return [i for i in lines if i]
+    return [i.strip() for i in text.split(',') if i.strip()]
@@ -0,0 +1,233 @@
+# coding = utf-8
+
+import sys
+import logging
+import vcp
+
+"""
+EDID 读取和解析.
+
+Windows 把每台显示器的 EDID 保存在注册表
+HKLM\\SYSTEM\\CurrentControlSet\\Enum\\DISPLAY\\<硬件 ID>\\<实例>\\Device Parameters\\EDID
+用 EnumDisplayDevices() 找到当前连接的显示器对应的实例，只读取这些显示器的 EDID。
+PhyMonitor 通过所属的 HMONITOR (GetMonitorInfo) 找到实例，和 EDID 一一对应，无法确定时不对应。
+
+# Reference
+[VESA E-EDID](https://en.wikipedia.org/wiki/Extended_Display_Identification_Data)
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+EDID_HEADER = b'\x00\xff\xff\xff\xff\xff\xff\x00'
+EDID_BLOCK_SIZE = 128
+
+# 18 bytes display descriptor 类型
+_DESCRIPTOR_SERIAL = 0xFF
+_DESCRIPTOR_TEXT = 0xFE
+_DESCRIPTOR_NAME = 0xFC
+
+_REG_DISPLAY_ENUM = r'SYSTEM\CurrentControlSet\Enum\DISPLAY'
+
+
+def parse_edid(data: bytes) -> dict:
+    """
+    解析 EDID base block
+    :param data: EDID, 至少 128 bytes
+    :return: {'manufacturer', 'product_code', 'serial', 'name', 'serial_number', 'manufacture_year',
+              'manufacture_week', 'edid_version', 'native_resolution'}
+    """
+    data = bytes(data)
+    if len(data) < EDID_BLOCK_SIZE or data[:8] != EDID_HEADER:
+        raise ValueError('invalid EDID header')
+    if sum(data[:EDID_BLOCK_SIZE]) % 256 != 0:
+        _LOGGER.warning('EDID checksum mismatch')
+
+    # 3 个 5-bit 字母, 'A' = 1
+    vendor = (data[8] << 8) | data[9]
+    manufacturer = ''.join(chr(((vendor >> shift) & 0x1F) + ord('A') - 1) for shift in (10, 5, 0))
+
+    result = {
+        'manufacturer': manufacturer,
+        'product_code': data[10] | (data[11] << 8),
+        'serial_number': data[12] | (data[13] << 8) | (data[14] << 16) | (data[15] << 24),
+        'manufacture_week': data[16],
+        'manufacture_year': data[17] + 1990,
+        'edid_version': '{}.{}'.format(data[18], data[19]),
+        'name': '',
+        'serial': '',
+        'native_resolution': '',
+    }
+
+    for offset in (54, 72, 90, 108):
+        descriptor = data[offset:offset + 18]
+        if descriptor[0] or descriptor[1]:
+            # detailed timing descriptor, 第一个是首选(原生)分辨率
+            if not result['native_resolution']:
+                h_active = descriptor[2] | ((descriptor[4] & 0xF0) << 4)
+                v_active = descriptor[5] | ((descriptor[7] & 0xF0) << 4)
+                result['native_resolution'] = '{}x{}'.format(h_active, v_active)
+            continue
+        text = descriptor[5:18].split(b'\n')[0].decode('ASCII', 'replace').strip()
+        if descriptor[3] == _DESCRIPTOR_NAME:
+            result['name'] = text
+        elif descriptor[3] == _DESCRIPTOR_SERIAL:
+            result['serial'] = text
+    return result
+
+
+def _display_device_api():
+    """
+    :return: (DISPLAY_DEVICEW 结构, EnumDisplayDevicesW, GetMonitorInfoW, MONITORINFOEXW 结构)
+    """
+    import ctypes
+    from ctypes import wintypes
+
+    class _DisplayDevice(ctypes.Structure):
+        _fields_ = [
+            ('cb', wintypes.DWORD),
+            ('DeviceName', wintypes.WCHAR * 32),
+            ('DeviceString', wintypes.WCHAR * 128),
+            ('StateFlags', wintypes.DWORD),
+            ('DeviceID', wintypes.WCHAR * 128),
+            ('DeviceKey', wintypes.WCHAR * 128),
+        ]
+
+    class _MonitorInfoEx(ctypes.Structure):
+        _fields_ = [
+            ('cbSize', wintypes.DWORD),
+            ('rcMonitor', wintypes.RECT),
+            ('rcWork', wintypes.RECT),
+            ('dwFlags', wintypes.DWORD),
+            ('szDevice', wintypes.WCHAR * 32),
+        ]
+
+    user32 = ctypes.WinDLL('user32')
+    enum_display_devices = user32.EnumDisplayDevicesW
+    enum_display_devices.argtypes = [wintypes.LPCWSTR, wintypes.DWORD, ctypes.POINTER(_DisplayDevice), wintypes.DWORD]
+    enum_display_devices.restype = wintypes.BOOL
+    get_monitor_info = user32.GetMonitorInfoW
+    get_monitor_info.argtypes = [wintypes.HMONITOR, ctypes.POINTER(_MonitorInfoEx)]
+    get_monitor_info.restype = wintypes.BOOL
+    return _DisplayDevice, enum_display_devices, get_monitor_info, _MonitorInfoEx
+
+
+def _monitor_devices(api, adapter_name: str) -> list:
+    """
+    用 EnumDisplayDevicesW 找到一个显示输出 (GetMonitorInfoW 的 szDevice) 上连接的显示器在注册表中的实例路径
+    :return: ['DEL4065\\5&1a2b3c&0&UID4354', ...]
+    """
+    import ctypes
+
+    display_device, enum_display_devices = api[0], api[1]
+    # DeviceID 返回 device interface name: \\?\DISPLAY#DEL4065#5&1a2b3c&0&UID4354#{e6f07b5f-...}
+    edd_get_device_interface_name = 0x00000001
+    display_device_active = 0x00000001
+
+    instances = []
+    monitor = display_device()
+    monitor.cb = ctypes.sizeof(monitor)
+    monitor_index = 0
+    while enum_display_devices(adapter_name, monitor_index, ctypes.byref(monitor), edd_get_device_interface_name):
+        monitor_index += 1
+        if not monitor.StateFlags & display_device_active:
+            continue
+        parts = monitor.DeviceID.split('#')
+        if len(parts) >= 3:
+            instances.append('{}\\{}'.format(parts[1], parts[2]))
+    return instances
+
+
+def _active_monitor_instances() -> list:
+    """
+    当前连接的所有显示器在注册表中的实例路径
+    :return: ['DEL4065\\5&1a2b3c&0&UID4354', ...]
+    """
+    import ctypes
+
+    api = _display_device_api()
+    instances = []
+    adapter = api[0]()
+    adapter.cb = ctypes.sizeof(adapter)
+    adapter_index = 0
+    while api[1](None, adapter_index, ctypes.byref(adapter), 0):
+        adapter_index += 1
+        instances.extend(_monitor_devices(api, adapter.DeviceName))
+    return instances
+
+
+def _hmonitor_instances(hmonitor) -> list:
+    """
+    HMONITOR 对应的显示器实例路径: GetMonitorInfoW 得到显示输出的名称，再枚举这个输出上的显示器
+    :param hmonitor:
+    :return: 实例路径, 复制模式下一个 HMONITOR 可能有多个
+    """
+    import ctypes
+
+    api = _display_device_api()
+    info = api[3]()
+    info.cbSize = ctypes.sizeof(info)
+    if not api[2](hmonitor, ctypes.byref(info)):
+        _LOGGER.warning('GetMonitorInfoW failed: %s', ctypes.WinError())
+        return []
+    return _monitor_devices(api, info.szDevice)
+
+
+def read_edids() -> list:
+    """
+    读取当前连接的所有显示器的 EDID
+    :return: [parse_edid() 的结果, ...], 附加 'instance' 字段
+    """
+    if sys.platform != 'win32':
+        return []
+    import winreg
+
+    result = []
+    for instance in _active_monitor_instances():
+        try:
+            with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE,
+                                '{}\\{}\\Device Parameters'.format(_REG_DISPLAY_ENUM, instance)) as key:
+                data, _ = winreg.QueryValueEx(key, 'EDID')
+            edid = parse_edid(data)
+        except (OSError, ValueError) as err:
+            _LOGGER.warning('unable to read EDID of %s: %s', instance, err)
+            continue
+        edid['instance'] = instance
+        result.append(edid)
+    return result
+
+
+def match_edids(phy_monitors: list, edids: list) -> dict:
+    """
+    把 EDID 对应到 PhyMonitor: 通过物理显示器所属的 HMONITOR 找到显示器的设备路径，和 EDID 的实例路径比较.
+    一个 HMONITOR 有多个物理显示器或者多个设备 (复制模式) 时无法确定对应关系，这些显示器没有 EDID，不按名称或顺序猜测
+    :param phy_monitors: vcp.PhyMonitor() instance(s)
+    :param edids: read_edids() 的结果
+    :return: {monitor_id: edid}
+    """
+    if not edids:
+        return {}
+    by_instance = {i['instance'].upper(): i for i in edids if i.get('instance')}
+    # {instance: [monitor_id, ...]}
+    candidates = {}
+    for monitor in phy_monitors:
+        located = vcp.hmonitor_of(monitor)
+        if located is None:
+            continue
+        hmonitor, count = located
+        instances = _hmonitor_instances(hmonitor) if count == 1 else []
+        if len(instances) != 1:
+            _LOGGER.info('%s: unable to identify the display device (%s physical monitor(s), %s device(s)), '
+                         'EDID ignored', monitor.monitor_id, count, len(instances))
+            continue
+        candidates.setdefault(instances[0].upper(), []).append(monitor.monitor_id)
+
+    result = {}
+    for instance, monitor_ids in candidates.items():
+        edid = by_instance.get(instance)
+        if edid is None:
+            continue
+        if len(monitor_ids) != 1:
+            _LOGGER.info('%s: %s monitors on the same display device, EDID ignored', instance, len(monitor_ids))
+            continue
+        result[monitor_ids[0]] = edid
+    return result
@@ -0,0 +1,297 @@
+# coding = utf-8
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import vcp
+import vcp_code
+
+"""
+同时操作多台显示器.
+
+不同显示器的 DDC/CI 调用互不影响，用线程池并行执行；同一台显示器的调用由 PhyMonitor 内部的锁串行化。
+被标记为 degraded (调用超时) 或者断路器断开 (vcp_health) 的显示器，到了检查时间时先做一次健康检查
+(PhyMonitor.check_health())，没有通过或者还没有到检查时间时直接跳过，不等待。
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+# 并行操作的最大线程数
+DEFAULT_MAX_WORKERS = 16
+# 使用 pool 时，超过截止时间后再等待工作线程返回的时间(秒)
+DEADLINE_GRACE = 0.5
+
+
+def _guard(func, expires: float, skip_degraded: bool):
+    """
+    :param func: func(monitor) -> result
+    :param expires: time.monotonic() 截止时间, None 不限制
+    :param skip_degraded: degraded / 断路器断开且健康检查失败的显示器抛出 vcp.MonitorDegraded
+    :return: 在截止时间内执行 func 的函数
+    """
+    def guarded(monitor):
+        with vcp.Deadline(None if expires is None else max(0.0, expires - time.monotonic())):
+            if skip_degraded and hasattr(monitor, 'check_health') and not monitor.check_health():
+                raise vcp.MonitorDegraded('unavailable: {}'.format(monitor.degraded_reason or 'circuit open'))
+            return func(monitor)
+    guarded.__name__ = getattr(func, '__name__', 'func')
+    return guarded
+
+
+def run_parallel(func, phy_monitors: list, max_workers: int = DEFAULT_MAX_WORKERS, pool=None,
+                 priority: int = None, timeout: float = None, skip_degraded: bool = True) -> list:
+    """
+    对每台显示器并行执行 func(monitor)
+    :param func: func(monitor) -> result
+    :param phy_monitors: vcp.PhyMonitor() instance(s)
+    :param max_workers: 最大线程数
+    :param pool: vcp_worker.WorkerPool, 给定时在每台显示器的工作线程中执行, 不使用线程池
+    :param priority: 使用 pool 时的优先级, 默认 vcp_worker.PRIORITY_SWEEP
+    :param timeout: 整个操作的截止时间(秒), 之后的 DDC/CI 调用抛出或返回 vcp.CallTimeout; None 不限制
+    :param skip_degraded: 跳过 degraded / 断路器断开且健康检查失败的显示器 (exception 为 vcp.MonitorDegraded)
+    :return: [(monitor, result, exception), ...], 顺序和 phy_monitors 相同
+    """
+    phy_monitors = list(phy_monitors)
+    if not phy_monitors:
+        return []
+    expires = None if timeout is None else time.monotonic() + timeout
+    func = _guard(func, expires, skip_degraded)
+    if pool is not None:
+        return _run_in_pool(func, phy_monitors, pool, priority, expires)
+
+    def call(monitor):
+        try:
+            return monitor, func(monitor), None
+        except Exception as err:
+            _LOGGER.error('%s: %s failed: %s', getattr(monitor, 'monitor_id', monitor),
+                          getattr(func, '__name__', func), err)
+            return monitor, None, err
+
+    if len(phy_monitors) == 1:
+        return [call(phy_monitors[0])]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(phy_monitors))) as executor:
+        return list(executor.map(call, phy_monitors))
+
+
+def _run_in_pool(func, phy_monitors: list, pool, priority: int = None, expires: float = None) -> list:
+    import vcp_worker
+    
+    if priority is None:
+        priority = vcp_worker.PRIORITY_SWEEP
+    futures = [(i, pool.submit(i, func, priority=priority)) for i in phy_monitors]
+    result = []
+    for monitor, future in futures:
+        try:
+            # 工作线程可能还在执行之前的任务, 不无限等待
+            wait = None if expires is None else max(0.0, expires - time.monotonic()) + DEADLINE_GRACE
+            try:
+                value = future.result(wait)
+            except FutureTimeout:
+                future.cancel()
+                raise vcp.CallTimeout('{}: deadline exceeded'.format(monitor.monitor_id))
+            result.append((monitor, value, None))
+        except Exception as err:
+            _LOGGER.error('%s: %s failed: %s', monitor.monitor_id, getattr(func, '__name__', func), err)
+            result.append((monitor, None, err))
+    return result
+
+
+# ############################################ 亮度同步
+# 曲线 -> 查找表, 同型号的显示器共用
+_BRIGHTNESS_LUT_CACHE = {}
+
+
+def brightness_lut(curve) -> tuple:
+    """
+    把校准曲线展开为 0-100 感知亮度对应的 Luminance 原始值百分比查找表, 线性插值.
+    同一条曲线只计算一次.
+    :param curve: [[感知亮度%, 原始值%], ...], None 为线性
+    :return: 101 个 float
+    """
+    if curve is None:
+        curve = ((0, 0), (100, 100))
+    key = tuple(tuple(i) for i in curve)
+    lut = _BRIGHTNESS_LUT_CACHE.get(key)
+    if lut is not None:
+        return lut
+
+    points = list(key)
+    # 曲线两端外推为水平线
+    if points[0][0] > 0:
+        points.insert(0, (0, points[0][1]))
+    if points[-1][0] < 100:
+        points.append((100, points[-1][1]))
+
+    table = []
+    segment = 0
+    for level in range(101):
+        while points[segment + 1][0] < level:
+            segment += 1
+        (x0, y0), (x1, y1) = points[segment], points[segment + 1]
+        table.append(y0 + (y1 - y0) * (level - x0) / (x1 - x0))
+    lut = tuple(table)
+    _BRIGHTNESS_LUT_CACHE[key] = lut
+    return lut
+
+
+_LUMINANCE = vcp_code.VCP_CODE['Luminance']
+
+
+class BrightnessGroup(object):
+    """
+    一组显示器同步亮度.
+
+    不同型号的显示器设置相同的 Luminance 值时实际亮度不同，每台显示器根据 quirks 中的 brightness_curve
+    把目标感知亮度 (0-100) 转换为 Luminance 原始值，并行写入；原始值没有变化的显示器不写入。
+    最大值优先使用 quirks 中的 channel_max; 读取失败 (最大值为 0) 的显示器不猜测最大值, set() 时重新读取，仍然失败时报告失败。
+    """
+    def __init__(self, phy_monitors: list, max_workers: int = DEFAULT_MAX_WORKERS):
+        """
+        构造时并行读取一次每台显示器的当前亮度和最大亮度
+        :param phy_monitors: vcp.PhyMonitor() instance(s)
+        :param max_workers: 最大线程数
+        """
+        self.members = list(phy_monitors)
+        self.max_workers = max_workers
+        self._lut = {i.monitor_id: brightness_lut(i.quirk.get('brightness_curve')) for i in self.members}
+        # {monitor_id: 最大值}, 不包括读取失败的显示器
+        self._max = {}
+        # {monitor_id: 最近一次写入 / 读取到的原始值}
+        self._last_raw = {}
+        # {monitor_id: 读取失败的原因}
+        self.failed = {}
+
+        for monitor, result, err in run_parallel(self._read, self.members, max_workers):
+            self._update(monitor, result, err)
+
+    @staticmethod
+    def _read(monitor) -> tuple:
+        """
+        :param monitor: vcp.PhyMonitor()
+        :return: (当前值, 最大值), quirks 中指定了 channel_max 时使用它作为最大值
+        """
+        current, max_ = monitor.read_vcp_code(_LUMINANCE)
+        if max_ <= 0:
+            # read_vcp_code() 失败时返回 (0, 0)
+            raise OSError('unable to read Luminance')
+        return current, (monitor.quirk.get('channel_max') or {}).get(_LUMINANCE, max_)
+
+    def _update(self, monitor, result, err):
+        if err is not None:
+            # run_parallel() 已经输出了日志
+            self.failed[monitor.monitor_id] = str(err) or type(err).__name__
+            return
+        self.failed.pop(monitor.monitor_id, None)
+        self._last_raw[monitor.monitor_id], self._max[monitor.monitor_id] = result
+
+    def raw_value(self, monitor, level: float) -> int:
+        """
+        目标感知亮度对应的 Luminance 原始值
+        :param monitor: vcp.PhyMonitor()
+        :param level: 感知亮度 0-100
+        :return:
+        """
+        level = min(100.0, max(0.0, float(level)))
+        lut = self._lut[monitor.monitor_id]
+        index = int(level)
+        percent = lut[index]
+        if index < 100:
+            percent += (lut[index + 1] - percent) * (level - index)
+        return int(round(percent * self._max[monitor.monitor_id] / 100))
+
+    def set(self, level: float) -> dict:
+        """
+        设置所有显示器的感知亮度
+        :param level: 感知亮度 0-100
+        :return: {monitor_id: 写入的原始值, 没有变化为 None, 失败 (包括读取不到最大值) 为 False}
+        """
+        unknown = [i for i in self.members if i.monitor_id not in self._max]
+        for monitor, current, err in run_parallel(self._read, unknown, self.max_workers):
+            self._update(monitor, current, err)
+        result = {i.monitor_id: None if i.monitor_id in self._max else False for i in self.members}
+        members = [i for i in self.members if i.monitor_id in self._max]
+
+        targets = {i.monitor_id: self.raw_value(i, level) for i in members}
+        changed = [i for i in members if self._last_raw.get(i.monitor_id) != targets[i.monitor_id]]
+
+        def write(monitor):
+            return monitor.set_vcp_value_by_name('Luminance', targets[monitor.monitor_id])
+
+        for monitor, ok, err in run_parallel(write, changed, self.max_workers):
+            if ok and err is None:
+                self._last_raw[monitor.monitor_id] = targets[monitor.monitor_id]
+                result[monitor.monitor_id] = targets[monitor.monitor_id]
+            else:
+                # 下次重新写入
+                self._last_raw.pop(monitor.monitor_id, None)
+                result[monitor.monitor_id] = False
+        return result
+
+
+# ############################################ 切换输入源
+# 缓存的输入源在这段时间(秒)内认为是准确的，目标输入源和缓存相同时不写入
+DEFAULT_INPUT_CACHE_MAX_AGE = 2.0
+# 等待显示器锁定新信号的轮询间隔: 从 INITIAL 开始每次乘以 BACKOFF，最大 MAX
+LOCK_POLL_INITIAL = 0.05
+LOCK_POLL_BACKOFF = 1.5
+LOCK_POLL_MAX = 1.0
+
+
+def _wait_input_lock(monitor, code: int, target: int, timeout: float) -> bool:
+    """
+    轮询直到显示器报告的输入源为 target
+    :param monitor: vcp.PhyMonitor()
+    :param code: Input Source VCP Code
+    :param target: 目标输入源的值
+    :param timeout: 超时(秒)
+    :return: 是否在超时前锁定
+    """
+    deadline = time.monotonic() + timeout
+    interval = LOCK_POLL_INITIAL
+    while True:
+        # 切换过程中显示器可能不响应 DDC/CI，读取失败时返回 0
+        if monitor.read_vcp_code(code)[0] == target:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * LOCK_POLL_BACKOFF, LOCK_POLL_MAX)
+
+
+def switch_input(phy_monitors: list, src: str, wait: float = 0, max_age: float = DEFAULT_INPUT_CACHE_MAX_AGE,
+                 max_workers: int = DEFAULT_MAX_WORKERS) -> dict:
+    """
+    同时切换多台显示器的输入源.
+    不读取当前输入源: 缓存的输入源足够新且和目标相同时跳过，否则直接写入。
+    :param phy_monitors: vcp.PhyMonitor() instance(s)
+    :param src: vcp_code.INPUT_SRC_CODE 的 key
+    :param wait: >0 时轮询等待每台显示器报告新的输入源，最多等待 wait 秒
+    :param max_age: 缓存的输入源允许的最长时间(秒)
+    :param max_workers: 最大线程数
+    :return: {monitor_id: {'ok': bool, 'skipped': bool, 'locked': bool / None, 'latency': 秒}}
+    """
+    if src not in vcp_code.INPUT_SRC_CODE:
+        raise ValueError('invalid input source: {}, available: {}'.format(src, list(vcp_code.INPUT_SRC_CODE)))
+    target = vcp_code.INPUT_SRC_CODE[src]
+    code = vcp_code.VCP_CODE['Input Source']
+
+    def switch(monitor):
+        started = time.monotonic()
+        cached = monitor.cached_vcp_value(code, max_age)
+        if cached is not None and cached[0] == target:
+            return {'ok': True, 'skipped': True, 'locked': True, 'latency': 0.0}
+
+        # 由下面的轮询确认结果，不做写入校验
+        ok = monitor.send_vcp_code(code, target, verify=False)
+        locked = None
+        if ok and wait > 0:
+            locked = _wait_input_lock(monitor, code, target, wait)
+        return {'ok': ok, 'skipped': False, 'locked': locked, 'latency': round(time.monotonic() - started, 3)}
+
+    result = {}
+    for monitor, report, err in run_parallel(switch, phy_monitors, max_workers):
+        if err is not None:
+            report = {'ok': False, 'skipped': False, 'locked': None, 'latency': None}
+        result[monitor.monitor_id] = report
+    return result
@@ -0,0 +1,224 @@
+# coding = utf-8
+
+import time
+import logging
+import threading
+
+"""
+显示器健康状态和断路器.
+
+每台 PhyMonitor 有一个 CircuitBreaker (PhyMonitor.health)，记录每次 DDC/CI 读写的结果:
+
+- closed: 正常. 连续失败 failure_threshold 次 (或者调用超时) 后进入 open
+- open: 读写直接失败，不访问显示器. 到了下一次检查的时间后由 PhyMonitor.probe() 读取 VCP Version (0xDF)
+- half_open: 检查时间已到，允许一次调用. 成功后回到 closed，失败后回到 open，下一次检查的间隔乘以 backoff
+
+vcp_fleet 的批量操作和命令行模式跳过 open 的显示器 (PhyMonitor.check_health())。HealthChecker 在后台线程中检查 open 的显示器，
+恢复后自动回到 closed。caps string 中没有列出的 VCP code 读写失败不计入 (显示器不支持而不是不响应)。
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 连续失败多少次后断开
+DEFAULT_FAILURE_THRESHOLD = 5
+# 第一次检查的间隔(秒), 之后每次失败乘以 BACKOFF, 最大 MAX
+DEFAULT_PROBE_INTERVAL = 5.0
+DEFAULT_PROBE_BACKOFF = 2.0
+DEFAULT_PROBE_INTERVAL_MAX = 300.0
+# HealthChecker 检查是否有需要检查的显示器的间隔(秒)
+DEFAULT_CHECK_INTERVAL = 1.0
+
+
+class CircuitBreaker(object):
+    """
+    一台显示器的断路器
+    """
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 probe_interval: float = DEFAULT_PROBE_INTERVAL, backoff: float = DEFAULT_PROBE_BACKOFF,
+                 probe_interval_max: float = DEFAULT_PROBE_INTERVAL_MAX):
+        """
+        :param failure_threshold: 连续失败多少次后断开
+        :param probe_interval: 断开后第一次检查的间隔(秒)
+        :param backoff: 检查失败后间隔乘以 backoff
+        :param probe_interval_max: 最大检查间隔(秒)
+        """
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.backoff = backoff
+        self.probe_interval_max = probe_interval_max
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._consecutive_failures = 0
+        self._interval = probe_interval
+        self._next_probe = 0.0
+        self._opened_at = None
+        self._counters = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0, 'recovered': 0}
+
+    def _open(self, now: float):
+        # 调用者持有 self._lock
+        if self.state == HALF_OPEN:
+            self._interval = min(self._interval * self.backoff, self.probe_interval_max)
+        elif self.state == CLOSED:
+            self._interval = self.probe_interval
+            self._opened_at = now
+            self._counters['opened'] += 1
+        self.state = OPEN
+        self._next_probe = now + self._interval
+
+    def allow(self) -> bool:
+        """
+        读写之前调用
+        :return: 是否允许访问显示器; open 且到了检查时间时进入 half_open 并允许一次
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if now >= self._next_probe:
+                # 一次试探调用, 结果返回之前的其它调用仍然拒绝
+                self.state = HALF_OPEN
+                self._next_probe = now + self._interval
+                return True
+            self._counters['rejected'] += 1
+            return False
+
+    def probe_due(self) -> bool:
+        """
+        :return: closed, 或者到了检查时间
+        """
+        with self._lock:
+            return self.state == CLOSED or time.monotonic() >= self._next_probe
+
+    def record(self, ok: bool):
+        """
+        记录一次读写的结果
+        :param ok:
+        :return:
+        """
+        with self._lock:
+            if ok:
+                self._counters['successes'] += 1
+                self._consecutive_failures = 0
+                if self.state != CLOSED:
+                    _LOGGER.debug('circuit closed after %.1fs', time.monotonic() - self._opened_at)
+                    self._counters['recovered'] += 1
+                    self.state = CLOSED
+                    self._interval = self.probe_interval
+                return
+            self._counters['failures'] += 1
+            self._consecutive_failures += 1
+            if self.state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                self._open(time.monotonic())
+
+    def half_open(self):
+        """
+        开始一次检查 (PhyMonitor.probe()), 结果由 record() 记录
+        :return:
+        """
+        with self._lock:
+            if self.state != CLOSED:
+                self.state = HALF_OPEN
+                self._next_probe = time.monotonic() + self._interval
+
+    def trip(self):
+        """
+        立即断开 (如调用超时)
+        :return:
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                self._open(time.monotonic())
+
+    def stats(self) -> dict:
+        """
+        :return: {'state', 'consecutive_failures', 'successes', 'failures', 'rejected', 'opened', 'recovered',
+                  'open_for': 秒, 'next_probe_in': 秒}
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['state'] = self.state
+            stats['consecutive_failures'] = self._consecutive_failures
+            now = time.monotonic()
+            if self.state == CLOSED:
+                stats['open_for'] = stats['next_probe_in'] = None
+            else:
+                stats['open_for'] = round(now - self._opened_at, 3)
+                stats['next_probe_in'] = round(max(0.0, self._next_probe - now), 3)
+        return stats
+
+
+class HealthChecker(object):
+    """
+    在后台线程中检查断开的显示器, 恢复后回到 closed
+    """
+    def __init__(self, phy_monitors: list, interval: float = DEFAULT_CHECK_INTERVAL, pool=None):
+        """
+        :param phy_monitors: vcp.PhyMonitor() instance(s)
+        :param interval: 查找需要检查的显示器的间隔(秒), 每台显示器的检查间隔由它的 CircuitBreaker 决定
+        :param pool: vcp_worker.WorkerPool, 给定时以 poll 优先级在每台显示器的工作线程中检查
+        """
+        self.interval = interval
+        self.pool = pool
+        self._monitors = list(phy_monitors)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def due(self) -> list:
+        """
+        :return: 断开或者 degraded, 且到了检查时间的显示器
+        """
+        return [i for i in self._monitors if (i.degraded or i.health.state != CLOSED) and i.health.probe_due()]
+
+    def check_once(self) -> dict:
+        """
+        并行检查所有到了检查时间的显示器
+        :return: {monitor_id: 是否恢复}
+        """
+        import vcp_fleet
+        import vcp_worker
+
+        monitors = self.due()
+        if not monitors:
+            return {}
+        result = {}
+        for monitor, ok, err in vcp_fleet.run_parallel(lambda m: m.probe(), monitors, pool=self.pool,
+                                                       priority=vcp_worker.PRIORITY_POLL, skip_degraded=False):
+            result[monitor.monitor_id] = bool(ok) and err is None
+            if result[monitor.monitor_id]:
+                _LOGGER.info('%s: recovered', monitor.monitor_id)
+        return result
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.check_once()
+            except Exception as err:
+                _LOGGER.error('health check failed: %s', err)
+            self._stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        """
+        启动后台检查线程
+        :return:
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='HealthChecker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """
+        停止后台检查线程
+        :param timeout:
+        :return:
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,366 @@
+# coding = utf-8
+
+import hmac
+import json
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+import vcp
+import vcp_code
+import vcp_fleet
+import vcp_health
+import vcp_worker
+
+"""
+HTTP / JSON 控制接口.
+
+服务启动时打开所有显示器并一直保持，每台显示器的操作在它的工作线程 (vcp_worker) 中执行。
+使用 HTTP/1.1 keep-alive，同一个连接可以连续发送多个请求。读取的值在 max_age 秒内直接从缓存返回。
+
+    GET  /monitors                          所有显示器
+    GET  /monitors/<id>                     一台显示器的所有属性: {"values": {...}, "errors": {...}}
+    GET  /monitors/<id>/<property>          读取属性, ?max_age=0 强制从显示器读取, 读取失败返回 502
+    PUT  /monitors/<id>/<property>          设置属性, body: {"value": 40}
+    POST /bulk                              批量操作, body:
+         {"monitors": ["P2401@1", ...] (省略为所有显示器), "set": {"brightness": 40}, "get": ["input_src"],
+          "max_age": 1.0}
+    GET  /stats                             每台显示器的工作线程、调用统计和健康状态
+
+属性名可以是 vcp.PROPERTY_TYPES 中的属性，也可以是 vcp_code.VCP_CODE 中的功能名称 (值为原始值)。
+monitor id 可以写成 URL 编码的形式，如 P2401%4065537。
+设置了 token 时每个请求都需要 'Authorization: Bearer <token>'，否则返回 401。
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# 读取的值的默认有效时间(秒)
+DEFAULT_MAX_AGE = 1.0
+# 请求 body 的最大长度
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class ApiError(Exception):
+    """
+    返回给客户端的错误
+    """
+    def __init__(self, status: int, message: str):
+        super(ApiError, self).__init__(message)
+        self.status = status
+
+
+class MonitorService(object):
+    """
+    HTTP 接口背后的操作, 和 HTTP 无关，可以直接调用
+    """
+    def __init__(self, phy_monitors: list, max_age: float = DEFAULT_MAX_AGE, pool=None):
+        """
+        :param phy_monitors: vcp.PhyMonitor() instance(s), 服务停止前不会关闭
+        :param max_age: 默认的缓存有效时间(秒)
+        :param pool: vcp_worker.WorkerPool, 默认新建
+        """
+        self.monitors = {i.monitor_id: i for i in phy_monitors}
+        self.max_age = max_age
+        self.pool = pool or vcp_worker.WorkerPool()
+        # {(monitor_id, property): (value, time.monotonic(), 读取用到的 VCP code 或 None)}
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+    def _monitor(self, monitor_id: str):
+        monitor = self.monitors.get(monitor_id)
+        if monitor is None:
+            raise ApiError(404, 'monitor not found: {}'.format(monitor_id))
+        return monitor
+
+    @staticmethod
+    def _check_property(name: str):
+        if name not in vcp.PROPERTY_TYPES and name not in vcp_code.VCP_CODE:
+            raise ApiError(404, 'unknown property: {}'.format(name))
+
+    @staticmethod
+    def _read(monitor, name: str):
+        """
+        :raise ApiError: 读取失败 (502)
+        """
+        start = time.monotonic()
+        if name in vcp_code.VCP_CODE:
+            value = monitor.get_vcp_value_by_name(name)[0]
+        else:
+            value = getattr(monitor, name)
+        # 读取失败时属性返回 0 或 '', 按缓存的时间检查用到的每个 code 都在这次读取中成功
+        failed = [code for code in sorted(vcp.property_vcp_codes(name) or ())
+                  if (monitor.cached_vcp_time(code) or 0) < start]
+        if failed:
+            raise ApiError(502, 'failed to read {}: {}'.format(
+                name, ', '.join('0x{:02X}'.format(i) for i in failed)))
+        return value
+
+    @staticmethod
+    def _write(monitor, name: str, value) -> bool:
+        # 功能名称的值为原始值
+        value_type = vcp.PROPERTY_TYPES.get(name, int)
+        return monitor.set_property(name, tuple(value) if value_type is tuple else value_type(value))
+
+    def _invalidate(self, monitor_id: str, name: str):
+        """
+        删除写入 name 后可能改变的缓存, 按 VCP code 匹配: 如设置 brightness 同时删除 Luminance,
+        设置 color_preset 同时删除 rgb_gain 等
+        """
+        written = vcp.written_vcp_codes(name)
+        with self._cache_lock:
+            for key in [k for k in self._cache if k[0] == monitor_id]:
+                codes = self._cache[key][2]
+                if written is None or codes is None or codes & written:
+                    del self._cache[key]
+
+    def list_monitors(self) -> list:
+        return [{'monitor': i.monitor_id, 'model': i.model, 'display_type': i.info_display_type,
+                 'properties': [k for k in vcp.PROPERTY_TYPES]} for i in self.monitors.values()]
+
+    def get(self, monitor_id: str, name: str, max_age: float = None):
+        """
+        读取属性, 缓存足够新时不访问显示器
+        :param monitor_id:
+        :param name: 属性名
+        :param max_age: 缓存有效时间(秒), None 使用默认值
+        :return:
+        :raise ApiError: 显示器或属性不存在 (404), 读取失败 (502)
+        """
+        monitor = self._monitor(monitor_id)
+        self._check_property(name)
+        max_age = self.max_age if max_age is None else max_age
+        key = (monitor_id, name)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None and time.monotonic() - cached[1] <= max_age:
+                self._cache_hits += 1
+                return cached[0]
+            self._cache_misses += 1
+        value = self.pool.submit(monitor, self._read, name).result()
+        if isinstance(value, tuple):
+            value = list(value)
+        with self._cache_lock:
+            self._cache[key] = (value, time.monotonic(), vcp.property_vcp_codes(name))
+        return value
+
+    def set(self, monitor_id: str, name: str, value) -> bool:
+        """
+        设置属性
+        :return: 是否成功
+        """
+        monitor = self._monitor(monitor_id)
+        self._check_property(name)
+        self._invalidate(monitor_id, name)
+        try:
+            return bool(self.pool.submit(monitor, self._write, name, value).result())
+        except (TypeError, ValueError) as err:
+            raise ApiError(400, 'invalid value for {}: {!r}: {}'.format(name, value, err))
+        except AttributeError as err:
+            raise ApiError(400, str(err))
+        finally:
+            # 写入期间的读取可能缓存了旧的值
+            self._invalidate(monitor_id, name)
+
+    def get_all(self, monitor_id: str, max_age: float = None) -> dict:
+        """
+        读取一台显示器的所有属性, 读取失败的属性放在 errors 中
+        :return: {'values': {name: value}, 'errors': {name: message}}
+        """
+        self._monitor(monitor_id)
+        result = {'values': {}, 'errors': {}}
+        for name in vcp.PROPERTY_TYPES:
+            try:
+                result['values'][name] = self.get(monitor_id, name, max_age)
+            except Exception as err:
+                result['errors'][name] = str(err)
+        return result
+
+    def bulk(self, request: dict) -> dict:
+        """
+        对多台显示器并行执行 set 和 get, 先 set 再 get
+        :param request: {"monitors": [...], "set": {name: value}, "get": [name], "max_age": seconds}
+        :return: {monitor_id: {'set': {name: ok}, 'get': {name: value}, 'errors': {name: message}}}
+        """
+        if not isinstance(request, dict):
+            raise ApiError(400, 'request body must be a JSON object')
+        monitor_ids = request.get('monitors')
+        if monitor_ids is not None and (not isinstance(monitor_ids, list) or
+                                        not all(isinstance(i, str) for i in monitor_ids)):
+            raise ApiError(400, '"monitors" must be a list of monitor ids')
+        monitor_ids = monitor_ids or list(self.monitors)
+        to_set = request.get('set') or {}
+        if not isinstance(to_set, dict):
+            raise ApiError(400, '"set" must be an object')
+        to_get = request.get('get') or []
+        if not isinstance(to_get, list) or not all(isinstance(i, str) for i in to_get):
+            raise ApiError(400, '"get" must be a list of property names')
+        for name in list(to_set) + list(to_get):
+            self._check_property(name)
+        monitors = [self._monitor(i) for i in monitor_ids]
+        max_age = request.get('max_age')
+
+        def run(monitor):
+            result = {'set': {}, 'get': {}, 'errors': {}}
+            for name, value in to_set.items():
+                try:
+                    result['set'][name] = self.set(monitor.monitor_id, name, value)
+                except Exception as err:
+                    result['errors'][name] = str(err)
+            for name in to_get:
+                try:
+                    result['get'][name] = self.get(monitor.monitor_id, name, max_age)
+                except Exception as err:
+                    result['errors'][name] = str(err)
+            return result
+
+        # 每台显示器的操作在各自的工作线程中排队，这里的线程只是等待结果
+        result = {}
+        for monitor, report, err in vcp_fleet.run_parallel(run, monitors):
+            if err is not None:
+                # degraded / 断路器断开的显示器被跳过
+                report = {'set': {}, 'get': {}, 'errors': {'*': str(err)}}
+            result[monitor.monitor_id] = report
+        return result
+
+    def stats(self) -> dict:
+        with self._cache_lock:
+            cache = {'hits': self._cache_hits, 'misses': self._cache_misses, 'entries': len(self._cache)}
+        workers = self.pool.stats()
+        return {'cache': cache,
+                'monitors': {i.monitor_id: {'worker': workers.get(i.monitor_id), 'calls': i.dedup_stats,
+                                            'health': i.health_stats}
+                             for i in self.monitors.values()}}
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # keep-alive: 每个响应都带 Content-Length
+    protocol_version = 'HTTP/1.1'
+    server_version = 'monitor_ctrl'
+
+    @property
+    def service(self) -> MonitorService:
+        return self.server.service
+
+    def log_message(self, format_, *args):
+        _LOGGER.debug('%s - %s', self.address_string(), format_ % args)
+
+    def _send_json(self, status: int, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_SIZE:
+            # 没有读取 body, 不能继续使用这个连接
+            self.close_connection = True
+            raise ApiError(413, 'request body too large')
+        if length == 0:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError as err:
+            raise ApiError(400, 'invalid JSON: {}'.format(err))
+
+    def _check_token(self):
+        token = self.server.token
+        if token and not hmac.compare_digest(self.headers.get('Authorization', ''), 'Bearer ' + token):
+            raise ApiError(401, 'invalid token')
+
+    def _dispatch(self, method: str):
+        url = urlsplit(self.path)
+        parts = [unquote(i) for i in url.path.split('/') if i]
+        query = parse_qs(url.query)
+        try:
+            # 先读取 body, 返回错误后同一个连接还可以继续使用
+            body = self._read_json() if method in ('PUT', 'POST') else None
+            self._check_token()
+            max_age = float(query['max_age'][0]) if 'max_age' in query else None
+            if method == 'GET' and parts == ['monitors']:
+                result = self.service.list_monitors()
+            elif method == 'GET' and len(parts) == 2 and parts[0] == 'monitors':
+                result = self.service.get_all(parts[1], max_age)
+            elif method == 'GET' and len(parts) == 3 and parts[0] == 'monitors':
+                result = {'value': self.service.get(parts[1], parts[2], max_age)}
+            elif method in ('PUT', 'POST') and len(parts) == 3 and parts[0] == 'monitors':
+                if not isinstance(body, dict) or 'value' not in body:
+                    raise ApiError(400, 'request body must be {"value": ...}')
+                result = {'ok': self.service.set(parts[1], parts[2], body['value'])}
+            elif method == 'POST' and parts == ['bulk']:
+                result = self.service.bulk(body)
+            elif method == 'GET' and parts == ['stats']:
+                result = self.service.stats()
+            else:
+                raise ApiError(404, 'not found: {} {}'.format(method, url.path))
+        except ApiError as err:
+            self._send_json(err.status, {'error': str(err)})
+            return
+        except ValueError as err:
+            self._send_json(400, {'error': str(err)})
+            return
+        except Exception as err:
+            _LOGGER.exception('%s %s failed', method, self.path)
+            self._send_json(500, {'error': str(err)})
+            return
+        self._send_json(200, result)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+
+def make_server(service: MonitorService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                token: str = None) -> ThreadingHTTPServer:
+    """
+    创建 HTTP 服务, 调用 serve_forever() 启动
+    :param service:
+    :param host:
+    :param port: 0 为随机端口 (server.server_address[1])
+    :param token: 客户端需要提供的 token, None 不检查
+    :return:
+    """
+    server = ThreadingHTTPServer((host, port), _RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.token = token
+    return server
+
+
+def serve(phy_monitors: list, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, max_age: float = DEFAULT_MAX_AGE,
+          token: str = None):
+    """
+    启动 HTTP 服务直到 Ctrl-C
+    :param phy_monitors: vcp.PhyMonitor() instance(s)
+    :param host:
+    :param port:
+    :param max_age: 缓存有效时间(秒)
+    :param token: 客户端需要提供的 token, None 不检查
+    :return:
+    """
+    service = MonitorService(phy_monitors, max_age)
+    server = make_server(service, host, port, token)
+    # 断开的显示器在后台检查, 恢复后不需要等到下一次请求
+    checker = vcp_health.HealthChecker(list(service.monitors.values()), pool=service.pool)
+    checker.start()
+    _LOGGER.info('serving %s monitor(s) on http://%s:%s', len(service.monitors), *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        checker.stop(timeout=5)
+        service.pool.stop(timeout=5)
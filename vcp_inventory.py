@@ -0,0 +1,210 @@
+# coding = utf-8
+
+import time
+import logging
+import vcp_code
+import vcp_edid
+import vcp_fleet
+
+"""
+显示器资产清单.
+
+每台显示器一次批量读取 EDID 信息和 Display Usage Time / Display Controller ID，
+VCP Version 和 Display Firmware Level 使用 PhyMonitor 构造时读取的值，所有显示器并行读取。
+增量模式只重新读取会变化的计数器 (开机小时数)。caps string 中没有列出的计数器为 None，不读取；
+读取失败的计数器也为 None，增量模式下保留上一次的值。读取失败的显示器输出一条只有 monitor_id / model / error 的记录，
+增量模式不使用这些记录。
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+# 输出字段的顺序
+INVENTORY_FIELDS = (
+    'monitor_id',
+    'model',
+    'model_index',
+    'display_type',
+    'manufacturer',
+    'product_code',
+    'edid_name',
+    'serial',
+    'serial_number',
+    'manufacture_year',
+    'manufacture_week',
+    'native_resolution',
+    'vcp_version',
+    'firmware_level',
+    'controller_id',
+    'usage_hours',
+    'updated',
+    'error',
+)
+
+# 增量模式下重新读取的计数器: {字段: vcp_code.VCP_CODE 的 key}
+COUNTER_CODES = {
+    'usage_hours': 'Display Usage Time',
+}
+
+
+def format_vcp_version(value: int) -> str:
+    """
+    VCP Version (0xDF): 高字节版本号, 低字节修订号
+    :param value:
+    :return: '2.1'
+    """
+    return '{}.{}'.format((value >> 8) & 0xFF, value & 0xFF)
+
+
+def inventory_key(record: dict) -> str:
+    """
+    跨多次运行识别同一台显示器: 有 EDID 序列号时用 厂商+产品+序列号，
+    否则用 型号#序号 (同一型号按枚举顺序编号; monitor_id 中的 handle 每次运行都会变化)
+    :param record:
+    :return:
+    """
+    serial = record.get('serial') or record.get('serial_number')
+    if record.get('manufacturer') and serial:
+        return '{}-{}-{}'.format(record['manufacturer'], record.get('product_code'), serial)
+    return '{}#{}'.format(record.get('model'), record.get('model_index'))
+
+
+def _read_code(monitor, key: str):
+    """
+    :param monitor: vcp.PhyMonitor()
+    :param key: vcp_code.VCP_CODE 的 key
+    :return: 当前值, caps string 中没有列出或者读取失败时为 None
+    """
+    if not monitor.supports_vcp_code(vcp_code.VCP_CODE[key]):
+        return None
+    value, max_value = monitor.get_vcp_value_by_name(key)
+    if max_value <= 0:
+        # 读取失败时返回 (0, 0), 不是真实的值
+        _LOGGER.warning('%s: unable to read %s', monitor.monitor_id, key)
+        return None
+    return value
+
+
+def _read_counters(monitor) -> dict:
+    """
+    读取会变化的计数器
+    :param monitor: vcp.PhyMonitor()
+    :return: {字段: 值}, caps string 中没有列出或者读取失败的为 None
+    """
+    return {field: _read_code(monitor, key) for field, key in COUNTER_CODES.items()}
+
+
+def collect_monitor(monitor, edid: dict = None, model_index: int = 1) -> dict:
+    """
+    读取一台显示器的资产信息
+    :param monitor: vcp.PhyMonitor()
+    :param edid: vcp_edid.parse_edid() 的结果
+    :param model_index: 同一型号中按枚举顺序的序号, 从 1 开始
+    :return:
+    """
+    edid = edid or {}
+    record = _read_counters(monitor)
+    record.update({
+        'monitor_id': monitor.monitor_id,
+        'model': monitor.model,
+        'model_index': model_index,
+        'display_type': monitor.info_display_type,
+        'manufacturer': edid.get('manufacturer', ''),
+        'product_code': edid.get('product_code', ''),
+        'edid_name': edid.get('name', ''),
+        'serial': edid.get('serial', ''),
+        'serial_number': edid.get('serial_number', ''),
+        'manufacture_year': edid.get('manufacture_year', ''),
+        'manufacture_week': edid.get('manufacture_week', ''),
+        'native_resolution': edid.get('native_resolution', ''),
+        'vcp_version': format_vcp_version(monitor.vcp_version),
+        'firmware_level': monitor.firmware_level,
+        'controller_id': _read_code(monitor, 'Display Controller ID'),
+        'updated': time.time(),
+        'error': '',
+    })
+    return record
+
+
+def collect(phy_monitors: list, previous: list = None, max_workers: int = vcp_fleet.DEFAULT_MAX_WORKERS,
+            pool=None) -> list:
+    """
+    并行读取所有显示器的资产信息
+    :param phy_monitors: vcp.PhyMonitor() instance(s)
+    :param previous: 上一次的结果，给定时已知的显示器只重新读取 COUNTER_CODES
+    :param max_workers: 最大线程数
+    :param pool: vcp_worker.WorkerPool, 给定时以最低优先级 (sweep) 在每台显示器的工作线程中读取
+    :return: [record, ...], 读取失败的显示器为 {'monitor_id', 'model', 'model_index', 'error'}
+    """
+    phy_monitors = list(phy_monitors)
+    edids = vcp_edid.match_edids(phy_monitors, vcp_edid.read_edids())
+    # 读取失败的记录没有资产信息, 不能作为增量的基础
+    previous_by_key = {inventory_key(i): i for i in previous or [] if not i.get('error')}
+    # {monitor_id: 同一型号中的序号}
+    model_index = {}
+    model_count = {}
+    for monitor in phy_monitors:
+        model_count[monitor.model] = model_count.get(monitor.model, 0) + 1
+        model_index[monitor.monitor_id] = model_count[monitor.model]
+
+    def sweep(monitor):
+        edid = edids.get(monitor.monitor_id, {})
+        index = model_index[monitor.monitor_id]
+        old = previous_by_key.get(inventory_key(dict(edid, model=monitor.model, model_index=index)))
+        if old is None:
+            return collect_monitor(monitor, edid, index)
+        # 增量: 只读取会变化的计数器
+        record = dict(old)
+        # 读取失败的计数器保留上一次的值
+        record.update({k: v for k, v in _read_counters(monitor).items() if v is not None})
+        record['monitor_id'] = monitor.monitor_id
+        record['updated'] = time.time()
+        record['error'] = ''
+        return record
+
+    records = []
+    for monitor, record, err in vcp_fleet.run_parallel(sweep, phy_monitors, max_workers, pool):
+        if err is not None:
+            record = {'monitor_id': monitor.monitor_id, 'model': monitor.model,
+                      'model_index': model_index[monitor.monitor_id], 'error': str(err) or type(err).__name__}
+        records.append(record)
+    return records
+
+
+def to_json(records: list, file):
+    """
+    输出 JSON
+    :param records: collect() 的结果
+    :param file: 输出的文件对象
+    :return:
+    """
+    import json
+
+    json.dump([{k: i.get(k, '') for k in INVENTORY_FIELDS} for i in records], file, indent=1, ensure_ascii=False)
+    file.write('\n')
+
+
+def to_csv(records: list, file):
+    """
+    输出 CSV
+    :param records: collect() 的结果
+    :param file: 输出的文件对象
+    :return:
+    """
+    import csv
+
+    writer = csv.DictWriter(file, fieldnames=INVENTORY_FIELDS, extrasaction='ignore', lineterminator='\n')
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+
+
+def load_json(path: str) -> list:
+    """
+    载入 to_json() 输出的文件, 用于增量模式
+    :param path:
+    :return:
+    """
+    import json
+
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
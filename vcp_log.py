@@ -0,0 +1,108 @@
+# coding = utf-8
+
+import sys
+import json
+import time
+import logging
+import threading
+
+"""
+结构化日志 (JSON lines).
+
+vcp.PhyMonitor 的 send_vcp_code() / read_vcp_code() 在 DEBUG 级别输出带有结构化字段的日志记录:
+    monitor     显示器 id (PhyMonitor.monitor_id)
+    op          'set' / 'get'
+    vcp_code    VCP code
+    value       写入或读取到的值
+    result      调用结果
+    latency_ms  耗时
+
+JsonLinesFormatter 把这些字段输出为一行 JSON，RateLimitFilter 限制重复的错误日志。
+"""
+
+# 结构化日志记录中可能出现的字段
+STRUCTURED_FIELDS = ('monitor', 'op', 'vcp_code', 'value', 'result', 'latency_ms')
+
+# 相同的错误在这段时间(秒)内只输出一次
+DEFAULT_RATE_LIMIT_INTERVAL = 10.0
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    每条日志输出为一行 JSON
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    限制重复的 WARNING 以上级别的日志: 相同位置、相同消息模板、相同显示器的记录在 interval 秒内只输出一次，
+    下一次输出时在 record.suppressed 中报告期间被丢弃的条数。
+    """
+    def __init__(self, interval: float = DEFAULT_RATE_LIMIT_INTERVAL, min_level: int = logging.WARNING):
+        super(RateLimitFilter, self).__init__()
+        self.interval = interval
+        self.min_level = min_level
+        # key: [last_emit_time, suppressed_count]
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.min_level:
+            return True
+
+        key = (record.pathname, record.lineno, str(record.msg), getattr(record, 'monitor', None))
+        now = time.monotonic()
+        with self._lock:
+            state = self._seen.get(key)
+            if state is not None and now - state[0] < self.interval:
+                state[1] += 1
+                return False
+            record.suppressed = state[1] if state is not None else 0
+            self._seen[key] = [now, 0]
+        return True
+
+
+def setup_structured_logging(path: str, level: int = logging.DEBUG,
+                             rate_limit_interval: float = DEFAULT_RATE_LIMIT_INTERVAL) -> logging.Handler:
+    """
+    添加 JSON lines 日志输出, 和 logging.basicConfig() 的设置互不影响.
+    root logger 的级别会降低到 level，已有 handler 保持原来的级别.
+    :param path: 输出文件, '-' 输出到 stderr
+    :param level: 结构化日志的级别
+    :param rate_limit_interval: 重复错误的限制间隔(秒), 0 不限制
+    :return: 添加的 handler
+    """
+    if path == '-':
+        handler = logging.StreamHandler(sys.stderr)
+    else:
+        handler = logging.FileHandler(path, encoding='utf-8')
+    handler.setLevel(level)
+    handler.setFormatter(JsonLinesFormatter())
+    if rate_limit_interval > 0:
+        handler.addFilter(RateLimitFilter(rate_limit_interval))
+
+    root = logging.getLogger()
+    if level < root.getEffectiveLevel():
+        for i in root.handlers:
+            if i.level == logging.NOTSET:
+                i.setLevel(root.getEffectiveLevel())
+        root.setLevel(level)
+    root.addHandler(handler)
+    return handler
@@ -0,0 +1,142 @@
+# coding = utf-8
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import vcp_code
+import vcp_fleet
+
+"""
+多台显示器电源开关.
+
+逐台开机太慢，同时开机的浪涌电流可能让空气开关跳闸。PowerOrchestrator 按顺序错开每台显示器的开始时间 (stagger)，
+同时进行的写入不超过 max_concurrent；写入时不逐台读回校验，全部写入后每轮并行读取一次还没有确认的显示器，
+直到全部达到目标状态或超时。
+
+关机/待机后 0xD6 可能返回 0x02-0x05 (vcp_code.POWER_MODE_OFF_VALUES)，都认为是 'off'。
+显示器在刚开机或待机时可能不响应 DDC/CI，读取失败的显示器在下一轮继续读取。
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+# 相邻两台显示器开始写入的间隔(秒)
+DEFAULT_STAGGER = 0.5
+# 同时进行的写入数
+DEFAULT_MAX_CONCURRENT = 4
+# 全部写入后等待确认的最长时间(秒)
+DEFAULT_CONFIRM_TIMEOUT = 15.0
+# 每轮确认读取的间隔(秒)
+DEFAULT_CONFIRM_INTERVAL = 0.5
+
+_POWER_MODE = vcp_code.VCP_CODE['Power Mode']
+
+
+def power_state(value: int) -> str:
+    """
+    0xD6 读取到的值对应的状态
+    :param value: read_vcp_code() 的值 (已按 quirks 转换)
+    :return: 'on' / 'off' / None (读取失败或未知的值)
+    """
+    if value == vcp_code.POWER_MODE_CODE['on']:
+        return 'on'
+    if value in vcp_code.POWER_MODE_OFF_VALUES:
+        return 'off'
+    return None
+
+
+class PowerOrchestrator(object):
+    """
+    错开时间并行设置多台显示器的电源状态.
+
+    set() 返回每台显示器的时间线, 时间为相对于开始的秒数:
+    {monitor_id: {'scheduled': 计划开始时间, 'write_start', 'write_end', 'write_ok': bool,
+                  'confirmed': 确认达到目标状态的时间 / None, 'state': 最后读取到的状态, 'ok': bool}}
+    """
+    def __init__(self, phy_monitors: list, stagger: float = DEFAULT_STAGGER,
+                 max_concurrent: int = DEFAULT_MAX_CONCURRENT, confirm_timeout: float = DEFAULT_CONFIRM_TIMEOUT,
+                 confirm_interval: float = DEFAULT_CONFIRM_INTERVAL):
+        """
+        :param phy_monitors: vcp.PhyMonitor() instance(s), 按这个顺序开始写入
+        :param stagger: 相邻两台显示器开始写入的最小间隔(秒), 0 不错开
+        :param max_concurrent: 同时进行的写入数
+        :param confirm_timeout: 全部写入后等待确认的最长时间(秒), 0 不确认
+        :param confirm_interval: 每轮确认读取的间隔(秒)
+        """
+        self.members = list(phy_monitors)
+        self.stagger = max(0.0, stagger)
+        self.max_concurrent = max(1, max_concurrent)
+        self.confirm_timeout = confirm_timeout
+        self.confirm_interval = confirm_interval
+
+    def _write_all(self, target: int, timeline: dict, started: float):
+        """
+        按 stagger 错开时间写入, 同时最多 max_concurrent 个
+        """
+        def write(monitor):
+            record = timeline[monitor.monitor_id]
+            delay = started + record['scheduled'] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            write_start = time.monotonic() - started
+            try:
+                ok = monitor.set_vcp_value_by_name('Power Mode', target, verify=False)
+            except Exception as err:
+                _LOGGER.error('%s: power write failed: %s', monitor.monitor_id, err)
+                ok = False
+            record['write_start'] = round(write_start, 3)
+            record['write_end'] = round(time.monotonic() - started, 3)
+            record['write_ok'] = bool(ok)
+
+        # 线程池按提交顺序取任务，worker 数即并发上限
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrent, len(self.members))) as executor:
+            list(executor.map(write, self.members))
+
+    def _confirm(self, mode: str, timeline: dict, started: float):
+        """
+        每轮并行读取还没有确认的显示器, 直到全部确认或超时
+        """
+        pending = [i for i in self.members if timeline[i.monitor_id]['write_ok']]
+        deadline = time.monotonic() + self.confirm_timeout
+        while pending:
+            reads = vcp_fleet.run_parallel(lambda m: m.read_vcp_code(_POWER_MODE)[0], pending, len(pending))
+            now = round(time.monotonic() - started, 3)
+            still_pending = []
+            for monitor, value, err in reads:
+                record = timeline[monitor.monitor_id]
+                state = power_state(value) if err is None else None
+                if state is not None:
+                    record['state'] = state
+                if state == mode:
+                    record['confirmed'] = now
+                else:
+                    still_pending.append(monitor)
+            pending = still_pending
+            if not pending or time.monotonic() + self.confirm_interval > deadline:
+                break
+            time.sleep(self.confirm_interval)
+        for monitor in pending:
+            _LOGGER.warning('%s: power mode %s not confirmed after %ss, last state: %s', monitor.monitor_id, mode,
+                            self.confirm_timeout, timeline[monitor.monitor_id]['state'])
+
+    def set(self, mode: str) -> dict:
+        """
+        设置所有显示器的电源状态
+        :param mode: vcp_code.POWER_MODE_CODE 的 key
+        :return: 每台显示器的时间线, 见类的说明
+        """
+        if mode not in vcp_code.POWER_MODE_CODE:
+            raise ValueError('invalid power mode: {}, available: {}'.format(mode, list(vcp_code.POWER_MODE_CODE)))
+        timeline = {i.monitor_id: {'scheduled': round(index * self.stagger, 3), 'write_start': None,
+                                   'write_end': None, 'write_ok': False, 'confirmed': None, 'state': None,
+                                   'ok': False}
+                    for index, i in enumerate(self.members)}
+        if not self.members:
+            return timeline
+
+        started = time.monotonic()
+        self._write_all(vcp_code.POWER_MODE_CODE[mode], timeline, started)
+        if self.confirm_timeout > 0:
+            self._confirm(mode, timeline, started)
+        for record in timeline.values():
+            record['ok'] = record['write_ok'] and (self.confirm_timeout <= 0 or record['confirmed'] is not None)
+        return timeline
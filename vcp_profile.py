@@ -0,0 +1,221 @@
+# coding = utf-8
+
+import os
+import time
+import logging
+import threading
+
+"""
+嵌套的耗时记录 (tracing spans).
+
+默认关闭，关闭时 span() 返回一个什么也不做的对象，PhyMonitor 的读写只多一次 `TRACER is None` 判断。
+enable() 之后记录:
+
+    enumerate                               枚举显示器
+      probe                                 打开一台显示器
+        caps / parse                        读取并解析 caps string
+    set brightness / get brightness         命令行 -s 的每个属性 (get 为确定类型的读取)
+      send_vcp_code(0x10) / read_vcp_code(0x10)
+        bus set_vcp_feature / bus get_vcp_feature     每次 DDC/CI 调用
+
+时间戳为 time.perf_counter() (单调)。save() 根据扩展名输出:
+
+- .json: Chrome trace event 格式, 用 chrome://tracing 或 https://ui.perfetto.dev 打开
+- .folded / .txt: folded stacks (每行 `a;b;c 自身耗时微秒`), 用 flamegraph.pl 或 speedscope 生成火焰图
+
+    tracer = vcp_profile.enable()
+    with vcp_profile.span('my operation', monitor=pm.monitor_id):
+        pm.brightness = 40
+    vcp_profile.disable().save('trace.json')
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+# 当前的 Tracer, None 为关闭
+TRACER = None
+
+
+class Span(object):
+    """
+    一个正在进行的 span, end() 或者 with 结束时记录
+    """
+    __slots__ = ('tracer', 'name', 'args', 'start', 'children', 'parent')
+
+    def __init__(self, tracer, name: str, args: dict, parent):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.parent = parent
+        # 子 span 的总耗时, 用于计算自身耗时
+        self.children = 0.0
+        self.start = time.perf_counter()
+
+    def end(self, **args):
+        """
+        :param args: 追加到 Chrome trace 的 args, 如调用结果
+        :return:
+        """
+        if args:
+            self.args = dict(self.args, **args) if self.args else args
+        self.tracer._end(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.end(error=exc_type.__name__)
+        else:
+            self.end()
+
+
+class _NullSpan(object):
+    """
+    关闭时 span() 返回的对象
+    """
+    __slots__ = ()
+
+    def end(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer(object):
+    """
+    记录所有线程的 span
+    """
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # [(name, start, duration, thread_id, args)]
+        self._events = []
+        # {'a;b;c': 自身耗时(秒)}
+        self._folded = {}
+        # {thread_id: thread name}
+        self._threads = {}
+
+    def begin(self, name: str, args: dict = None) -> Span:
+        """
+        开始一个 span, 同一个线程中之后开始的 span 是它的子 span. 必须在同一个线程中 end()
+        :param name: 名称, 不能包含 ';'
+        :param args: Chrome trace 的 args
+        :return:
+        """
+        local = self._local
+        span = Span(self, name, args, getattr(local, 'top', None))
+        local.top = span
+        return span
+
+    def _end(self, span: Span):
+        duration = time.perf_counter() - span.start
+        self._local.top = span.parent
+        if span.parent is not None:
+            span.parent.children += duration
+        names = []
+        node = span
+        while node is not None:
+            names.append(node.name)
+            node = node.parent
+        path = ';'.join(reversed(names))
+        thread = threading.current_thread()
+        with self._lock:
+            self._events.append((span.name, span.start, duration, thread.ident, span.args))
+            self._folded[path] = self._folded.get(path, 0.0) + max(0.0, duration - span.children)
+            if thread.ident not in self._threads:
+                self._threads[thread.ident] = thread.name
+
+    def summary(self) -> dict:
+        """
+        :return: {name: {'count', 'total', 'max'}}, 时间单位为秒
+        """
+        result = {}
+        with self._lock:
+            events = list(self._events)
+        for name, _, duration, _, _ in events:
+            item = result.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            item['count'] += 1
+            item['total'] += duration
+            item['max'] = max(item['max'], duration)
+        return result
+
+    def chrome_trace(self) -> dict:
+        """
+        :return: Chrome trace event 格式
+        """
+        pid = os.getpid()
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                 for tid, name in threads.items()]
+        for name, start, duration, tid, args in events:
+            event = {'name': name, 'cat': 'vcp', 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': round((start - self._origin) * 1e6, 3), 'dur': round(duration * 1e6, 3)}
+            if args:
+                event['args'] = args
+            trace.append(event)
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def folded(self) -> str:
+        """
+        :return: folded stacks, 每行 `a;b;c 自身耗时微秒`
+        """
+        with self._lock:
+            folded = dict(self._folded)
+        return ''.join('{} {}\n'.format(path, int(round(seconds * 1e6)))
+                       for path, seconds in sorted(folded.items()))
+
+    def save(self, path: str):
+        """
+        :param path: .folded / .txt 为 folded stacks, 其它为 Chrome trace JSON
+        :return:
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            if os.path.splitext(path)[1].lower() in ('.folded', '.txt'):
+                f.write(self.folded())
+            else:
+                import json
+                json.dump(self.chrome_trace(), f, ensure_ascii=False, default=str)
+        _LOGGER.info('trace saved to %s (%s spans)', path, len(self._events))
+
+
+def enable() -> Tracer:
+    """
+    开始记录
+    :return: 新的 Tracer
+    """
+    global TRACER
+    TRACER = Tracer()
+    return TRACER
+
+
+def disable() -> Tracer:
+    """
+    停止记录
+    :return: 之前的 Tracer, 没有开启时为 None
+    """
+    global TRACER
+    tracer, TRACER = TRACER, None
+    return tracer
+
+
+def span(name: str, **args):
+    """
+    with vcp_profile.span('name', key=value): ...
+    :param name: 名称, 不能包含 ';'
+    :param args: Chrome trace 的 args
+    :return: 关闭时为 NULL_SPAN
+    """
+    tracer = TRACER
+    if tracer is None:
+        return NULL_SPAN
+    return tracer.begin(name, args)
@@ -0,0 +1,288 @@
+# coding = utf-8
+
+import logging
+import vcp_code
+
+"""
+按型号 / 固件版本记录的显示器 quirks.
+
+每个条目用 'model' 匹配 caps string 里的型号 ('*' 匹配所有型号)，
+可选的 'vcp_version' (0xDF) 和 'firmware' (0xC9) 用来区分同一型号的不同固件。
+一台显示器匹配到的所有条目按照 通配 -> 型号 -> 型号+版本 的顺序合并，后面的覆盖前面的。
+
+JSON 文件格式和 QUIRKS_DB 一样，VCP code 可以写成 "0xD6" 这样的字符串:
+
+[
+    {"model": "P2401", "command_delay": 0.05, "broken_codes": ["0x0C"],
+     "channel_max": {"0x1A": 80}}
+]
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+# 没有匹配到任何条目时使用的默认值
+DEFAULT_QUIRK = {
+    # 每次写入之后等待的时间(秒)，有些显示器连续发送指令会出错
+    'command_delay': 0.0,
+    # 不支持或者工作不正常的 VCP code，不会发送到显示器
+    'broken_codes': [],
+    # 读取到的值的映射: {code: {raw_value: value}}
+    'value_remap': {},
+    # 单独指定的最大值，不再读取显示器报告的最大值: {code: max}
+    'channel_max': {},
+    # 色温 = color_temp_base + 'User Color Temperature Increment' * 'User Color Temperature'
+    'color_temp_base': 3000,
+    # power_mode 读取到未知的值时报告的状态
+    'power_mode_unknown': 'off',
+    # 写入校验策略，None 使用 vcp.DEFAULT_VERIFY_POLICY
+    'verify_policy': None,
+    # 亮度校准曲线: [[感知亮度%, Luminance 原始值%], ...], 按感知亮度递增，None 为线性
+    # 用于多台显示器同步亮度 (vcp_fleet.BrightnessGroup)
+    'brightness_curve': None,
+    # 面板的色度坐标: {'red': [x, y], 'green': [x, y], 'blue': [x, y], 'white': [x, y]}
+    # white 为 RGB 增益都是最大值时的白点，None 为 sRGB / D65. 用于色彩校准 (vcp_color)
+    'primaries': None,
+}
+
+QUIRKS_DB = [
+    {
+        # 很多显示器用电源键关机后 0xD6 返回 0x02 (Standby) 而不是 0x05
+        'model': '*',
+        'value_remap': {
+            vcp_code.VCP_CODE['Power Mode']: {i: vcp_code.POWER_MODE_CODE['off']
+                                              for i in vcp_code.POWER_MODE_OFF_VALUES},
+        },
+    },
+]
+
+_LIST_FIELDS = ('broken_codes',)
+_DICT_FIELDS = ('value_remap', 'channel_max')
+_MATCH_FIELDS = ('model', 'vcp_version', 'firmware')
+
+
+def _to_int(value, field: str) -> int:
+    """
+    JSON 里的 VCP code / 值可以是整数或者 "0x10" 这样的字符串
+    :param value:
+    :param field: 错误信息中的字段名
+    :return:
+    :raise ValueError: 不是整数或者整数字符串
+    """
+    if isinstance(value, str):
+        try:
+            return int(value, 0)
+        except ValueError:
+            raise ValueError('invalid {}: {!r}'.format(field, value))
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    raise ValueError('invalid {}: {!r}'.format(field, value))
+
+
+def _expect(entry: dict, key: str, type_):
+    if key in entry and not isinstance(entry[key], type_):
+        raise ValueError('{} must be a {} in quirk of {}: {!r}'.format(
+            key, type_.__name__, entry.get('model'), entry[key]))
+
+
+def normalize_quirk(entry: dict) -> dict:
+    """
+    把 JSON 载入的条目中的字符串 code 转换为整数. 先检查字段的类型，格式错误时抛出 ValueError
+    :param entry:
+    :return: 新的条目, 之后用 validate_quirk() 检查
+    """
+    if not isinstance(entry, dict):
+        raise ValueError('quirk entry must be a dict: {!r}'.format(entry))
+    _expect(entry, 'broken_codes', list)
+    _expect(entry, 'channel_max', dict)
+    _expect(entry, 'value_remap', dict)
+    for remap in entry.get('value_remap', {}).values():
+        if not isinstance(remap, dict):
+            raise ValueError('invalid value_remap in quirk of {}: {!r}'.format(entry.get('model'), remap))
+
+    entry = dict(entry)
+    for key in ('vcp_version', 'firmware'):
+        if key in entry:
+            entry[key] = _to_int(entry[key], key)
+    if 'broken_codes' in entry:
+        entry['broken_codes'] = [_to_int(i, 'broken_codes') for i in entry['broken_codes']]
+    if 'channel_max' in entry:
+        entry['channel_max'] = {_to_int(k, 'channel_max code'): _to_int(v, 'channel_max')
+                                for k, v in entry['channel_max'].items()}
+    if 'value_remap' in entry:
+        entry['value_remap'] = {
+            _to_int(code, 'value_remap code'): {_to_int(k, 'value_remap'): _to_int(v, 'value_remap')
+                                                for k, v in remap.items()}
+            for code, remap in entry['value_remap'].items()}
+    return entry
+
+
+def validate_quirk(entry: dict):
+    """
+    检查一个 quirk 条目，格式错误时抛出 ValueError
+    :param entry:
+    :return:
+    """
+    if not isinstance(entry, dict):
+        raise ValueError('quirk entry must be a dict: {!r}'.format(entry))
+    if not isinstance(entry.get('model'), str) or entry.get('model') == '':
+        raise ValueError('quirk entry without model: {!r}'.format(entry))
+
+    for key in entry:
+        if key not in DEFAULT_QUIRK and key not in _MATCH_FIELDS:
+            raise ValueError('unknown quirk field: {}'.format(key))
+    for key, type_ in (('broken_codes', list), ('channel_max', dict), ('value_remap', dict)):
+        _expect(entry, key, type_)
+
+    def check_code(code):
+        if not isinstance(code, int) or not 0 <= code <= 0xFF:
+            raise ValueError('invalid vcp code in quirk of {}: {!r}'.format(entry['model'], code))
+
+    for key in ('vcp_version', 'firmware'):
+        if key in entry and (not isinstance(entry[key], int) or entry[key] < 0):
+            raise ValueError('invalid {} in quirk of {}: {!r}'.format(key, entry['model'], entry[key]))
+
+    delay = entry.get('command_delay', 0)
+    if not isinstance(delay, (int, float)) or delay < 0:
+        raise ValueError('invalid command_delay in quirk of {}: {!r}'.format(entry['model'], delay))
+
+    for code in entry.get('broken_codes', []):
+        check_code(code)
+    for code, max_ in entry.get('channel_max', {}).items():
+        check_code(code)
+        if not isinstance(max_, int) or max_ <= 0:
+            raise ValueError('invalid channel_max in quirk of {}: {!r}'.format(entry['model'], max_))
+    for code, remap in entry.get('value_remap', {}).items():
+        check_code(code)
+        if not isinstance(remap, dict) or not all(isinstance(k, int) and isinstance(v, int)
+                                                  for k, v in remap.items()):
+            raise ValueError('invalid value_remap in quirk of {}: {!r}'.format(entry['model'], remap))
+
+    base = entry.get('color_temp_base', 3000)
+    if not isinstance(base, int) or base <= 0:
+        raise ValueError('invalid color_temp_base in quirk of {}: {!r}'.format(entry['model'], base))
+
+    if entry.get('power_mode_unknown', 'off') not in vcp_code.POWER_MODE_CODE:
+        raise ValueError('invalid power_mode_unknown in quirk of {}: {!r}'.format(
+            entry['model'], entry.get('power_mode_unknown')))
+
+    curve = entry.get('brightness_curve')
+    if curve is not None:
+        if not isinstance(curve, list) or len(curve) < 2:
+            raise ValueError('invalid brightness_curve in quirk of {}: {!r}'.format(entry['model'], curve))
+        last_x = -1
+        for point in curve:
+            if (not isinstance(point, (list, tuple)) or len(point) != 2
+                    or not all(isinstance(i, (int, float)) and 0 <= i <= 100 for i in point)
+                    or point[0] <= last_x):
+                raise ValueError('invalid brightness_curve point in quirk of {}: {!r}'.format(entry['model'], point))
+            last_x = point[0]
+
+    primaries = entry.get('primaries')
+    if primaries is not None:
+        if not isinstance(primaries, dict) or sorted(primaries) != ['blue', 'green', 'red', 'white']:
+            raise ValueError('invalid primaries in quirk of {}: {!r}'.format(entry['model'], primaries))
+        for xy in primaries.values():
+            if (not isinstance(xy, (list, tuple)) or len(xy) != 2
+                    or not all(isinstance(i, (int, float)) and 0 < i < 1 for i in xy)):
+                raise ValueError('invalid primaries in quirk of {}: {!r}'.format(entry['model'], primaries))
+
+    if entry.get('verify_policy') not in (None, 'always', 'sampled', 'never'):
+        raise ValueError('invalid verify_policy in quirk of {}: {!r}'.format(
+            entry['model'], entry.get('verify_policy')))
+
+
+def load_quirks(path: str) -> int:
+    """
+    从 JSON 文件载入 quirks，校验后追加到 QUIRKS_DB. 任何一个条目错误时都不载入
+    :param path:
+    :return: 载入的条目数
+    :raise ValueError: 文件或者条目的格式错误
+    :raise OSError:
+    """
+    import json
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise ValueError('quirks file must contain a list: {}'.format(path))
+
+    normalized = []
+    for index, entry in enumerate(entries):
+        try:
+            entry = normalize_quirk(entry)
+            validate_quirk(entry)
+        except ValueError as err:
+            raise ValueError('{}: entry {}: {}'.format(path, index, err))
+        normalized.append(entry)
+    entries = normalized
+    QUIRKS_DB.extend(entries)
+    _LOGGER.debug('loaded %s quirk(s) from %s', len(entries), path)
+    return len(entries)
+
+
+def _match_level(entry: dict, model: str, vcp_version: int, firmware: int) -> int:
+    """
+    条目的匹配程度，-1 不匹配，数值越大越具体
+    :return:
+    """
+    if entry['model'] == '*':
+        level = 0
+    elif entry['model'].upper() == model.upper():
+        level = 1
+    else:
+        return -1
+
+    for key, value in (('vcp_version', vcp_version), ('firmware', firmware)):
+        if key in entry:
+            if entry[key] != value:
+                return -1
+            level += 1
+    return level
+
+
+def lookup(model: str, vcp_version: int = None, firmware: int = None) -> dict:
+    """
+    合并所有匹配的条目，得到这台显示器的 quirks
+    :param model: caps string 中的型号
+    :param vcp_version: VCP Version (0xDF) 的值
+    :param firmware: Display Firmware Level (0xC9) 的值
+    :return: 包含 DEFAULT_QUIRK 所有字段的 dict
+    """
+    matched = []
+    for index, entry in enumerate(QUIRKS_DB):
+        level = _match_level(entry, model, vcp_version, firmware)
+        if level >= 0:
+            matched.append((level, index, entry))
+    matched.sort(key=lambda i: (i[0], i[1]))
+
+    quirk = {k: (v.copy() if isinstance(v, (list, dict)) else v) for k, v in DEFAULT_QUIRK.items()}
+    for _, _, entry in matched:
+        for key, value in entry.items():
+            if key in _MATCH_FIELDS:
+                continue
+            if key in _LIST_FIELDS:
+                quirk[key] = quirk[key] + [i for i in value if i not in quirk[key]]
+            elif key == 'value_remap':
+                for code, remap in value.items():
+                    merged = dict(quirk[key].get(code, {}))
+                    merged.update(remap)
+                    quirk[key][code] = merged
+            elif key in _DICT_FIELDS:
+                quirk[key].update(value)
+            else:
+                quirk[key] = value
+    return quirk
+
+
+if __name__ == '__main__':
+    # test code: 校验内置的 quirks
+    import sys
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    for i in QUIRKS_DB:
+        validate_quirk(i)
+    for i in sys.argv[1:]:
+        load_quirks(i)
+
+    print(lookup('test-model'))
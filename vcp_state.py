@@ -0,0 +1,406 @@
+# coding = utf-8
+
+import time
+import shlex
+import logging
+import threading
+from array import array
+import vcp_code
+import vcp_fleet
+from vcp_batch import COMPARE_OPS
+
+"""
+显示器状态表.
+
+MonitorState 用两个 array 保存一台显示器的一组 VCP 值和读取时间 (time.time())，没有读取过的值为 MISSING。
+FleetTable 保存所有显示器的 MonitorState，支持查询、快照和比较:
+
+    table = vcp_state.FleetTable()
+    table.refresh(phy_monitors)
+    table.query('brightness > 80 and input_src == "Digital Video (TMDS) 3 HDMI 1"')
+    before = table.snapshot()
+    ...
+    vcp_state.diff(before, table)    # {monitor_id: {field: [old, new]}}
+
+值的类型: 有选项的字段 (input_src 等) 为选项名称，其它为原始值。
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+# 字段: (名称, vcp_code.VCP_CODE 的 key, 选项 {名称: 值} 或 None), 顺序即 array 中的位置
+FIELDS = (
+    ('brightness', 'Luminance', None),
+    ('contrast', 'Contrast', None),
+    ('color_preset', 'Select Color Preset', vcp_code.COLOR_PRESET_CODE),
+    ('red_gain', 'Video Gain Red', None),
+    ('green_gain', 'Video Gain Green', None),
+    ('blue_gain', 'Video Gain Blue', None),
+    ('input_src', 'Input Source', vcp_code.INPUT_SRC_CODE),
+    ('power_mode', 'Power Mode', vcp_code.POWER_MODE_CODE),
+    ('osd_language', 'OSD Language', vcp_code.OSD_LANG_CODE),
+)
+FIELD_NAMES = tuple(i[0] for i in FIELDS)
+
+# 没有读取过的值
+MISSING = -1
+
+_FIELD_INDEX = {name: n for n, (name, _, _) in enumerate(FIELDS)}
+_CODE_INDEX = {vcp_code.VCP_CODE[key]: n for n, (_, key, _) in enumerate(FIELDS)}
+_KEY_INDEX = {key: n for n, (_, key, _) in enumerate(FIELDS)}
+# {字段位置: {值: 名称}}
+_CHOICE_NAMES = {n: {v: k for k, v in choices.items()} for n, (_, _, choices) in enumerate(FIELDS) if choices}
+
+_EMPTY_VALUES = array('i', [MISSING] * len(FIELDS))
+_EMPTY_TIMES = array('d', [0.0] * len(FIELDS))
+
+
+def _field_index(name: str) -> int:
+    index = _FIELD_INDEX.get(name)
+    if index is None:
+        raise ValueError('unknown field: {}, available: {}'.format(name, FIELD_NAMES))
+    return index
+
+
+def _decode(index: int, raw: int):
+    """
+    原始值转换为字段的值
+    :param index: 字段位置
+    :param raw:
+    :return: 没有读取过为 None, 有选项的字段为选项名称 (未知的值为 '', 关机为 'off')
+    """
+    if raw == MISSING:
+        return None
+    names = _CHOICE_NAMES.get(index)
+    if names is None:
+        return raw
+    name = names.get(raw)
+    if name is None and FIELDS[index][0] == 'power_mode' and raw in vcp_code.POWER_MODE_OFF_VALUES:
+        return 'off'
+    return name or ''
+
+
+def _encode(index: int, value) -> int:
+    choices = FIELDS[index][2]
+    if choices is not None and isinstance(value, str):
+        if value not in choices:
+            raise ValueError('invalid {}: {!r}'.format(FIELDS[index][0], value))
+        return choices[value]
+    return int(value)
+
+
+class MonitorState(object):
+    """
+    一台显示器的状态, 每个字段一个原始值和读取时间
+    """
+    __slots__ = ('monitor_id', 'model', 'values', 'times')
+
+    def __init__(self, monitor_id: str, model: str = '', values: array = None, times: array = None):
+        """
+        :param monitor_id:
+        :param model:
+        :param values: array('i'), 顺序和 FIELDS 相同, 默认全部为 MISSING
+        :param times: array('d'), 每个值的 time.time() 时间戳
+        """
+        self.monitor_id = monitor_id
+        self.model = model
+        self.values = array('i', _EMPTY_VALUES if values is None else values)
+        self.times = array('d', _EMPTY_TIMES if times is None else times)
+
+    @classmethod
+    def from_monitor(cls, phy_monitor) -> 'MonitorState':
+        """
+        用 PhyMonitor 缓存的值创建, 不访问显示器
+        :param phy_monitor: vcp.PhyMonitor()
+        :return:
+        """
+        state = cls(phy_monitor.monitor_id, phy_monitor.model)
+        for code, (value, _, ts) in phy_monitor.cached_vcp_values().items():
+            index = _CODE_INDEX.get(code)
+            if index is not None:
+                state.values[index] = value
+                state.times[index] = ts
+        return state
+
+    def raw(self, name: str) -> int:
+        """
+        :param name: 字段名
+        :return: 原始值, 没有读取过为 None
+        """
+        value = self.values[_field_index(name)]
+        return None if value == MISSING else value
+
+    def get(self, name: str):
+        """
+        :param name: 字段名
+        :return: 字段的值, 没有读取过为 None
+        """
+        index = _field_index(name)
+        return _decode(index, self.values[index])
+
+    def timestamp(self, name: str) -> float:
+        """
+        :param name: 字段名
+        :return: 读取时间 (time.time()), 没有读取过为 None
+        """
+        index = _field_index(name)
+        return self.times[index] if self.values[index] != MISSING else None
+
+    def set(self, name: str, value, ts: float = None) -> bool:
+        """
+        更新一个字段
+        :param name: 字段名
+        :param value: 原始值或选项名称
+        :param ts: 时间戳, 默认为现在
+        :return: 值是否改变
+        """
+        index = _field_index(name)
+        raw = _encode(index, value)
+        changed = self.values[index] != raw
+        self.values[index] = raw
+        self.times[index] = time.time() if ts is None else ts
+        return changed
+
+    def copy(self) -> 'MonitorState':
+        return MonitorState(self.monitor_id, self.model, self.values, self.times)
+
+    def diff(self, other: 'MonitorState') -> dict:
+        """
+        和另一个状态比较
+        :param other: 较新的状态
+        :return: {字段名: [self 的值, other 的值]}, 只包含不同的字段
+        """
+        if self.values == other.values:
+            return {}
+        return {FIELDS[n][0]: [_decode(n, old), _decode(n, new)]
+                for n, (old, new) in enumerate(zip(self.values, other.values)) if old != new}
+
+    def to_dict(self) -> dict:
+        result = {'monitor': self.monitor_id, 'model': self.model}
+        for n, name in enumerate(FIELD_NAMES):
+            result[name] = _decode(n, self.values[n])
+        return result
+
+    def __repr__(self):
+        return 'MonitorState({!r}, {})'.format(self.monitor_id, {k: v for k, v in self.to_dict().items()
+                                                                  if k in _FIELD_INDEX and v is not None})
+
+
+def read_state(phy_monitor, names=FIELD_NAMES) -> MonitorState:
+    """
+    从显示器读取一组字段
+    :param phy_monitor: vcp.PhyMonitor()
+    :param names: 要读取的字段名, 显示器不支持的字段不读取
+    :return: 包含 PhyMonitor 所有缓存的值的 MonitorState
+    """
+    for name in names:
+        code = vcp_code.VCP_CODE[FIELDS[_field_index(name)][1]]
+        if phy_monitor.supports_vcp_code(code):
+            phy_monitor.read_vcp_code(code)
+    return MonitorState.from_monitor(phy_monitor)
+
+
+def parse_query(text: str) -> list:
+    """
+    解析查询条件, 多个条件用 and 连接:
+
+        brightness > 80 and input_src == "Digital Video (TMDS) 3 HDMI 1"
+
+    :param text:
+    :return: [(字段名, 比较符, 值), ...]
+    """
+    tokens = shlex.split(text)
+    conditions = []
+    for n in range(0, len(tokens), 4):
+        group = tokens[n:n + 4]
+        if len(group) < 3 or (len(group) == 4 and group[3] != 'and'):
+            raise ValueError('invalid query: {}'.format(text))
+        name, compare, value = group[:3]
+        if compare not in COMPARE_OPS:
+            raise ValueError('invalid operator: {}, available: {}'.format(compare, tuple(COMPARE_OPS)))
+        index = _field_index(name)
+        conditions.append((name, compare, value if FIELDS[index][2] is not None else int(value, 0)))
+    if not conditions or len(tokens) % 4 != 3:
+        raise ValueError('invalid query: {}'.format(text))
+    return conditions
+
+
+class FleetTable(object):
+    """
+    所有显示器的 MonitorState.
+
+    有选项的字段 (input_src 等) 按值建立索引, 查询时 == 条件先通过索引缩小范围.
+    """
+    def __init__(self, states=()):
+        """
+        :param states: MonitorState 列表
+        """
+        self._states = {}
+        # {字段位置: {原始值: {monitor_id}}}
+        self._index = {n: {} for n in _CHOICE_NAMES}
+        self._lock = threading.RLock()
+        for state in states:
+            self.put(state)
+
+    def __len__(self):
+        return len(self._states)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._states.values()))
+
+    def __contains__(self, monitor_id):
+        return monitor_id in self._states
+
+    def get(self, monitor_id: str) -> MonitorState:
+        return self._states.get(monitor_id)
+
+    def _unindex(self, state: MonitorState):
+        for n, index in self._index.items():
+            ids = index.get(state.values[n])
+            if ids is not None:
+                ids.discard(state.monitor_id)
+                if not ids:
+                    del index[state.values[n]]
+
+    def _reindex(self, state: MonitorState):
+        for n, index in self._index.items():
+            index.setdefault(state.values[n], set()).add(state.monitor_id)
+
+    def put(self, state: MonitorState):
+        """
+        添加或替换一台显示器的状态
+        :param state:
+        :return:
+        """
+        with self._lock:
+            old = self._states.get(state.monitor_id)
+            if old is not None:
+                self._unindex(old)
+            self._states[state.monitor_id] = state
+            self._reindex(state)
+
+    def remove(self, monitor_id: str):
+        with self._lock:
+            state = self._states.pop(monitor_id, None)
+            if state is not None:
+                self._unindex(state)
+
+    def update(self, monitor_id: str, name: str, value, ts: float = None) -> bool:
+        """
+        更新一台显示器的一个字段, 显示器不存在时添加
+        :param monitor_id:
+        :param name: 字段名
+        :param value: 原始值或选项名称
+        :param ts: 时间戳
+        :return: 值是否改变
+        """
+        with self._lock:
+            state = self._states.get(monitor_id)
+            if state is None:
+                state = MonitorState(monitor_id)
+                self.put(state)
+            index = _field_index(name)
+            if index in self._index:
+                self._unindex(state)
+                changed = state.set(name, value, ts)
+                self._reindex(state)
+                return changed
+            return state.set(name, value, ts)
+
+    def apply_event(self, event: dict):
+        """
+        应用 vcp_watch.MonitorWatcher 的事件
+        :param event: {'monitor', 'model', 'ts', 'changes': {vcp_code_key: [old, new]}}
+        :return:
+        """
+        with self._lock:
+            if event['monitor'] not in self._states:
+                self.put(MonitorState(event['monitor'], event.get('model', '')))
+            for key, (_, value) in event['changes'].items():
+                index = _KEY_INDEX.get(key)
+                if index is not None and value is not None:
+                    self.update(event['monitor'], FIELDS[index][0], value, event.get('ts'))
+
+    def refresh(self, phy_monitors: list, read: bool = True, pool=None,
+                max_workers: int = vcp_fleet.DEFAULT_MAX_WORKERS):
+        """
+        从显示器更新状态
+        :param phy_monitors: vcp.PhyMonitor() instance(s)
+        :param read: False 只使用 PhyMonitor 缓存的值, 不访问显示器
+        :param pool: vcp_worker.WorkerPool
+        :param max_workers: 最大线程数
+        :return:
+        """
+        if not read:
+            for monitor in phy_monitors:
+                self.put(MonitorState.from_monitor(monitor))
+            return
+        for monitor, state, err in vcp_fleet.run_parallel(read_state, phy_monitors, max_workers, pool=pool):
+            if err is None:
+                self.put(state)
+
+    def query(self, conditions) -> list:
+        """
+        查询满足所有条件的显示器
+        :param conditions: parse_query() 的字符串, 或者 [(字段名, 比较符, 值), ...]
+        :return: [MonitorState, ...]
+        """
+        if isinstance(conditions, str):
+            conditions = parse_query(conditions)
+        compiled = []
+        with self._lock:
+            candidates = None
+            for name, compare, value in conditions:
+                index = _field_index(name)
+                if compare == '==' and index in self._index:
+                    raw = _encode(index, value)
+                    ids = self._index[index].get(raw, set())
+                    candidates = ids if candidates is None else candidates & ids
+                else:
+                    compiled.append((index, COMPARE_OPS[compare], value))
+            if candidates is None:
+                states = list(self._states.values())
+            else:
+                states = [self._states[i] for i in candidates]
+
+        result = []
+        for state in states:
+            for index, compare, value in compiled:
+                current = _decode(index, state.values[index])
+                if current is None or not compare(current, value):
+                    break
+            else:
+                result.append(state)
+        return result
+
+    def snapshot(self) -> 'FleetTable':
+        """
+        :return: 当前状态的副本
+        """
+        with self._lock:
+            return FleetTable(i.copy() for i in self._states.values())
+
+    def to_list(self) -> list:
+        return [i.to_dict() for i in self]
+
+
+def diff(old: FleetTable, new: FleetTable) -> dict:
+    """
+    比较两个状态表
+    :param old:
+    :param new:
+    :return: {monitor_id: {字段名: [old_value, new_value]}}, 新增或消失的显示器另一边的值为 None
+    """
+    result = {}
+    empty = MonitorState('')
+    for state in new:
+        previous = old.get(state.monitor_id) or empty
+        changes = previous.diff(state)
+        if changes:
+            result[state.monitor_id] = changes
+    for state in old:
+        if state.monitor_id not in new:
+            changes = state.diff(empty)
+            if changes:
+                result[state.monitor_id] = changes
+    return result
@@ -0,0 +1,333 @@
+# coding = utf-8
+
+import time
+import json
+import logging
+import threading
+from collections import namedtuple, deque
+
+"""
+DDC/CI 调用的录制和回放.
+
+TraceRecorder 包装一个 backend (默认 vcp.Win32Backend)，把每次 enumerate / caps / get / set / close 调用的
+参数、结果、错误和耗时写入 JSON lines 文件。ReplayBackend 从这个文件回放，PhyMonitor 可以在没有显示器的
+机器 (包括 Linux) 上使用，用于重现特定显示器的问题和性能测试:
+
+    import vcp, vcp_trace
+    vcp.set_backend(vcp_trace.TraceRecorder(vcp.default_backend(), 'monitors.trace'))
+    ...
+    vcp.set_backend(vcp_trace.ReplayBackend('monitors.trace'))
+    monitors = [vcp.PhyMonitor(i) for i in vcp.default_backend().enumerate_monitors()]
+
+SimulatedBackend 不需要 trace 文件，在内存中模拟若干台显示器，用于测试 HTTP API / agent 等。
+
+文件的第一行是 {"trace": "vcp", "version": 1, "created": ...}，之后每行一次调用:
+
+    {"t": 0.512, "op": "get", "h": 65537, "code": 16, "ok": true, "cur": 50, "max": 100, "ms": 41.2}
+    {"t": 0.560, "op": "set", "h": 65537, "code": 16, "value": 40, "ok": false, "err": "...", "ms": 40.8}
+
+t: 相对于开始录制的时间(秒), h: physical monitor handle, ms: 调用耗时(毫秒)
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+TRACE_VERSION = 1
+
+# ReplayBackend.enumerate_monitors() 返回的对象, 和 PHYSICAL_MONITOR 有相同的字段
+TracedMonitor = namedtuple('TracedMonitor', ('hPhysicalMonitor', 'szPhysicalMonitorDescription'))
+
+
+def _handle_value(handle) -> int:
+    """
+    HANDLE 可能是 int / None / c_void_p
+    """
+    handle = getattr(handle, 'value', handle)
+    return int(handle or 0)
+
+
+class TraceRecorder(object):
+    """
+    记录 backend 的所有调用, 接口和被包装的 backend 相同
+    """
+    def __init__(self, backend, path: str):
+        """
+        :param backend: 被包装的 backend, 如 vcp.default_backend()
+        :param path: 输出的 trace 文件, 已存在则覆盖
+        """
+        self.backend = backend
+        self.path = path
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # 每行写入后立即 flush, 程序异常退出时也能保留之前的记录
+        self._file = open(path, 'w', encoding='utf-8', buffering=1)
+        self._write({'trace': 'vcp', 'version': TRACE_VERSION, 'created': time.time()})
+
+    def _write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line + '\n')
+
+    def _record(self, op: str, handle, started: float, **fields):
+        record = {'t': round(started - self._started, 4), 'op': op}
+        if handle is not None:
+            record['h'] = _handle_value(handle)
+        record.update(fields)
+        record['ms'] = round((time.monotonic() - started) * 1000, 3)
+        self._write(record)
+
+    def _failed(self) -> str:
+        # 必须在失败的调用之后立即在同一线程中读取
+        self._local.error = self.backend.last_error()
+        return self._local.error
+
+    def enumerate_monitors(self) -> list:
+        started = time.monotonic()
+        monitors = self.backend.enumerate_monitors()
+        self._record('enum', None, started, monitors=[
+            [_handle_value(i.hPhysicalMonitor), i.szPhysicalMonitorDescription] for i in monitors])
+        return monitors
+
+    def capabilities(self, handle) -> str:
+        started = time.monotonic()
+        try:
+            caps = self.backend.capabilities(handle)
+        except OSError as err:
+            self._record('caps', handle, started, ok=False, err=str(err))
+            raise
+        # Win32Backend 返回 bytes, trace 文件中保存为字符串
+        self._record('caps', handle, started, ok=True,
+                     caps=caps.decode('ASCII', 'replace') if isinstance(caps, bytes) else caps)
+        return caps
+
+    def get_vcp_feature(self, handle, code: int):
+        started = time.monotonic()
+        ok, current_value, max_value = self.backend.get_vcp_feature(handle, code)
+        fields = {'code': code, 'ok': ok, 'cur': current_value, 'max': max_value}
+        if not ok:
+            fields['err'] = self._failed()
+        self._record('get', handle, started, **fields)
+        return ok, current_value, max_value
+
+    def set_vcp_feature(self, handle, code: int, value: int) -> bool:
+        started = time.monotonic()
+        ok = self.backend.set_vcp_feature(handle, code, value)
+        fields = {'code': code, 'value': value, 'ok': ok}
+        if not ok:
+            fields['err'] = self._failed()
+        self._record('set', handle, started, **fields)
+        return ok
+
+    def destroy(self, handle) -> bool:
+        started = time.monotonic()
+        ok = self.backend.destroy(handle)
+        self._record('close', handle, started, ok=ok)
+        return ok
+
+    def last_error(self) -> str:
+        return getattr(self._local, 'error', '')
+
+    def close(self):
+        """
+        关闭 trace 文件, 之后的调用不再记录
+        :return:
+        """
+        with self._lock:
+            self._file.close()
+
+
+def load_trace(path: str) -> list:
+    """
+    读取 trace 文件
+    :param path:
+    :return: [record, ...], 不包括第一行
+    """
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        header = json.loads(f.readline() or '{}')
+        if header.get('trace') != 'vcp':
+            raise ValueError('{} is not a vcp trace'.format(path))
+        if header.get('version', 0) > TRACE_VERSION:
+            raise ValueError('unsupported trace version: {}'.format(header.get('version')))
+        for line_no, line in enumerate(f, 2):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError as err:
+                # 录制时异常退出，最后一行可能不完整
+                _LOGGER.warning('%s line %s: %s', path, line_no, err)
+    return records
+
+
+class ReplayBackend(object):
+    """
+    从 trace 回放 DDC/CI 调用.
+
+    每台显示器、每个 VCP code 的 get / set 按录制的顺序返回录制的结果；录制的结果用完之后，
+    get 返回最后一次读取或写入的值，set 总是成功。trace 中没有出现过的 code 读取失败。
+    """
+    def __init__(self, trace, latency_scale: float = 0.0):
+        """
+        :param trace: trace 文件路径或 load_trace() 的结果
+        :param latency_scale: 按录制的耗时乘以这个系数等待, 0 不等待, 1.0 按原速回放
+        """
+        records = load_trace(trace) if isinstance(trace, str) else list(trace)
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._monitors = []
+        self._caps = {}
+        # {(handle, op, code): deque(record)}
+        self._responses = {}
+        # {(handle, code): [current_value, max_value]}
+        self._state = {}
+
+        handles = []
+        for record in records:
+            op = record.get('op')
+            handle = record.get('h')
+            if op == 'enum' and not self._monitors:
+                self._monitors = [TracedMonitor(h, desc) for h, desc in record.get('monitors', [])]
+            elif op == 'caps':
+                self._caps[handle] = record
+            elif op in ('get', 'set'):
+                self._responses.setdefault((handle, op, record['code']), deque()).append(record)
+            if handle is not None and handle not in handles:
+                handles.append(handle)
+        if not self._monitors:
+            # trace 中没有 enumerate 的记录 (只录制了部分调用)
+            self._monitors = [TracedMonitor(h, '') for h in handles]
+
+    def _delay(self, record: dict):
+        if self.latency_scale > 0 and record.get('ms'):
+            time.sleep(record['ms'] / 1000 * self.latency_scale)
+
+    def _next(self, handle, op: str, code: int):
+        with self._lock:
+            queue = self._responses.get((_handle_value(handle), op, code))
+            return queue.popleft() if queue else None
+
+    def enumerate_monitors(self) -> list:
+        return list(self._monitors)
+
+    def capabilities(self, handle) -> str:
+        record = self._caps.get(_handle_value(handle))
+        if record is None:
+            raise OSError('no capabilities of handle {} in trace'.format(_handle_value(handle)))
+        self._delay(record)
+        if not record.get('ok', True):
+            raise OSError(record.get('err', 'capabilities request failed'))
+        return record.get('caps', '')
+
+    def get_vcp_feature(self, handle, code: int):
+        key = (_handle_value(handle), code)
+        record = self._next(handle, 'get', code)
+        if record is None:
+            with self._lock:
+                state = self._state.get(key)
+            if state is None:
+                self._local.error = 'vcp code 0x{:02X} not in trace'.format(code)
+                return False, 0, 0
+            return True, state[0], state[1]
+
+        self._delay(record)
+        if not record.get('ok'):
+            self._local.error = record.get('err', '')
+            return False, record.get('cur', 0), record.get('max', 0)
+        with self._lock:
+            self._state[key] = [record.get('cur', 0), record.get('max', 0)]
+        return True, record.get('cur', 0), record.get('max', 0)
+
+    def set_vcp_feature(self, handle, code: int, value: int) -> bool:
+        key = (_handle_value(handle), code)
+        record = self._next(handle, 'set', code)
+        if record is not None:
+            self._delay(record)
+            if not record.get('ok'):
+                self._local.error = record.get('err', '')
+                return False
+        with self._lock:
+            self._state.setdefault(key, [0, 0])[0] = value
+        return True
+
+    def destroy(self, handle) -> bool:
+        return True
+
+    def last_error(self) -> str:
+        return getattr(self._local, 'error', '')
+
+
+# 默认模拟的显示器
+SIMULATED_CAPS = ('(prot(monitor)type(LCD)model(SIM2400)cmds(01 02 03 07 0C E3 F3)vcp(02 04 05 08 10 12 14(05 06 08 0B) '
+                  '16 18 1A 52 60(01 03 0F 11) 62 8D(01 02) AC AE B2 B6 C6 C8 C9 D6(01 04 05) DF)mswhql(1)asset_eep(40)'
+                  'mccs_ver(2.1))')
+SIMULATED_VALUES = {
+    0x02: (1, 2), 0x10: (50, 100), 0x12: (70, 100), 0x14: (6, 11), 0x16: (100, 100), 0x18: (100, 100),
+    0x1A: (100, 100), 0x60: (0x0F, 0x12), 0x62: (30, 100), 0x8D: (2, 2), 0xC9: (0x0102, 0xFFFF),
+    0xD6: (1, 5), 0xDF: (0x0201, 0xFFFF),
+}
+
+
+class SimulatedBackend(object):
+    """
+    内存中模拟的显示器, 不需要 trace 文件. 写入的值之后可以读回，caps string 中没有的 code 读写失败。
+    """
+    def __init__(self, count: int = 1, caps: str = SIMULATED_CAPS, values: dict = None, latency: float = 0.0):
+        """
+        :param count: 显示器数量
+        :param caps: 每台显示器的 caps string
+        :param values: 初始值 {code: (current_value, max_value)}, 默认 SIMULATED_VALUES
+        :param latency: 每次调用的延迟(秒), 模拟 DDC/CI 总线
+        """
+        import vcp
+
+        self.latency = latency
+        self._caps = caps
+        self._supported = set(vcp.parse_vcp_caps(caps))
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._monitors = [TracedMonitor(0x10000 + i, 'Simulated Monitor {}'.format(i)) for i in range(count)]
+        initial = SIMULATED_VALUES if values is None else values
+        # {handle: {code: [current_value, max_value]}}
+        self._values = {i.hPhysicalMonitor: {k: list(v) for k, v in initial.items()} for i in self._monitors}
+
+    def _sleep(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _fail(self, message: str):
+        self._local.error = message
+        return False
+
+    def enumerate_monitors(self) -> list:
+        return list(self._monitors)
+
+    def capabilities(self, handle) -> str:
+        self._sleep()
+        if _handle_value(handle) not in self._values:
+            raise OSError('invalid monitor handle: {}'.format(_handle_value(handle)))
+        return self._caps
+
+    def get_vcp_feature(self, handle, code: int):
+        self._sleep()
+        if code not in self._supported:
+            return self._fail('vcp code 0x{:02X} not supported'.format(code)), 0, 0
+        with self._lock:
+            current_value, max_value = self._values[_handle_value(handle)].get(code, (0, 0))
+        return True, current_value, max_value
+
+    def set_vcp_feature(self, handle, code: int, value: int) -> bool:
+        self._sleep()
+        if code not in self._supported:
+            return self._fail('vcp code 0x{:02X} not supported'.format(code))
+        with self._lock:
+            self._values[_handle_value(handle)].setdefault(code, [0, 0])[0] = value
+        return True
+
+    def destroy(self, handle) -> bool:
+        return True
+
+    def last_error(self) -> str:
+        return getattr(self._local, 'error', '')
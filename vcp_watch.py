@@ -0,0 +1,237 @@
+# coding = utf-8
+
+import time
+import logging
+import threading
+import vcp_code
+
+"""
+显示器设置变化检测.
+
+MonitorWatcher 在一个后台线程中周期性地批量读取每台显示器的一组 VCP code，把变化的值通知给所有订阅者，
+多个使用者共享同一个轮询线程。
+
+支持 MCCS 'New Control Value' (0x02) 的显示器每次只读取 0x02，
+显示器报告有新的设置 (用户按了显示器按键) 时先写入 0x01 清除标志，再读取全部 code；
+有 code 读取失败时下一次轮询读取全部 code。
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+# 默认检测的设置
+DEFAULT_WATCH_CODES = (
+    'Luminance',
+    'Contrast',
+    'Select Color Preset',
+    'Input Source',
+    'Power Mode',
+    'OSD Language',
+)
+
+DEFAULT_POLL_INTERVAL = 1.0
+# 即使显示器报告没有新的设置，每隔这么多次轮询也读取一次全部 code (有些显示器不可靠)
+DEFAULT_FULL_READ_EVERY = 30
+
+_NEW_CONTROL_VALUE = vcp_code.VCP_CODE['New Control Value']
+
+
+class MonitorWatcher(object):
+    """
+    检测一组显示器的设置变化.
+
+    每个事件是一个 dict:
+    {'monitor': monitor_id, 'model': model, 'ts': time.time(),
+     'changes': {vcp_code_key: [old_value, new_value], ...}}
+    第一次读取时 old_value 为 None.
+    """
+    def __init__(self, phy_monitors: list, codes=DEFAULT_WATCH_CODES, interval: float = DEFAULT_POLL_INTERVAL,
+                 full_read_every: int = DEFAULT_FULL_READ_EVERY, pool=None):
+        """
+        :param phy_monitors: vcp.PhyMonitor() instance(s)
+        :param codes: 要检测的 vcp_code.VCP_CODE 的 key, 或者 {monitor_id: codes} 为每台显示器单独指定
+        :param interval: 轮询间隔(秒)
+        :param full_read_every: 支持 0x02 的显示器每隔多少次轮询读取一次全部 code, 0 不强制读取
+        :param pool: vcp_worker.WorkerPool, 给定时以 poll 优先级在每台显示器的工作线程中读取，不阻塞交互操作
+        """
+        self.interval = interval
+        self.pool = pool
+        self.full_read_every = full_read_every
+        self._monitors = list(phy_monitors)
+        self._codes = {}
+        for monitor in self._monitors:
+            keys = codes.get(monitor.monitor_id, DEFAULT_WATCH_CODES) if isinstance(codes, dict) else codes
+            self._codes[monitor.monitor_id] = [
+                (key, vcp_code.VCP_CODE[key]) for key in keys
+                if key in vcp_code.VCP_CODE and monitor.supports_vcp_code(vcp_code.VCP_CODE[key])]
+        self._use_new_control_value = {i.monitor_id: bool(i.vcp_caps) and i.supports_vcp_code(_NEW_CONTROL_VALUE)
+                                       for i in self._monitors}
+        # {monitor_id: {vcp_code_key: value}}
+        self._last_values = {}
+        # 上一次有 code 读取失败的显示器, 下一次轮询忽略 0x02 读取全部 code
+        self._incomplete = set()
+        self._poll_count = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # ############################# 订阅
+
+    def subscribe(self, callback):
+        """
+        订阅变化事件，callback(event) 在轮询线程中调用
+        :param callback:
+        :return: 取消订阅的函数
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+        return lambda: self.unsubscribe(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _publish(self, event: dict):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception as err:
+                _LOGGER.error('watch subscriber %r failed: %s', callback, err)
+
+    async def events(self, max_queue: int = 1000):
+        """
+        以 async iterator 的方式接收事件:
+
+            async for event in watcher.events():
+                ...
+
+        队列满时丢弃新的事件.
+        :param max_queue: 队列长度
+        :return:
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(max_queue)
+
+        def put(event):
+            if not queue.full():
+                queue.put_nowait(event)
+            else:
+                _LOGGER.warning('watch event queue full, event dropped: %s', event.get('monitor'))
+
+        unsubscribe = self.subscribe(lambda event: loop.call_soon_threadsafe(put, event))
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            unsubscribe()
+
+    # ############################# 轮询
+
+    def _has_new_control_value(self, monitor) -> bool:
+        """
+        读取 0x02, 显示器是否报告了新的设置
+        :param monitor:
+        :return:
+        """
+        value = monitor.read_vcp_code(_NEW_CONTROL_VALUE)[0]
+        return value == vcp_code.NEW_CONTROL_VALUE_CODE['New control values present']
+
+    def _read_monitor(self, monitor, force: bool) -> dict:
+        """
+        读取一台显示器的设置, 返回变化的值
+        :param monitor:
+        :param force: 忽略 0x02 强制读取全部 code
+        :return: {vcp_code_key: [old, new]}
+        """
+        use_ncv = self._use_new_control_value[monitor.monitor_id]
+        last = self._last_values.setdefault(monitor.monitor_id, {})
+        full = force or not last or monitor.monitor_id in self._incomplete
+        if use_ncv and not full and not self._has_new_control_value(monitor):
+            return {}
+
+        if use_ncv:
+            # 读取之前清除 New Control Value 标志: 读取期间用户的修改会再次设置标志，下一次轮询读取
+            monitor.send_vcp_code(_NEW_CONTROL_VALUE, vcp_code.NEW_CONTROL_VALUE_CODE['No new control values'])
+
+        changes = {}
+        self._incomplete.discard(monitor.monitor_id)
+        for key, code in self._codes[monitor.monitor_id]:
+            value, max_value = monitor.read_vcp_code(code)
+            if max_value <= 0:
+                # 读取失败 (0, 0): 不是新的值, 保留上一次的值; 标志已经清除, 下一次轮询读取全部 code
+                _LOGGER.debug('%s: read %s failed, skipped', monitor.monitor_id, key)
+                self._incomplete.add(monitor.monitor_id)
+                continue
+            if last.get(key) != value:
+                changes[key] = [last.get(key), value]
+                last[key] = value
+        return changes
+
+    def poll_once(self) -> list:
+        """
+        轮询所有显示器一次，通知订阅者
+        :return: 这次产生的事件
+        """
+        force = self.full_read_every > 0 and self._poll_count % self.full_read_every == 0
+        self._poll_count += 1
+
+        if self.pool is not None:
+            import vcp_worker
+        # 有 pool 时先提交所有显示器, 各显示器的工作线程并行读取, 再按顺序收集结果
+        pending = []
+        for monitor in self._monitors:
+            if self.pool is None:
+                pending.append((monitor, None))
+                continue
+            try:
+                pending.append((monitor, self.pool.submit(monitor, self._read_monitor, force,
+                                                          priority=vcp_worker.PRIORITY_POLL)))
+            except Exception as err:
+                _LOGGER.error('%s: watch failed: %s', monitor.monitor_id, err)
+
+        events = []
+        for monitor, future in pending:
+            try:
+                changes = self._read_monitor(monitor, force) if future is None else future.result()
+            except Exception as err:
+                _LOGGER.error('%s: watch failed: %s', monitor.monitor_id, err)
+                continue
+            if changes:
+                event = {'monitor': monitor.monitor_id, 'model': monitor.model, 'ts': time.time(),
+                         'changes': changes}
+                events.append(event)
+                self._publish(event)
+        return events
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            self.poll_once()
+            self._stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        """
+        启动后台轮询线程
+        :return:
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='MonitorWatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """
+        停止后台轮询线程
+        :param timeout:
+        :return:
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
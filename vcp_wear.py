@@ -0,0 +1,248 @@
+# coding = utf-8
+
+import os
+import json
+import time
+import logging
+import datetime
+import threading
+import vcp_code
+
+"""
+EEPROM 写入预算.
+
+vcp_code.PERSISTENT_CODES 中的设置 (颜色预设、菜单语言、保存设置等) 写入后会保存到显示器的 EEPROM，擦写次数有限。
+WriteBudget 记录每台显示器的持久写入次数 (保存到 JSON 文件，重启后继续累计)，并且:
+
+- 同一个 code 两次持久写入的间隔不少于 min_interval 秒，间隔内的写入合并为最后一次 (PhyMonitor 的写入合并)
+- 每台显示器每天的持久写入不超过 daily_budget 次，超过后拒绝写入
+- report() 根据累计的写入速度估计还能使用多少天
+
+其它 code (亮度等) 不受影响。
+
+    vcp.set_write_budget(vcp_wear.WriteBudget('wear.json', daily_budget=100))
+
+显示器和 vcp_inventory 一样用 EDID 中的厂商+产品+序列号区分 (第一次持久写入时读取 EDID)，
+多台同型号的显示器换了连接顺序计数也不会混在一起；没有序列号时才用 型号#序号 (同一型号按 identify() 的顺序编号)。
+Windows 重新启动后 handle 会变化，不能用来区分。
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+# 每台显示器每天允许的持久写入次数
+DEFAULT_DAILY_BUDGET = 200
+# 同一个 code 两次持久写入的最短间隔(秒)
+DEFAULT_MIN_INTERVAL = 2.0
+# EEPROM 的擦写寿命 (次), 常见的 24Cxx 为 100 万次, 保守估计
+DEFAULT_ENDURANCE = 100000
+# 每多少次持久写入保存一次计数
+DEFAULT_SAVE_EVERY = 10
+
+_CODE_NAMES = {v: k for k, v in vcp_code.VCP_CODE.items()}
+
+
+def _today() -> str:
+    return datetime.date.today().isoformat()
+
+
+class WriteBudget(object):
+    """
+    持久写入的计数和限制
+    """
+    def __init__(self, path: str = None, daily_budget: int = DEFAULT_DAILY_BUDGET,
+                 min_interval: float = DEFAULT_MIN_INTERVAL, endurance: int = DEFAULT_ENDURANCE,
+                 persistent_codes=vcp_code.PERSISTENT_CODES):
+        """
+        :param path: 保存计数的 JSON 文件, None 只在内存中计数
+        :param daily_budget: 每台显示器每天允许的持久写入次数, 0 不限制
+        :param min_interval: 同一个 code 两次持久写入的最短间隔(秒)
+        :param endurance: EEPROM 的擦写寿命, 用来估计剩余天数
+        :param persistent_codes: 持久保存的 VCP code
+        """
+        self.path = path
+        self.daily_budget = daily_budget
+        self.min_interval = min_interval
+        self.endurance = endurance
+        self.persistent_codes = frozenset(persistent_codes)
+        self._lock = threading.Lock()
+        # {key: {'first': time.time(), 'total': n, 'day': 'YYYY-MM-DD', 'today': n, 'codes': {'0x14': n}}}
+        self._counters = {}
+        # 本次运行中: {id(monitor): key}, {id(monitor): 型号中的序号}, {model: 已分配的序号数}
+        self._keys = {}
+        self._model_index = {}
+        self._model_count = {}
+        # {monitor_id: edid}, identify() 提供或者第一次需要时读取; None 还没有读取
+        self._edids = None
+        self._edid_lock = threading.Lock()
+        # {(key, code): time.monotonic()} 最近一次持久写入 (包括已预留的)
+        self._last_write = {}
+        self._denied = 0
+        self._unsaved = 0
+        if path:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                counters = json.load(f)
+        except (OSError, ValueError) as err:
+            _LOGGER.debug('unable to load write counters: %s', err)
+            return
+        with self._lock:
+            self._counters.update(counters)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = json.dumps(self._counters, indent=1, sort_keys=True)
+            self._unsaved = 0
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                f.write(data)
+        except OSError as err:
+            _LOGGER.error('unable to save write counters: %s', err)
+
+    def identify(self, phy_monitors: list, edids: dict = None):
+        """
+        按枚举顺序给同一型号的显示器编号 (没有序列号时使用), 不访问显示器
+        :param phy_monitors: vcp.PhyMonitor() instance(s), 枚举顺序
+        :param edids: vcp_edid.match_edids() 的结果 {monitor_id: edid}, None 在第一次持久写入时读取
+        :return:
+        """
+        with self._lock:
+            for monitor in phy_monitors:
+                if id(monitor) not in self._model_index:
+                    self._model_index[id(monitor)] = self._next_index(monitor.model)
+        if edids is not None:
+            with self._edid_lock:
+                self._edids = dict(edids)
+
+    def _next_index(self, model: str) -> int:
+        number = self._model_count.get(model, 0) + 1
+        self._model_count[model] = number
+        return number
+
+    def _edid(self, phy_monitor) -> dict:
+        """
+        :return: 显示器的 EDID, 没有找到时为 {}
+        """
+        import vcp_edid
+
+        with self._edid_lock:
+            if self._edids is None:
+                self._edids = {}
+            if phy_monitor.monitor_id not in self._edids:
+                edids = vcp_edid.match_edids([phy_monitor], vcp_edid.read_edids())
+                self._edids[phy_monitor.monitor_id] = edids.get(phy_monitor.monitor_id, {})
+            return self._edids[phy_monitor.monitor_id]
+
+    def key(self, phy_monitor) -> str:
+        """
+        :param phy_monitor: vcp.PhyMonitor()
+        :return: 计数使用的显示器名称, vcp_inventory.inventory_key(): 厂商-产品-序列号, 没有序列号时为 型号#序号
+        """
+        import vcp_inventory
+
+        with self._lock:
+            key = self._keys.get(id(phy_monitor))
+            if key is not None:
+                return key
+        # 读取 EDID 不持有 _lock, 其它显示器的计数不需要等待
+        edid = self._edid(phy_monitor)
+        with self._lock:
+            key = self._keys.get(id(phy_monitor))
+            if key is not None:
+                return key
+            index = self._model_index.get(id(phy_monitor))
+            if index is None:
+                index = self._model_index[id(phy_monitor)] = self._next_index(phy_monitor.model)
+            key = vcp_inventory.inventory_key(dict(edid, model=phy_monitor.model, model_index=index))
+            fallback = '{}#{}'.format(phy_monitor.model, index)
+            if key != fallback and key not in self._counters and fallback in self._counters:
+                # 以前的版本按 型号#序号 计数, 第一次识别出序列号时沿用这个计数
+                self._counters[key] = self._counters.pop(fallback)
+            self._keys[id(phy_monitor)] = key
+            return key
+
+    def is_persistent(self, code: int) -> bool:
+        return code in self.persistent_codes
+
+    def _counter(self, key: str) -> dict:
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = {'first': time.time(), 'total': 0, 'day': _today(), 'today': 0,
+                                             'codes': {}}
+        if counter['day'] != _today():
+            counter['day'] = _today()
+            counter['today'] = 0
+        return counter
+
+    def reserve(self, phy_monitor, code: int) -> float:
+        """
+        写入持久 code 之前调用
+        :param phy_monitor: vcp.PhyMonitor()
+        :param code: VCP Code
+        :return: 写入前需要等待的时间(秒), 等待期间的写入合并为一次; 超出每天的预算时返回 None
+        """
+        key = self.key(phy_monitor)
+        now = time.monotonic()
+        with self._lock:
+            counter = self._counter(key)
+            if self.daily_budget and counter['today'] >= self.daily_budget:
+                self._denied += 1
+                return None
+            last = self._last_write.get((key, code))
+            delay = 0.0 if last is None else max(0.0, last + self.min_interval - now)
+            self._last_write[(key, code)] = now + delay
+            return delay
+
+    def record(self, phy_monitor, code: int):
+        """
+        记录一次发送到显示器的持久写入
+        :param phy_monitor: vcp.PhyMonitor()
+        :param code: VCP Code
+        :return:
+        """
+        key = self.key(phy_monitor)
+        with self._lock:
+            counter = self._counter(key)
+            counter['total'] += 1
+            counter['today'] += 1
+            code_key = '0x{:02X}'.format(code)
+            counter['codes'][code_key] = counter['codes'].get(code_key, 0) + 1
+            self._unsaved += 1
+            save = self._unsaved >= DEFAULT_SAVE_EVERY
+        if save:
+            self.save()
+
+    def report(self) -> list:
+        """
+        :return: 每台显示器一项 {'monitor', 'total', 'today', 'budget_left', 'per_day', 'projected_days',
+                                 'codes': {name: n}}; projected_days 为按目前的速度达到 endurance 的天数
+        """
+        now = time.time()
+        result = []
+        with self._lock:
+            for key in sorted(self._counters):
+                counter = self._counter(key)
+                days = max(1.0, (now - counter['first']) / 86400)
+                per_day = counter['total'] / days
+                result.append({
+                    'monitor': key,
+                    'total': counter['total'],
+                    'today': counter['today'],
+                    'budget_left': max(0, self.daily_budget - counter['today']) if self.daily_budget else None,
+                    'per_day': round(per_day, 2),
+                    'projected_days': round(max(0, self.endurance - counter['total']) / per_day) if per_day else None,
+                    'codes': {_CODE_NAMES.get(int(k, 16), k): v for k, v in counter['codes'].items()},
+                })
+        return result
+
+    @property
+    def denied(self) -> int:
+        """
+        因为超出预算被拒绝的写入次数
+        """
+        return self._denied
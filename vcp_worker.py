@@ -0,0 +1,241 @@
+# coding = utf-8
+
+import time
+import queue
+import logging
+import itertools
+import threading
+from concurrent.futures import Future
+
+"""
+每台显示器一个工作线程.
+
+GUI、后台轮询和资产清单等调用者不直接访问 PhyMonitor，而是把操作提交到这台显示器的 MonitorWorker，
+由它的线程按优先级依次执行，调用者得到 concurrent.futures.Future。
+同一优先级按提交顺序执行: 交互操作 (GUI) > 后台轮询 > 批量读取 (资产清单)。
+
+每个 worker 记录队列长度、等待时间 (提交 -> 开始执行) 和执行时间，用来观察争用:
+
+    pool = vcp_worker.WorkerPool()
+    future = pool.worker(monitor).set('brightness', 40)
+    pool.stats()
+"""
+
+_LOGGER = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_POLL = 1
+PRIORITY_SWEEP = 2
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_POLL: 'poll',
+    PRIORITY_SWEEP: 'sweep',
+}
+
+# 停止线程的哨兵, 排在所有任务之后
+_STOP_PRIORITY = 99
+
+
+class _Timing(object):
+    """
+    累计耗时
+    """
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def to_dict(self) -> dict:
+        return {'avg_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+                'max_ms': round(self.max * 1000, 3)}
+
+
+class MonitorWorker(object):
+    """
+    拥有一台显示器的工作线程
+    """
+    def __init__(self, phy_monitor):
+        """
+        :param phy_monitor: vcp.PhyMonitor()
+        """
+        self.monitor = phy_monitor
+        self.monitor_id = phy_monitor.monitor_id
+        self.model = phy_monitor.model
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._stats_lock = threading.Lock()
+        self._submitted = {i: 0 for i in PRIORITY_NAMES}
+        self._failed = 0
+        self._cancelled = 0
+        self._wait = {i: _Timing() for i in PRIORITY_NAMES}
+        self._service = _Timing()
+        self._thread = threading.Thread(target=self._run, name='MonitorWorker-{}'.format(self.monitor_id),
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            priority, _, enqueued, future, func, args, kwargs = self._queue.get()
+            if future is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                with self._stats_lock:
+                    self._cancelled += 1
+                continue
+
+            started = time.monotonic()
+            try:
+                result = func(self.monitor, *args, **kwargs)
+            except Exception as err:
+                future.set_exception(err)
+                with self._stats_lock:
+                    self._failed += 1
+            else:
+                future.set_result(result)
+            with self._stats_lock:
+                self._wait[priority].add(started - enqueued)
+                self._service.add(time.monotonic() - started)
+
+    def submit(self, func, *args, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> Future:
+        """
+        在工作线程中执行 func(monitor, *args, **kwargs)
+        :param func:
+        :param priority: PRIORITY_INTERACTIVE / PRIORITY_POLL / PRIORITY_SWEEP
+        :return: Future
+        """
+        if priority not in PRIORITY_NAMES:
+            raise ValueError('invalid priority: {}'.format(priority))
+        if not self._thread.is_alive():
+            raise RuntimeError('{}: worker stopped'.format(self.monitor_id))
+        future = Future()
+        with self._stats_lock:
+            self._submitted[priority] += 1
+        self._queue.put((priority, next(self._seq), time.monotonic(), future, func, args, kwargs))
+        return future
+
+    def get(self, name: str, priority: int = PRIORITY_INTERACTIVE) -> Future:
+        """
+        读取 PhyMonitor 的属性
+        :param name: 属性名
+        :param priority:
+        :return: Future
+        """
+        return self.submit(getattr, name, priority=priority)
+
+    def set(self, name: str, value, priority: int = PRIORITY_INTERACTIVE) -> Future:
+        """
+        设置 PhyMonitor 的属性
+        :param name: 属性名
+        :param value:
+        :param priority:
+        :return: Future
+        """
+        return self.submit(setattr, name, value, priority=priority)
+
+    def proxy(self, priority: int = PRIORITY_INTERACTIVE) -> 'MonitorProxy':
+        """
+        :param priority: 通过 proxy 提交的操作的优先级
+        :return: 和 PhyMonitor 用法相同的对象, 所有 DDC/CI 操作都在工作线程中执行
+        """
+        return MonitorProxy(self, priority)
+
+    def stats(self) -> dict:
+        """
+        :return: {'queue_depth', 'submitted': {priority_name: n}, 'failed', 'cancelled',
+                  'wait': {priority_name: {'avg_ms', 'max_ms'}}, 'service': {'avg_ms', 'max_ms'}}
+        """
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'submitted': {PRIORITY_NAMES[k]: v for k, v in self._submitted.items()},
+                'failed': self._failed,
+                'cancelled': self._cancelled,
+                'wait': {PRIORITY_NAMES[k]: v.to_dict() for k, v in self._wait.items()},
+                'service': self._service.to_dict(),
+            }
+
+    def stop(self, timeout: float = None):
+        """
+        执行完已经提交的操作后停止工作线程
+        :param timeout:
+        :return:
+        """
+        self._queue.put((_STOP_PRIORITY, next(self._seq), time.monotonic(), None, None, None, None))
+        self._thread.join(timeout)
+
+
+class MonitorProxy(object):
+    """
+    把 PhyMonitor 的属性读写和方法调用转发到 MonitorWorker.
+
+    读取属性和调用方法时等待结果；设置属性不等待 (按顺序在工作线程中执行，失败时记录日志)。
+    model / monitor_id 等普通属性直接读取，不经过工作线程。
+    """
+    def __init__(self, worker: MonitorWorker, priority: int = PRIORITY_INTERACTIVE):
+        object.__setattr__(self, '_worker', worker)
+        object.__setattr__(self, '_priority', priority)
+
+    def __getattr__(self, name):
+        worker = self._worker
+        descriptor = getattr(type(worker.monitor), name, None)
+        if isinstance(descriptor, property):
+            return worker.get(name, self._priority).result()
+        value = getattr(worker.monitor, name)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            return worker.submit(lambda monitor: getattr(monitor, name)(*args, **kwargs),
+                                 priority=self._priority).result()
+        return call
+
+    def __setattr__(self, name, value):
+        future = self._worker.set(name, value, self._priority)
+        future.add_done_callback(lambda f: f.exception() and _LOGGER.error(
+            '%s: set %s=%s failed: %s', self._worker.monitor_id, name, value, f.exception()))
+
+
+class WorkerPool(object):
+    """
+    所有显示器的 MonitorWorker, 第一次使用时创建
+    """
+    def __init__(self):
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def worker(self, phy_monitor) -> MonitorWorker:
+        """
+        :param phy_monitor: vcp.PhyMonitor()
+        :return: 这台显示器的 MonitorWorker
+        """
+        with self._lock:
+            worker = self._workers.get(id(phy_monitor))
+            if worker is None:
+                worker = self._workers[id(phy_monitor)] = MonitorWorker(phy_monitor)
+            return worker
+
+    def submit(self, phy_monitor, func, *args, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> Future:
+        return self.worker(phy_monitor).submit(func, *args, priority=priority, **kwargs)
+
+    def stats(self) -> dict:
+        """
+        :return: {monitor_id: MonitorWorker.stats()}
+        """
+        with self._lock:
+            workers = list(self._workers.values())
+        return {i.monitor_id: i.stats() for i in workers}
+
+    def stop(self, timeout: float = None):
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+        for worker in workers:
+            worker.stop(timeout)